@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark facit marker alignment on synthetic facit segments.
+
+Compares _find_marker_positions() in nmc_extract_safe_batch.py with the
+previous recursive memo search (kept here as the reference implementation)
+on segments with 10, 100 and 1000 items, and checks that both pick the same
+marker positions.
+
+Usage:
+    python scripts/nmc_bench_marker_alignment.py [--sizes 10 100 1000] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable, Dict, List, Tuple
+
+from nmc_extract_safe_batch import _find_marker_positions
+
+
+def reference_find_marker_positions(tokens: List[str], expected_count: int) -> List[int] | None:
+    marker_positions: Dict[int, List[int]] = {
+        marker: [idx for idx, token in enumerate(tokens) if token == str(marker)]
+        for marker in range(1, expected_count + 1)
+    }
+    if any(len(marker_positions[marker]) == 0 for marker in range(1, expected_count + 1)):
+        return None
+
+    memo: Dict[Tuple[int, int], Tuple[int, ...] | None] = {}
+
+    def solve(marker: int, previous_marker_idx: int) -> Tuple[int, ...] | None:
+        key = (marker, previous_marker_idx)
+        if key in memo:
+            return memo[key]
+
+        for pos in marker_positions[marker]:
+            if pos <= previous_marker_idx:
+                continue
+            if marker > 1 and pos <= previous_marker_idx + 1:
+                continue
+            if marker == expected_count:
+                if pos >= len(tokens) - 1:
+                    continue
+                memo[key] = (pos,)
+                return memo[key]
+
+            tail = solve(marker + 1, pos)
+            if tail is not None:
+                memo[key] = (pos,) + tail
+                return memo[key]
+
+        memo[key] = None
+        return None
+
+    solved = solve(1, -1)
+    if solved is None:
+        return None
+    return list(solved)
+
+
+def build_segment_tokens(item_count: int, rng: random.Random) -> List[str]:
+    """Numbered answers where some answers collide with later item markers."""
+    tokens: List[str] = ["Facit"]
+    for no in range(1, item_count + 1):
+        tokens.append(str(no))
+        answer_roll = rng.random()
+        if answer_roll < 0.2:
+            tokens.append(str(rng.randint(1, item_count)))
+        elif answer_roll < 0.3:
+            tokens.extend([str(rng.randint(1, 999)), "st"])
+        else:
+            tokens.append(f"{rng.randint(1, 9999)},{rng.randint(0, 99)}")
+    tokens.append("Kontrollera")
+    return tokens
+
+
+def time_call(func: Callable[[], object], repeat: int) -> Tuple[float, object]:
+    best = float("inf")
+    result: object = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=20260219)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'items':>6} {'tokens':>7} {'aligned ms':>11} {'reference ms':>13} {'same':>5}")
+    for size in args.sizes:
+        tokens = build_segment_tokens(size, rng)
+        aligned_s, aligned = time_call(lambda: _find_marker_positions(tokens, size), args.repeat)
+        try:
+            reference_s, reference = time_call(lambda: reference_find_marker_positions(tokens, size), args.repeat)
+            reference_ms = f"{reference_s * 1000:13.3f}"
+            same = "yes" if aligned == reference else "NO"
+        except RecursionError:
+            reference_ms = f"{'recursion':>13}"
+            same = "-"
+        print(f"{size:>6} {len(tokens):>7} {aligned_s * 1000:11.3f} {reference_ms} {same:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark gate for the parser and evaluator hot functions.
+
+Times normalize_text, parse_expression_items, parse_word_items,
+extract_facit_segment, _find_marker_positions, evaluate_expression,
+parse_decimal_text, parse_primary_numeric_from_text and format_decimal in
+nmc_extract_safe_batch.py on fixed text fixtures, and compares the result
+with a stored baseline. Exits with status 1 when a function is more than
+--max-slowdown percent and more than --noise-floor-us microseconds per call
+slower than its baseline.
+
+Fixtures live in scripts/nmc_bench_micro_fixtures.json. They are rebuilt from
+the rows in NMC/processed/safe_batch_*.json with --capture-fixtures, which
+turns each code's rows back into diagnos and facit text in the layout the PDFs
+use. Timings are stored relative to a fixed pure-Python calibration loop so a
+baseline recorded on one machine stays usable on another. Each sample calls a
+workload for at least MIN_SAMPLE_S, function and calibration samples
+alternate, and the gate uses the median ratio over all repeats, so one
+noisy sample neither passes nor fails a run. Functions over the limits are
+measured a second time and only fail the gate when they are over the limits
+in both measurements.
+
+Usage:
+    python scripts/nmc_bench_micro.py [--max-slowdown 25] [--noise-floor-us 5] [--repeat 15]
+    python scripts/nmc_bench_micro.py --update-baseline
+    python scripts/nmc_bench_micro.py --capture-fixtures
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import nmc_extract_safe_batch as extractor
+from nmc_extract_safe_batch import (
+    SAFE_BATCHES,
+    _find_marker_positions,
+    evaluate_expression,
+    evaluate_normalized_expression,
+    extract_facit_segment,
+    format_decimal,
+    normalize_text,
+    parse_decimal_text,
+    parse_expression_items,
+    parse_primary_numeric_from_text,
+    parse_word_items,
+)
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+FIXTURES_PATH = SCRIPT_DIR / "nmc_bench_micro_fixtures.json"
+BASELINE_PATH = SCRIPT_DIR / "nmc_bench_micro_baseline.json"
+FIXTURE_FORMAT = 1
+DEFAULT_MAX_SLOWDOWN_PCT = 25.0
+DEFAULT_NOISE_FLOOR_US = 5.0
+MIN_SAMPLE_S = 0.05
+
+# Text the real PDFs put around the numbered items; kept in the fixtures so
+# normalize_text and the tokenizer see ligatures, soft hyphens and page noise.
+DIAGNOS_HEADER = "Diagnos {code}\nNamn: ________ Klass: ____\nSkriv svaret på linjen. Beräkna i hu­vudet.\n"
+DIAGNOS_FOOTER = "\n© NCM, Göteborgs universitet – Diagnoser i matematik – ﬁnns på ncm.gu.se\n"
+FACIT_HEADER = "{code}\nFacit\n"
+FACIT_FOOTER = "\nKontrollera att eleven kan förklara sitt svar.\nStudera elevens lösningar.\n"
+
+
+def load_batch_rows(processed_dir: Path) -> Dict[str, Tuple[str, List[Dict[str, object]]]]:
+    """Rows per code from the safe batch outputs, with the batch parser mode."""
+    rows_by_code: Dict[str, Tuple[str, List[Dict[str, object]]]] = {}
+    for batch in SAFE_BATCHES:
+        path = processed_dir / f"{extractor.get_batch_file_stem(batch['name'])}.json"
+        if not path.exists():
+            continue
+        for row in json.loads(path.read_text(encoding="utf-8")):
+            rows_by_code.setdefault(str(row["ncm_code"]), (batch["parser"], []))[1].append(row)
+    return rows_by_code
+
+
+def build_fixtures(processed_dir: Path) -> Dict[str, object]:
+    codes: List[Dict[str, object]] = []
+    for code, (parser_mode, rows) in sorted(load_batch_rows(processed_dir).items()):
+        rows = sorted(rows, key=lambda row: int(row["item_no"]))
+        is_expression = parser_mode == "expression"
+        diagnos_lines = [DIAGNOS_HEADER.format(code=code)]
+        facit_lines = [FACIT_HEADER.format(code=code)]
+        for row in rows:
+            prefix = "Beräkna " if is_expression else ""
+            diagnos_lines.append(f"{row['item_no']} {prefix}{row['question_text']}\n   S var: ______________\n")
+            facit_lines.append(f"{row['item_no']} {row['expected_answer']}\n")
+        diagnos_lines.append(DIAGNOS_FOOTER)
+        facit_lines.append(FACIT_FOOTER)
+        codes.append(
+            {
+                "code": code,
+                "item_count": len(rows),
+                "diagnos_text": "".join(diagnos_lines),
+                "facit_text": "".join(facit_lines),
+                "questions": [str(row["question_text"]) for row in rows],
+                "answers": [str(row["expected_answer"]) for row in rows],
+            }
+        )
+    return {"format": FIXTURE_FORMAT, "source": "NMC/processed/safe_batch_*.json", "codes": codes}
+
+
+def load_fixtures(path: Path) -> Dict[str, object]:
+    fixtures = json.loads(path.read_text(encoding="utf-8"))
+    if fixtures.get("format") != FIXTURE_FORMAT:
+        raise SystemExit(f"Unsupported fixture format in {path}; rebuild with --capture-fixtures.")
+    return fixtures
+
+
+def build_workloads(fixtures: Dict[str, object]) -> Dict[str, Callable[[], object]]:
+    """One callable per benchmarked function, each covering every fixture once."""
+    codes = fixtures["codes"]
+    diagnos_raw = [entry["diagnos_text"] for entry in codes]
+    diagnos_clean = [normalize_text(text) for text in diagnos_raw]
+    facit_raw = [entry["facit_text"] for entry in codes]
+    facit_tokens = [
+        ([token for token in extract_facit_segment(text).split() if token], entry["item_count"])
+        for text, entry in zip(facit_raw, codes)
+    ]
+    questions = [question for entry in codes for question in entry["questions"]]
+    answers = [answer for entry in codes for answer in entry["answers"]]
+    decimals = [value for value in (parse_decimal_text(answer) for answer in answers) if value is not None]
+    decimals += [value / 8 for value in decimals]
+
+    def run_all(func: Callable[..., object], values: List[object]) -> Callable[[], object]:
+        def workload() -> object:
+            result = None
+            for value in values:
+                result = func(value)
+            return result
+
+        return workload
+
+    def evaluate_cold() -> object:
+        # evaluate_expression memoizes per expression; time the evaluation, not the cache.
+        evaluate_normalized_expression.cache_clear()
+        return run_all(evaluate_expression, questions)()
+
+    def align_all() -> object:
+        result = None
+        for tokens, count in facit_tokens:
+            result = _find_marker_positions(tokens, count)
+        return result
+
+    return {
+        "normalize_text": run_all(normalize_text, diagnos_raw + facit_raw),
+        "parse_expression_items": run_all(parse_expression_items, diagnos_clean),
+        "parse_word_items": run_all(parse_word_items, diagnos_clean),
+        "extract_facit_segment": run_all(extract_facit_segment, facit_raw),
+        "_find_marker_positions": align_all,
+        "evaluate_expression": evaluate_cold,
+        "parse_decimal_text": run_all(parse_decimal_text, answers),
+        "parse_primary_numeric_from_text": run_all(parse_primary_numeric_from_text, questions + answers),
+        "format_decimal": run_all(format_decimal, decimals),
+    }
+
+
+def calibration_workload() -> object:
+    """Fixed interpreter-bound loop used to normalise timings across machines."""
+    total = 0
+    parts: List[str] = []
+    for index in range(2000):
+        total += index * index % 7
+        parts.append(str(index))
+    return total, ",".join(parts).count("1"), Decimal(total) / 3
+
+
+def time_sample(workload: Callable[[], object]) -> float:
+    """Mean seconds per call over a loop of at least MIN_SAMPLE_S, with GC off like timeit."""
+    calls = 0
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while True:
+            workload()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= MIN_SAMPLE_S:
+                return elapsed / calls
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
+def time_against_calibration(workload: Callable[[], object], repeat: int) -> Tuple[float, float, float]:
+    """Median per-call microseconds for the workload and the calibration loop, and their median ratio.
+
+    Samples alternate between the two so a slow patch on a shared machine
+    affects both sides of the ratio instead of only one function.
+    """
+    workload()
+    calibration_workload()
+    samples = [(time_sample(workload), time_sample(calibration_workload)) for _ in range(repeat)]
+    return (
+        statistics.median(call for call, _ in samples) * 1_000_000,
+        statistics.median(calibration for _, calibration in samples) * 1_000_000,
+        statistics.median(call / calibration for call, calibration in samples),
+    )
+
+
+def measure(fixtures: Dict[str, object], repeat: int, only: List[str] | None) -> Dict[str, object]:
+    workloads = build_workloads(fixtures)
+    if only:
+        unknown = sorted(set(only) - set(workloads))
+        if unknown:
+            raise SystemExit(f"Unknown function(s): {', '.join(unknown)}")
+        workloads = {name: workload for name, workload in workloads.items() if name in only}
+
+    calibration_samples: List[float] = []
+    functions: Dict[str, Dict[str, float]] = {}
+    for name, workload in workloads.items():
+        call_us, calibration_us, relative = time_against_calibration(workload, repeat)
+        calibration_samples.append(calibration_us)
+        functions[name] = {"us": round(call_us, 3), "relative": round(relative, 5)}
+    return {"calibration_us": round(statistics.median(calibration_samples), 3), "functions": functions}
+
+
+def compare(
+    current: Dict[str, object],
+    baseline: Dict[str, object],
+    max_slowdown_pct: float,
+    noise_floor_us: float = DEFAULT_NOISE_FLOOR_US,
+) -> Dict[str, str]:
+    """Functions slower than the baseline by more than max_slowdown_pct and noise_floor_us per call.
+
+    The absolute slowdown is the change in relative time scaled by this
+    run's calibration loop, so it is in this machine's microseconds.
+    """
+    regressions: Dict[str, str] = {}
+    baseline_functions = baseline.get("functions", {})
+    print(f"{'function':<33} {'baseline':>10} {'current':>10} {'change':>9}")
+    for name, result in current["functions"].items():
+        reference = baseline_functions.get(name)
+        if not reference:
+            print(f"{name:<33} {'-':>10} {result['relative']:>10.4f} {'new':>9}")
+            continue
+        change_pct = (result["relative"] / reference["relative"] - 1) * 100
+        change_us = (result["relative"] - reference["relative"]) * current["calibration_us"]
+        flag = ""
+        if change_pct > max_slowdown_pct and change_us > noise_floor_us:
+            flag = "  SLOWER"
+            regressions[name] = (
+                f"{name}: {change_pct:+.1f}%, {change_us:+.1f} us/call "
+                f"(limits {max_slowdown_pct:.0f}%, {noise_floor_us:g} us)"
+            )
+        print(f"{name:<33} {reference['relative']:>10.4f} {result['relative']:>10.4f} {change_pct:>+8.1f}%{flag}")
+    return regressions
+
+
+def load_baseline(path: Path) -> Dict[str, object]:
+    if not path.exists():
+        return {"functions": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_json(path: Path, payload: Dict[str, object]) -> None:
+    path.write_text(json.dumps(payload, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", type=Path, default=FIXTURES_PATH)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--max-slowdown", type=float, default=DEFAULT_MAX_SLOWDOWN_PCT, metavar="PCT")
+    parser.add_argument(
+        "--noise-floor-us",
+        type=float,
+        default=DEFAULT_NOISE_FLOOR_US,
+        metavar="US",
+        help="Ignore slowdowns of at most this many microseconds per call.",
+    )
+    parser.add_argument("--repeat", type=int, default=15)
+    parser.add_argument("--only", nargs="+", metavar="FUNCTION", help="Benchmark only these functions.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline.")
+    parser.add_argument(
+        "--capture-fixtures",
+        action="store_true",
+        help="Rebuild the fixture file from NMC/processed and exit.",
+    )
+    args = parser.parse_args()
+    if args.max_slowdown < 0:
+        parser.error("--max-slowdown must be zero or positive")
+    if args.noise_floor_us < 0:
+        parser.error("--noise-floor-us must be zero or positive")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    if args.capture_fixtures:
+        fixtures = build_fixtures(extractor.OUT_DIR)
+        if not fixtures["codes"]:
+            raise SystemExit(f"No safe batch rows found in {extractor.OUT_DIR}.")
+        write_json(args.fixtures, fixtures)
+        print(f"Wrote {len(fixtures['codes'])} code fixtures to {args.fixtures}")
+        return 0
+
+    fixtures = load_fixtures(args.fixtures)
+    current = measure(fixtures, args.repeat, args.only)
+
+    if args.update_baseline:
+        baseline = load_baseline(args.baseline) if args.only else {"functions": {}}
+        baseline["functions"].update(current["functions"])
+        baseline.update(
+            {
+                "recorded_at_utc": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "calibration_us": current["calibration_us"],
+            }
+        )
+        write_json(args.baseline, dict(sorted(baseline.items())))
+        print(f"Updated baseline: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        raise SystemExit(f"No baseline at {args.baseline}; run with --update-baseline first.")
+    baseline = load_baseline(args.baseline)
+    regressions = compare(current, baseline, args.max_slowdown, args.noise_floor_us)
+    if regressions:
+        # A real slowdown shows up again; a noisy first measurement rarely does twice.
+        print(f"\nRe-measuring {len(regressions)} flagged function(s):")
+        retried = measure(fixtures, args.repeat, list(regressions))
+        regressions = compare(retried, baseline, args.max_slowdown, args.noise_floor_us)
+    if regressions:
+        print("\nSlower than baseline:")
+        for line in regressions.values():
+            print(f"- {line}")
+        return 1
+    print(f"\nAll functions within {args.max_slowdown:.0f}% of baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
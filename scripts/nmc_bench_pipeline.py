@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+End-to-end scaling benchmark for nmc_extract_safe_batch.py on synthetic NMC corpora.
+
+Generates diagnos/facit PDF pairs with pypdf's writer in the layout the parsers
+expect (`<n> Beräkna ... S var:` items, a `Facit` section with numbered answers
+followed by a `Kontrollera` heading), then runs the extractor as a subprocess
+on each corpus size: the full pipeline cold and warm, and each stage alone.
+
+Every run records wall time, peak RSS of the extractor process, rows/sec and
+the per-stage totals from the batch reports. Corpora are generated from a
+fixed seed and cached under the work directory, so result files from
+different commits are comparable.
+
+Usage:
+    python scripts/nmc_bench_pipeline.py --sizes 10 100 1000 --output bench_pipeline.json
+    python scripts/nmc_bench_pipeline.py --sizes 100 --baseline bench_pipeline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from nmc_extract_safe_batch import SAFE_BATCHES
+
+SCRIPT = Path(__file__).resolve().parent / "nmc_extract_safe_batch.py"
+ROOT = Path(__file__).resolve().parents[1]
+FILLER_PREFIXES = ["AG", "AUN", "AUP", "RB", "RD", "RP", "GFO", "M", "ST", "TA"]
+RUN_MODES = {
+    "full_cold": ["--rebuild-cache"],
+    "full_warm": [],
+    "batches_only": ["--batches-only", "--no-cache"],
+    "screen_only": ["--screen-only", "--no-cache"],
+    "mapping_only": ["--mapping-only"],
+}
+
+
+def _escape_pdf_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(path: Path, pages: Sequence[Sequence[str]]) -> None:
+    """Write a PDF whose pages contain the given lines in Helvetica."""
+    writer = PdfWriter()
+    font = DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+            NameObject("/Encoding"): NameObject("/WinAnsiEncoding"),
+        }
+    )
+    font_ref = writer._add_object(font)
+    for lines in pages:
+        page = writer.add_blank_page(595, 842)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font_ref})}
+        )
+        operations = ["BT", "/F1 11 Tf", "14 TL", "50 800 Td"]
+        operations.extend(f"({_escape_pdf_text(line)}) Tj T*" for line in lines)
+        operations.append("ET")
+        stream = DecodedStreamObject()
+        stream.set_data("\n".join(operations).encode("cp1252"))
+        page[NameObject("/Contents")] = writer._add_object(stream)
+    with path.open("wb") as handle:
+        writer.write(handle)
+
+
+def build_code_content(parser_mode: str, rng: random.Random) -> tuple[List[str], List[str]]:
+    """Diagnos item lines and facit answers for one synthetic code."""
+    item_count = rng.randint(4, 12)
+    items: List[str] = []
+    answers: List[str] = []
+    for no in range(1, item_count + 1):
+        if parser_mode == "expression":
+            left = rng.randint(10, 999)
+            right = rng.randint(2, 99)
+            op = rng.choice(["+", "-", "·"])
+            value = left + right if op == "+" else left - right if op == "-" else left * right
+            items.append(f"{no} Beräkna {left} {op} {right}  S var: ________")
+            answers.append(str(value))
+        else:
+            count = rng.randint(2, 60)
+            extra = rng.randint(1, 40)
+            items.append(f"{no} Lisa har {count} kulor och får {extra} till. Hur många har hon nu?  S var: ______")
+            answers.append(f"{count + extra} kulor")
+    return items, answers
+
+
+def generate_corpus(nmc_dir: Path, filler_codes: int, seed: int) -> int:
+    """Write the SAFE_BATCHES codes plus filler codes; returns the number of pairs."""
+    nmc_dir.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    codes: List[tuple[str, str]] = []
+    for batch in SAFE_BATCHES:
+        codes.extend((str(code), str(batch["parser"])) for code in batch["codes"])
+    for index in range(filler_codes):
+        prefix = FILLER_PREFIXES[index % len(FILLER_PREFIXES)]
+        codes.append((f"{prefix}{100 + index}", "expression" if index % 2 == 0 else "word"))
+
+    for code, parser_mode in codes:
+        items, answers = build_code_content(parser_mode, rng)
+        header = [f"Diagnos {code}", "Namn: ____________  Klass: ____"]
+        split = max(1, len(items) // 2)
+        write_text_pdf(nmc_dir / f"{code}%20diagnos.pdf", [header + items[:split], items[split:]])
+        facit_lines = ["Facit"] + [f"{no} {answer}" for no, answer in enumerate(answers, start=1)]
+        write_text_pdf(
+            nmc_dir / f"{code}%20facit.pdf",
+            [facit_lines, ["Kontrollera", "att eleven kan förklara steg 1 och 2."]],
+        )
+    return len(codes)
+
+
+def run_extractor(nmc_dir: Path, out_dir: Path, extra_args: Sequence[str], jobs: int) -> Dict[str, object]:
+    command = [
+        sys.executable,
+        str(SCRIPT),
+        "--nmc-dir",
+        str(nmc_dir),
+        "--out-dir",
+        str(out_dir),
+        "--jobs",
+        str(jobs),
+        *extra_args,
+    ]
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdout=stdout_file, stderr=stderr_file)
+        # wait4 gives this child's own rusage, so peak RSS is not mixed with earlier runs.
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_s = time.perf_counter() - started
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout = stdout_file.read().decode("utf-8", "replace")
+        stderr = stderr_file.read().decode("utf-8", "replace")
+
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0:
+        raise RuntimeError(f"Extractor failed ({exit_code}): {stderr.strip() or stdout.strip()}")
+
+    peak_rss_kb = usage.ru_maxrss if sys.platform != "darwin" else usage.ru_maxrss // 1024
+    return {"wall_s": round(wall_s, 4), "peak_rss_kb": int(peak_rss_kb), "stdout": stdout.strip()}
+
+
+def collect_output_stats(out_dir: Path) -> Dict[str, object]:
+    rows = 0
+    stages: Dict[str, Dict[str, float]] = {}
+    for report_path in sorted(out_dir.glob("safe_batch_*_report.json")):
+        if report_path.name == "safe_batch_parse_report.json":
+            continue
+        report = json.loads(report_path.read_text(encoding="utf-8"))
+        rows += int(report.get("total_rows", 0))
+        for name, record in dict(report.get("metrics", {}).get("stages", {})).items():
+            total = stages.setdefault(name, {"wall_ms": 0.0, "chars": 0, "items": 0})
+            for key in total:
+                total[key] += float(record.get(key, 0))
+
+    screening_path = out_dir / "safe_candidate_screening.json"
+    if screening_path.exists():
+        screening = json.loads(screening_path.read_text(encoding="utf-8"))
+        for row in screening.get("rows", []):
+            rows += int(row.get("item_count", 0))
+        for name, record in dict(screening.get("metrics", {}).get("stages", {})).items():
+            total = stages.setdefault(name, {"wall_ms": 0.0, "chars": 0, "items": 0})
+            for key in total:
+                total[key] += float(record.get(key, 0))
+    return {"rows": rows, "stages": {name: {k: round(v, 3) for k, v in record.items()} for name, record in stages.items()}}
+
+
+def clear_outputs(out_dir: Path, keep_cache: bool) -> None:
+    if not out_dir.exists():
+        return
+    for entry in out_dir.iterdir():
+        if keep_cache and entry.name == ".cache":
+            continue
+        if entry.is_dir():
+            shutil.rmtree(entry)
+        else:
+            entry.unlink()
+
+
+def environment_info() -> Dict[str, object]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=False
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    try:
+        from importlib import metadata
+
+        pypdf_version = metadata.version("pypdf")
+    except Exception:  # pragma: no cover
+        pypdf_version = "unknown"
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pypdf": pypdf_version,
+        "git_commit": commit,
+    }
+
+
+def print_comparison(results: Dict[str, object], baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    previous = {(run["size"], run["mode"]): run for run in baseline.get("runs", [])}
+    print(f"\nCompared with {baseline_path} ({baseline.get('environment', {}).get('git_commit', '?')}):")
+    for run in results["runs"]:
+        before = previous.get((run["size"], run["mode"]))
+        if not before or not before.get("wall_s"):
+            continue
+        ratio = float(run["wall_s"]) / float(before["wall_s"])
+        print(f"  {run['size']:>6} {run['mode']:<13} {before['wall_s']:>8.3f}s -> {run['wall_s']:>8.3f}s ({ratio:5.2f}x)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Scaling benchmark for the NMC extraction pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Filler code pairs per corpus.")
+    parser.add_argument("--modes", nargs="+", choices=sorted(RUN_MODES), default=list(RUN_MODES))
+    parser.add_argument("--jobs", type=int, default=1, help="Passed through to the extractor.")
+    parser.add_argument("--seed", type=int, default=20260219)
+    parser.add_argument("--work-dir", type=Path, default=Path(tempfile.gettempdir()) / "nmc_bench_pipeline")
+    parser.add_argument("--output", type=Path, default=Path("nmc_bench_pipeline_results.json"))
+    parser.add_argument("--baseline", type=Path, help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    runs: List[Dict[str, object]] = []
+    for size in args.sizes:
+        corpus_dir = args.work_dir / f"corpus_{size}_{args.seed}"
+        nmc_dir = corpus_dir / "NMC"
+        if not (corpus_dir / ".complete").exists():
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+            started = time.perf_counter()
+            pairs = generate_corpus(nmc_dir, size, args.seed)
+            (corpus_dir / ".complete").write_text(str(pairs), encoding="utf-8")
+            print(f"Generated {pairs} pairs in {time.perf_counter() - started:.1f}s at {nmc_dir}")
+        pairs = int((corpus_dir / ".complete").read_text(encoding="utf-8"))
+
+        out_dir = corpus_dir / "processed"
+        shutil.rmtree(out_dir, ignore_errors=True)
+        for mode in args.modes:
+            # Every run starts from empty outputs; the warm run keeps only the text cache.
+            clear_outputs(out_dir, keep_cache=mode == "full_warm")
+            measured = run_extractor(nmc_dir, out_dir, RUN_MODES[mode], args.jobs)
+            stats = collect_output_stats(out_dir)
+            wall_s = float(measured["wall_s"])
+            run = {
+                "size": size,
+                "pairs": pairs,
+                "mode": mode,
+                "wall_s": wall_s,
+                "peak_rss_kb": measured["peak_rss_kb"],
+                "rows": stats["rows"],
+                "rows_per_s": round(stats["rows"] / wall_s, 1) if wall_s > 0 and stats["rows"] else 0.0,
+                "stages": stats["stages"],
+            }
+            runs.append(run)
+            print(
+                f"{size:>6} pairs={pairs:<6} {mode:<13} {wall_s:8.3f}s "
+                f"rss={run['peak_rss_kb'] / 1024:7.1f}MB rows/s={run['rows_per_s']}"
+            )
+
+    results = {
+        "generated_at_utc": datetime.now(timezone.utc).isoformat(),
+        "seed": args.seed,
+        "jobs": args.jobs,
+        "environment": environment_info(),
+        "runs": runs,
+    }
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,28 +15,153 @@ Outputs (per batch):
 
 Additional outputs:
 - NMC/processed/safe_candidate_screening.json
+- NMC/processed/candidate_batch_<parser>.json/.csv/_report.json (--promote-candidates;
+  removed again by screening runs without it)
 - NMC/processed/ncm_code_skill_map.json
 - NMC/processed/ncm_code_skill_map.csv
+- NMC/processed/ncm_problem_index.json
+- NMC/processed/ncm_problem_bank.json
+- NMC/processed/shards/<code>.json and shards/manifest.json
+- NMC/processed/ncm_answer_verification.json
 - NMC/processed/IMPORT_LOG.md
+
+ncm_problem_index.json gives every batch row a stable id (by code and item
+number, kept across runs and never reused) and sorted posting lists per code,
+ability tag, domain and operation, so src/lib/ncmProblemBank.js can intersect
+lists instead of scanning the whole bank. ncm_problem_bank.json holds the
+bank entries src/lib/ncmProblemBank.js loads as is (answer, operands, type,
+level, magnitude, time estimate and skill tag derived at build time).
+NMC/processed/shards/<code>.json hold the same entries per NCM code, and
+shards/manifest.json their entry counts and tags, so
+src/lib/ncmProblemShards.js can load only the codes an assignment needs.
+
+Outputs are written via temp file + os.replace and only when their bytes
+change. Reports are also left alone when only run fields (generated_at_utc,
+metrics, cache counters) differ, so a no-op run does not touch files that
+the frontend imports; their metrics and cache counters are those of the run
+that last changed the report. NMC/processed/last_run.json (not committed) is
+rewritten by every extraction run with its own cache counters and metrics
+per batch and for the whole run.
+
+NMC/processed/extract_manifest.json records the input hashes, parser mode,
+mapping fingerprint and script version per code. With --incremental only
+codes whose record changed are re-extracted and only affected outputs are
+rewritten.
+
+A SAFE_BATCHES code whose PDFs fail to extract or time out keeps its rows
+from the previous batch files, is listed under failed_codes in the batch
+report and makes the run exit with status 1. Screening reports such codes as
+processing_error/timeout rows instead. A run that finds no PDFs in NMC/
+stops before writing anything.
+
+Extracted PDF text is cached per page under NMC/processed/.cache/pdf_text/,
+keyed by the PDF content hash and the extractor version. Use --no-cache to
+bypass the cache or --rebuild-cache to re-extract every PDF.
+
+--mapping-only, --screen-only and --batches-only run a single stage; pypdf
+is only imported when a PDF actually has to be extracted, so --mapping-only
+is fast enough for a pre-commit hook. IMPORT_LOG.md is appended only by
+runs that cover all stages.
+
+--watch keeps the script running after the first (incremental) run. It
+polls NMC/*.pdf by size and mtime, waits until a changed file has settled and
+then reruns incrementally, so only the codes whose PDFs changed are
+re-extracted; each update rewrites the watch session's IMPORT_LOG.md section.
+
+NMC/processed/.cache/text_index.json is an inverted index (token -> code,
+kind, page, offset) over the normalized PDF texts, kept by nmc_text_index.py.
+Runs drop changed PDFs from it and index the texts they loaded or find in the
+text cache; the query subcommand indexes any other new or changed PDFs and
+answers term, phrase and regex queries from it, e.g. `query Beräkna --not "S var:"`.
+
+The serve subcommand (nmc_extract_service.py) keeps the corpus index and
+extracted texts in memory and answers local HTTP requests (extract/screen a
+code, rebuild a batch, look up a mapping) without a new process per request.
+
+Each finished code is checkpointed under NMC/processed/.checkpoints/ (rows
+and report fragment, tagged with the code's manifest record). If a run is
+interrupted, --resume reuses those codes and only processes the rest; the
+batch files are assembled from the checkpoints. A completed run removes them.
+
+PDF text extraction runs in a child process with a wall-clock limit
+(--pdf-timeout) and an address-space cap (--pdf-memory-mb). A PDF that hits
+either limit yields a timeout/processing_error report for its code, with the
+time spent, instead of stalling the run. Facit PDFs are decoded page by page
+and only up to the heading that ends the Facit segment. PDFs are read through
+a read-only mmap that serves both the content hash and pypdf.
+
+With --sqlite the same data is also kept in NMC/processed/ncm_items.sqlite
+(tables items, codes, ability_tags, screening), upserted per code so an
+incremental run only touches the codes it re-extracted.
 """
 
 from __future__ import annotations
 
+import argparse
+import bisect
 import csv
+import functools
+import hashlib
+import io
 import json
+import math
+import mmap
+import os
 import re
-from dataclasses import asdict, dataclass
+import shutil
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime, timezone
-from decimal import Decimal, InvalidOperation
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from fractions import Fraction
+from concurrent.futures import Executor
 from pathlib import Path
-from typing import Dict, List, Tuple
-
-from pypdf import PdfReader
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Set, TextIO, Tuple, TypeVar
 
 
 ROOT = Path(__file__).resolve().parents[1]
 NMC_DIR = ROOT / "NMC"
 OUT_DIR = NMC_DIR / "processed"
+MANIFEST_NAME = "extract_manifest.json"
+RUN_REPORT_NAME = "last_run.json"
+CHECKPOINT_DIR_NAME = ".checkpoints"
+SQLITE_NAME = "ncm_items.sqlite"
+PROBLEM_INDEX_NAME = "ncm_problem_index.json"
+PROBLEM_INDEX_VERSION = 1
+PROBLEM_BANK_NAME = "ncm_problem_bank.json"
+SHARD_DIR_NAME = "shards"
+SHARD_MANIFEST_NAME = "manifest.json"
+SHARD_MANIFEST_VERSION = 1
+ANSWER_VERIFICATION_NAME = "ncm_answer_verification.json"
+CANDIDATE_BATCH_PREFIX = "candidate_"
+CANDIDATE_PARSERS = ("expression", "word")
+
+# Bump when the ncm_items.sqlite schema changes; an older store is rebuilt.
+ITEM_STORE_SCHEMA_VERSION = "1"
+
+ALL_STAGES = ("batches", "screening", "mapping")
+
+# Report keys that describe the run rather than the extracted content. A report
+# whose other content is unchanged is left untouched on disk.
+VOLATILE_REPORT_KEYS = frozenset({"generated_at_utc", "metrics", "pdf_text_cache"})
+
+# Report reasons for codes whose extraction failed; they are never checkpointed.
+FAILED_REASONS = frozenset({"processing_error", "timeout"})
+
+# Number of codes listed in the "slowest codes" tables of reports and IMPORT_LOG.md.
+SLOWEST_CODES_LIMIT = 10
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+# Receives a lazy page iterator and yields the pages worth keeping; it may stop
+# early, in which case the remaining pages are never decoded.
+PageFilter = Callable[[Iterable[str]], Iterator[str]]
+
+# Bump when the page text extraction changes so cached text is re-extracted.
+PDF_TEXT_EXTRACTOR_VERSION = "page-text-v1"
 
 SAFE_BATCHES = [
     {
@@ -161,7 +286,7 @@ PREFIX_RULES = [
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class ItemRow:
     ncm_code: str
     item_no: int
@@ -186,12 +311,464 @@ class BatchSummary:
     per_code: List[Dict[str, object]]
 
 
-def read_pdf_text(path: Path) -> str:
-    reader = PdfReader(str(path))
-    text_parts: List[str] = []
-    for page in reader.pages:
-        text_parts.append(page.extract_text() or "")
-    return "\n".join(text_parts)
+class StageTimer:
+    """Wall time, pages, characters and items per pipeline stage."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, float]]:
+        record = self.stages.setdefault(name, {"wall_ms": 0.0, "pages": 0, "chars": 0, "items": 0})
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["wall_ms"] += (time.perf_counter() - started) * 1000
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages": {name: round_stage(record) for name, record in self.stages.items()},
+        }
+
+
+def round_stage(record: Dict[str, float]) -> Dict[str, object]:
+    rounded: Dict[str, object] = {
+        "wall_ms": round(float(record.get("wall_ms", 0.0)), 3),
+        "pages": int(record.get("pages", 0)),
+        "chars": int(record.get("chars", 0)),
+        "items": int(record.get("items", 0)),
+    }
+    wall_s = float(record.get("wall_ms", 0.0)) / 1000
+    if rounded["chars"] and wall_s > 0:
+        rounded["chars_per_s"] = round(rounded["chars"] / wall_s)
+    return rounded
+
+
+def summarize_metrics(
+    entries: Iterable[Tuple[str, str, Dict[str, object]]],
+    extra_stages: Iterable[Dict[str, Dict[str, object]]] = (),
+    limit: int = SLOWEST_CODES_LIMIT,
+) -> Dict[str, object]:
+    """Stage totals and the slowest codes from (code, source, metrics) entries.
+
+    extra_stages are added to the stage totals without counting as codes.
+    """
+    totals: Dict[str, Dict[str, float]] = {}
+
+    def add_stages(stages: Dict[str, Dict[str, object]]) -> None:
+        for name, record in stages.items():
+            total = totals.setdefault(name, {"wall_ms": 0.0, "pages": 0, "chars": 0, "items": 0})
+            for key in total:
+                total[key] += float(record.get(key, 0))
+
+    timed_codes: List[Dict[str, object]] = []
+    for code, source, metrics in entries:
+        if not isinstance(metrics, dict):
+            continue
+        add_stages(dict(metrics.get("stages", {})))
+        timed_codes.append({"code": code, "source": source, "total_ms": float(metrics.get("total_ms", 0.0))})
+
+    for stages in extra_stages:
+        add_stages(stages)
+
+    timed_codes.sort(key=lambda entry: (-float(entry["total_ms"]), str(entry["code"])))
+    return {
+        "total_ms": round(sum(float(entry["total_ms"]) for entry in timed_codes), 3),
+        "stages": {name: round_stage(record) for name, record in totals.items()},
+        "slowest_codes": timed_codes[:limit],
+    }
+
+
+def get_extractor_version() -> str:
+    from importlib import metadata
+
+    try:
+        pypdf_version = metadata.version("pypdf")
+    except metadata.PackageNotFoundError:
+        pypdf_version = "unknown"
+    return f"{PDF_TEXT_EXTRACTOR_VERSION}+pypdf-{pypdf_version}"
+
+
+class MappedFile:
+    """Read-only mmap of a file, opened on first use.
+
+    The same mapping serves the sha256 cache key and pypdf, so a PDF that is
+    hashed and parsed is read once, without copying it into Python buffers.
+    Empty files (which cannot be mapped) give b"".
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._handle = None
+        self._buffer: mmap.mmap | bytes | None = None
+
+    def buffer(self) -> mmap.mmap | bytes:
+        if self._buffer is None:
+            self._handle = self.path.open("rb")
+            try:
+                self._buffer = mmap.mmap(self._handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self._buffer = b""
+        return self._buffer
+
+    def sha256(self) -> str:
+        return hashlib.sha256(self.buffer()).hexdigest()
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._handle is not None:
+            self._handle.close()
+        self._buffer = None
+        self._handle = None
+
+    def __enter__(self) -> "MappedFile":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def hash_file(path: Path) -> str:
+    with MappedFile(path) as mapped:
+        return mapped.sha256()
+
+
+@contextmanager
+def atomic_output(path: Path, encoding: str = "utf-8", newline: str | None = None) -> Iterator[TextIO]:
+    """Write through a temp file that replaces path only if the bytes differ.
+
+    Readers such as the Vite dev server never see a half-written file, and an
+    identical rewrite leaves the existing file (and its mtime) untouched.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with tmp_path.open("w", encoding=encoding, newline=newline) as handle:
+            yield handle
+        if (
+            path.exists()
+            and path.stat().st_size == tmp_path.stat().st_size
+            and hash_file(path) == hash_file(tmp_path)
+        ):
+            tmp_path.unlink()
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def remove_orphaned_temp_files(directory: Path) -> int:
+    """Delete atomic_output temp files left behind by a killed run."""
+    removed = 0
+    for tmp_path in directory.glob(".*.tmp"):
+        pid_text = tmp_path.name.rsplit(".", 2)[-2]
+        if not pid_text.isdigit() or int(pid_text) == os.getpid():
+            continue
+        try:
+            os.kill(int(pid_text), 0)
+            continue
+        except ProcessLookupError:
+            pass
+        except OSError:
+            continue
+        tmp_path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+
+def strip_volatile(value: object, keys: frozenset = VOLATILE_REPORT_KEYS) -> object:
+    if isinstance(value, dict):
+        return {key: strip_volatile(item, keys) for key, item in value.items() if key not in keys}
+    if isinstance(value, list):
+        return [strip_volatile(item, keys) for item in value]
+    return value
+
+
+def write_json_report(path: Path, payload: Dict[str, object]) -> bool:
+    """Write a JSON report unless only its volatile run fields would change."""
+    try:
+        with path.open("r", encoding="utf-8") as handle:
+            existing = json.load(handle)
+    except (OSError, ValueError):
+        existing = None
+    if existing is not None and strip_volatile(existing) == strip_volatile(payload):
+        return False
+    with atomic_output(path) as handle:
+        json.dump(payload, handle, ensure_ascii=False, indent=2)
+    return True
+
+
+class PdfExtractionError(RuntimeError):
+    """Text extraction failed in the isolated worker (error, crash or memory cap)."""
+
+
+class PdfExtractionTimeout(PdfExtractionError):
+    """Text extraction ran longer than the configured wall-clock limit."""
+
+
+@dataclass(frozen=True)
+class PdfExtractionLimits:
+    """Limits for one PDF extraction; 0 disables a limit, both 0 runs in-process."""
+
+    timeout_s: float = 120.0
+    memory_mb: int = 2048
+
+    @property
+    def isolated(self) -> bool:
+        return self.timeout_s > 0 or self.memory_mb > 0
+
+
+class PdfTextCache:
+    """Per-page PDF text cache keyed by content hash and extractor version.
+
+    mode is "use" (read and write entries), "rebuild" (ignore existing entries
+    but write fresh ones) or "off" (bypass the cache entirely). Misses are
+    extracted under limits.
+    """
+
+    def __init__(self, cache_dir: Path, mode: str = "use", limits: PdfExtractionLimits | None = None) -> None:
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.limits = limits
+        self.extractor_version = get_extractor_version()
+        self.version_tag = hashlib.sha256(self.extractor_version.encode("utf-8")).hexdigest()[:12]
+        self.hits = 0
+        self.misses = 0
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def content_hash(self, path: Path, mapped: MappedFile | None = None) -> str:
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        cached = self._hashes.get(key)
+        if cached is None:
+            cached = mapped.sha256() if mapped is not None else hash_file(path)
+            self._hashes[key] = cached
+        return cached
+
+    def entry_path(self, content_hash: str) -> Path:
+        return self.cache_dir / f"{content_hash}.{self.version_tag}.json"
+
+    def read_pages(self, path: Path, until: PageFilter | None = None) -> List[str]:
+        """Page texts of path, or only the pages `until` keeps.
+
+        An entry cached from an early-stopped read only serves later reads
+        with the same filter; a complete entry serves every read.
+        """
+        with MappedFile(path) as mapped:
+            if not self.enabled:
+                return self.extract(path, until, mapped)[0]
+
+            entry_path = self.entry_path(self.content_hash(path, mapped))
+            if self.mode == "use":
+                pages = self.cached_pages(path, until, mapped)
+                if pages is not None:
+                    self.hits += 1
+                    return pages
+
+            self.misses += 1
+            pages, complete = self.extract(path, until, mapped)
+        self._store_entry(entry_path, path, pages, None if complete or until is None else until.__name__)
+        return pages
+
+    def cached_pages(
+        self,
+        path: Path,
+        until: PageFilter | None = None,
+        mapped: MappedFile | None = None,
+    ) -> List[str] | None:
+        """What read_pages() would return from an existing entry, or None; never extracts."""
+        if not self.enabled:
+            return None
+        entry = self._load_entry(self.entry_path(self.content_hash(path, mapped)))
+        if entry is None:
+            return None
+        pages, page_filter = entry
+        if page_filter is None:
+            return pages if until is None else list(until(pages))
+        if until is not None and page_filter == until.__name__:
+            return pages
+        return None
+
+    def extract(
+        self,
+        path: Path,
+        until: PageFilter | None = None,
+        mapped: MappedFile | None = None,
+    ) -> Tuple[List[str], bool]:
+        if self.limits is not None and self.limits.isolated:
+            return extract_pdf_pages_isolated(path, self.limits, until, mapped)
+        return extract_pdf_page_prefix(path, until, mapped.buffer() if mapped is not None else None)
+
+    def _load_entry(self, entry_path: Path) -> Tuple[List[str], str | None] | None:
+        try:
+            with entry_path.open("r", encoding="utf-8") as handle:
+                payload = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if payload.get("extractor_version") != self.extractor_version:
+            return None
+        pages = payload.get("pages")
+        if not isinstance(pages, list):
+            return None
+        page_filter = payload.get("page_filter")
+        return [str(page) for page in pages], str(page_filter) if page_filter else None
+
+    def _store_entry(self, entry_path: Path, source: Path, pages: List[str], page_filter: str | None = None) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        payload: Dict[str, object] = {
+            "extractor_version": self.extractor_version,
+            "source_pdf": source.name,
+            "pages": pages,
+        }
+        if page_filter is not None:
+            payload["page_filter"] = page_filter
+        tmp_path = entry_path.with_name(f"{entry_path.name}.{os.getpid()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as handle:
+            json.dump(payload, handle, ensure_ascii=False)
+        os.replace(tmp_path, entry_path)
+
+    def snapshot(self) -> Tuple[int, int]:
+        return self.hits, self.misses
+
+    def stats_since(self, snapshot: Tuple[int, int]) -> Dict[str, object]:
+        return {
+            "mode": self.mode,
+            "hits": self.hits - snapshot[0],
+            "misses": self.misses - snapshot[1],
+        }
+
+    def remember_hash(self, path: Path, size: int, mtime_ns: int, content_hash: str) -> None:
+        self._hashes[(str(path), size, mtime_ns)] = content_hash
+
+    def evict_stale(self, live_hashes: Iterable[str]) -> int:
+        """Remove entries that no longer match a current PDF or extractor version."""
+        if not self.enabled or not self.cache_dir.exists():
+            return 0
+        live_names = {self.entry_path(content_hash).name for content_hash in live_hashes}
+        removed = 0
+        for entry in self.cache_dir.iterdir():
+            if entry.name in live_names:
+                continue
+            entry.unlink()
+            removed += 1
+        return removed
+
+
+def iter_pdf_pages(path: Path, buffer: mmap.mmap | bytes | None = None) -> Iterator[str]:
+    """Page texts of path, decoding each page only when it is requested.
+
+    pypdf reads from buffer (a mapping of path) when given, otherwise from a
+    mapping opened here.
+    """
+    # Imported lazily so mapping-only runs and cache hits never load pypdf.
+    from pypdf import PdfReader
+
+    with ExitStack() as stack:
+        if buffer is None:
+            buffer = stack.enter_context(MappedFile(path)).buffer()
+        reader = PdfReader(buffer if isinstance(buffer, mmap.mmap) else io.BytesIO(buffer))
+        for page in reader.pages:
+            yield page.extract_text() or ""
+
+
+def extract_pdf_pages(path: Path, buffer: mmap.mmap | bytes | None = None) -> List[str]:
+    return list(iter_pdf_pages(path, buffer))
+
+
+def extract_pdf_page_prefix(
+    path: Path,
+    until: PageFilter | None = None,
+    buffer: mmap.mmap | bytes | None = None,
+) -> Tuple[List[str], bool]:
+    """Pages kept by until (all pages without it) and whether every page was read."""
+    if until is None:
+        return extract_pdf_pages(path, buffer), True
+    exhausted: List[bool] = []
+
+    def source() -> Iterator[str]:
+        yield from iter_pdf_pages(path, buffer)
+        exhausted.append(True)
+
+    pages = list(until(source()))
+    return pages, bool(exhausted)
+
+
+def _extract_pages_in_child(
+    path: str,
+    memory_mb: int,
+    until: PageFilter | None,
+    buffer: mmap.mmap | bytes | None,
+    conn,
+) -> None:
+    if memory_mb > 0:
+        try:
+            import resource
+
+            limit = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass  # no RLIMIT_AS on this platform; the timeout still applies
+    try:
+        conn.send(("ok", extract_pdf_page_prefix(Path(path), until, buffer)))
+    except BaseException as error:
+        conn.send(("error", f"{type(error).__name__}: {error}"))
+    finally:
+        conn.close()
+
+
+def extract_pdf_pages_isolated(
+    path: Path,
+    limits: PdfExtractionLimits,
+    until: PageFilter | None = None,
+    mapped: MappedFile | None = None,
+) -> Tuple[List[str], bool]:
+    """extract_pdf_page_prefix() in a supervised child process.
+
+    The child runs under RLIMIT_AS and is killed once limits.timeout_s has
+    passed, so a PDF that makes pypdf spin or balloon only costs that code.
+    A forked child parses the parent's mapping directly; other start methods
+    map the file again in the child (same page-cache pages, no copy).
+    """
+    import multiprocessing
+
+    # Load pypdf here so forked children inherit it instead of importing it per PDF.
+    import pypdf  # noqa: F401
+
+    context = multiprocessing.get_context()
+    shared = mapped.buffer() if mapped is not None and context.get_start_method() == "fork" else None
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_extract_pages_in_child,
+        args=(str(path), limits.memory_mb, until, shared, sender),
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(limits.timeout_s if limits.timeout_s > 0 else None):
+            raise PdfExtractionTimeout(f"{path.name}: text extraction exceeded {limits.timeout_s:g}s")
+        try:
+            status, payload = receiver.recv()
+        except EOFError:
+            process.join()
+            raise PdfExtractionError(f"{path.name}: extraction worker exited with code {process.exitcode}") from None
+    finally:
+        if process.is_alive():
+            process.kill()
+        process.join()
+        receiver.close()
+    if status != "ok":
+        raise PdfExtractionError(f"{path.name}: {payload}")
+    return payload
 
 
 def normalize_text(value: str) -> str:
@@ -210,14 +787,6 @@ def normalize_ncm_code(code: str) -> str:
     return cleaned
 
 
-def find_pdf_for_code(code: str, kind: str) -> Path:
-    pattern = f"{code}*{kind}.pdf"
-    matches = sorted(NMC_DIR.glob(pattern))
-    if not matches:
-        raise FileNotFoundError(f"Missing {kind} PDF for code {code}")
-    return matches[0]
-
-
 def extract_code_and_kind(path: Path) -> Tuple[str | None, str | None]:
     stem = path.stem.replace("%20", " ").strip()
     lower = stem.lower()
@@ -230,80 +799,300 @@ def extract_code_and_kind(path: Path) -> Tuple[str | None, str | None]:
     return None, None
 
 
-def discover_all_codes() -> List[str]:
-    pairs: Dict[str, Dict[str, bool]] = {}
-    for path in NMC_DIR.glob("*.pdf"):
-        code, kind = extract_code_and_kind(path)
-        if not code or not kind:
-            continue
-        bucket = pairs.setdefault(code, {"diagnos": False, "facit": False})
-        bucket[kind] = True
-    valid = [code for code, kinds in pairs.items() if kinds["diagnos"] and kinds["facit"]]
-    return sorted(valid)
+@dataclass
+class CorpusFile:
+    path: Path
+    size: int
+    mtime_ns: int
+
+
+@dataclass
+class CorpusEntry:
+    code: str
+    diagnos: CorpusFile | None = None
+    facit: CorpusFile | None = None
+
+    def file(self, kind: str) -> CorpusFile:
+        found = self.diagnos if kind == "diagnos" else self.facit if kind == "facit" else None
+        if found is None:
+            raise FileNotFoundError(f"Missing {kind} PDF for code {self.code}")
+        return found
+
+
+class CorpusIndex:
+    """One scan of NMC/*.pdf shared by every stage of a run.
+
+    Maps normalized code -> diagnos/facit files (path, size, mtime) and loads
+    each PDF's text lazily, at most once per process.
+    """
+
+    def __init__(self, entries: Dict[str, CorpusEntry], cache: PdfTextCache | None = None) -> None:
+        self.entries = entries
+        self.cache = cache
+        self._pages: Dict[Path, List[str]] = {}
+        self._texts: Dict[Path, Tuple[str, int]] = {}
+
+    @classmethod
+    def build(cls, nmc_dir: Path, cache: PdfTextCache | None = None) -> "CorpusIndex":
+        entries: Dict[str, CorpusEntry] = {}
+        for path in sorted(nmc_dir.glob("*.pdf")):
+            code, kind = extract_code_and_kind(path)
+            if not code or not kind:
+                continue
+            entry = entries.setdefault(code, CorpusEntry(code=code))
+            if getattr(entry, kind) is not None:
+                # Same precedence as the old per-code glob: first file name wins.
+                continue
+            stat = path.stat()
+            setattr(entry, kind, CorpusFile(path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns))
+        return cls(entries, cache=cache)
+
+    def codes(self) -> List[str]:
+        valid = [code for code, entry in self.entries.items() if entry.diagnos and entry.facit]
+        return sorted(valid)
+
+    def pdf_paths(self) -> List[Path]:
+        paths: List[Path] = []
+        for entry in self.entries.values():
+            paths.extend(item.path for item in (entry.diagnos, entry.facit) if item is not None)
+        return sorted(paths)
+
+    def entry(self, code: str) -> CorpusEntry:
+        normalized = normalize_ncm_code(code)
+        found = self.entries.get(normalized)
+        if found is None:
+            raise FileNotFoundError(f"No NMC PDFs found for code {normalized}")
+        return found
+
+    def pdf_for_code(self, code: str, kind: str) -> Path:
+        return self.entry(code).file(kind).path
+
+    def load_pages(self, code: str, kind: str) -> List[str]:
+        """Raw page texts of a code's PDF, extracted at most once."""
+        path = self.pdf_for_code(code, kind)
+        pages = self._pages.get(path)
+        if pages is None:
+            # Only the Facit segment of a facit PDF is ever parsed, so stop decoding after it.
+            until = facit_pages_until_segment_end if kind == "facit" else None
+            if self.cache is not None:
+                pages = self.cache.read_pages(path, until)
+            else:
+                pages = extract_pdf_page_prefix(path, until)[0]
+            self._pages[path] = pages
+        return pages
+
+    def cached_pages(self, code: str, kind: str) -> List[str] | None:
+        """Page texts of a code's PDF if loaded here or in the text cache, else None; never extracts.
+
+        Codes extracted in worker processes are only loaded there, but their
+        text cache entries are shared.
+        """
+        path = self.pdf_for_code(code, kind)
+        pages = self._pages.get(path)
+        if pages is None and self.cache is not None:
+            pages = self.cache.cached_pages(path, facit_pages_until_segment_end if kind == "facit" else None)
+        return pages
+
+    def load(self, code: str, kind: str) -> Tuple[str, int]:
+        """Raw text and page count for a code's PDF, extracted at most once."""
+        path = self.pdf_for_code(code, kind)
+        loaded = self._texts.get(path)
+        if loaded is None:
+            pages = self.load_pages(code, kind)
+            loaded = ("\n".join(pages), len(pages))
+            self._texts[path] = loaded
+        return loaded
+
+    def text(self, code: str, kind: str) -> str:
+        return self.load(code, kind)[0]
+
+    def files(self) -> Iterator[CorpusFile]:
+        for entry in self.entries.values():
+            yield from (item for item in (entry.diagnos, entry.facit) if item is not None)
+
+    def carry_over_texts(self, previous: "CorpusIndex") -> None:
+        """Reuse texts previous already loaded for PDFs whose size and mtime are unchanged."""
+        current = {item.path: item for item in self.files()}
+        for item in previous.files():
+            if current.get(item.path) != item:
+                continue
+            if item.path in previous._pages:
+                self._pages[item.path] = previous._pages[item.path]
+            if item.path in previous._texts:
+                self._texts[item.path] = previous._texts[item.path]
+
+
+@dataclass
+class DiagnosItems:
+    expression: Dict[int, str]
+    word: Dict[int, str]
+
+
+ITEM_TERMINATOR_PATTERN = re.compile(r"\s+S\s*var\s*:", re.IGNORECASE)
+ITEM_START_PATTERN = re.compile(r"(?<!\S)(\d+)\s+(?=\S)")
+EXPRESSION_START_PATTERN = re.compile(r"(?<!\S)(\d+)\s+Beräkna\s+(?=\S)", re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def tokenize_diagnos_items(cleaned_text: str) -> DiagnosItems:
+    """Split diagnos text into `<n> ... S var:` blocks in one pass.
+
+    Each block yields a word item (first numbered text in the block) and, when
+    the block contains `<n> Beräkna ...`, an expression item, so both views are
+    always cut from the same blocks.
+    """
+    expression: Dict[int, str] = {}
+    word: Dict[int, str] = {}
+    block_start = 0
+    for terminator in ITEM_TERMINATOR_PATTERN.finditer(cleaned_text):
+        block_end = terminator.start()
+        item = ITEM_START_PATTERN.search(cleaned_text, block_start, block_end)
+        if item:
+            word[int(item.group(1))] = WHITESPACE_PATTERN.sub(" ", cleaned_text[item.end() : block_end]).strip()
+            calculation = EXPRESSION_START_PATTERN.search(cleaned_text, item.start(), block_end)
+            if calculation:
+                expression[int(calculation.group(1))] = WHITESPACE_PATTERN.sub(
+                    " ", cleaned_text[calculation.end() : block_end]
+                ).strip()
+        block_start = terminator.end()
+    return DiagnosItems(expression=expression, word=word)
 
 
 def parse_expression_items(cleaned_text: str) -> Dict[int, str]:
-    items: Dict[int, str] = {}
-    pattern = re.compile(r"(?<!\S)(\d+)\s+Beräkna\s+(.+?)\s+S\s*var\s*:", re.IGNORECASE)
-    for match in pattern.finditer(cleaned_text):
-        no = int(match.group(1))
-        expr = re.sub(r"\s+", " ", match.group(2)).strip()
-        items[no] = expr
-    return items
+    return tokenize_diagnos_items(cleaned_text).expression
 
 
 def parse_word_items(cleaned_text: str) -> Dict[int, str]:
-    items: Dict[int, str] = {}
-    pattern = re.compile(r"(?<!\S)(\d+)\s+(.+?)\s+S\s*var\s*:", re.IGNORECASE)
-    for match in pattern.finditer(cleaned_text):
-        no = int(match.group(1))
-        question = re.sub(r"\s+", " ", match.group(2)).strip()
-        if not question:
-            continue
-        items[no] = question
-    return items
+    return tokenize_diagnos_items(cleaned_text).word
 
 
 def parse_diagnos_items(cleaned_text: str, parser_mode: str) -> Dict[int, str]:
+    items = tokenize_diagnos_items(cleaned_text)
     if parser_mode == "expression":
-        return parse_expression_items(cleaned_text)
+        return items.expression
     if parser_mode == "word":
-        return parse_word_items(cleaned_text)
+        return items.word
+    return items.expression or items.word
 
-    expression = parse_expression_items(cleaned_text)
-    if expression:
-        return expression
-    return parse_word_items(cleaned_text)
 
+SIMPLE_EXPRESSION_PATTERN = re.compile(r"(-?\d+(?:\.\d+)?)\s*([+\-*/])\s*(-?\d+(?:\.\d+)?)")
+EXPRESSION_CHARS_PATTERN = re.compile(r"[\d.+\-*/()\s]+")
+EXPRESSION_TOKEN_PATTERN = re.compile(r"\s*(?:(\d+(?:\.\d+)?)|(\S))")
+EXPRESSION_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "neg": 3}
+MAX_EXPRESSION_LENGTH = 200
 
-def evaluate_expression(question_text: str) -> Decimal | None:
+
+def normalize_expression(question_text: str) -> str:
+    """Map Swedish/typographic operators and decimal commas onto + - * / and '.'."""
     expression = str(question_text or "").strip()
     expression = expression.replace("–", "-").replace("−", "-").replace("·", "*").replace("×", "*")
     expression = expression.replace("÷", "/").replace(":", "/")
     expression = expression.replace(",", ".")
-    expression = expression.replace(" ", "")
-    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)\s*([+\-*/])\s*(-?\d+(?:\.\d+)?)", expression)
-    if not match:
-        return None
+    return expression.replace(" ", "")
 
-    left_raw, op, right_raw = match.groups()
-    try:
+
+def evaluate_expression(question_text: str) -> Decimal | None:
+    """Value of an arithmetic question such as `3 · (4,5 − 1,5)`, or None.
+
+    Results are cached by normalized expression, so the batch rows and the
+    answer verification never evaluate the same expression twice.
+    """
+    return evaluate_normalized_expression(normalize_expression(question_text))
+
+
+@functools.lru_cache(maxsize=4096)
+def evaluate_normalized_expression(expression: str) -> Decimal | None:
+    """Shunting-yard evaluation over Fractions: + - * /, parentheses and unary minus.
+
+    At least one binary operator is required (a bare number is not a
+    calculation). Anything else, including division by zero, gives None.
+    """
+    simple = SIMPLE_EXPRESSION_PATTERN.fullmatch(expression)
+    if simple:
+        # Most rows are a single `a op b`; Decimal gives the same value without the parser.
+        left_raw, operator, right_raw = simple.groups()
         left = Decimal(left_raw)
         right = Decimal(right_raw)
-    except InvalidOperation:
+        if operator == "+":
+            value = left + right
+        elif operator == "-":
+            value = left - right
+        elif operator == "*":
+            value = left * right
+        elif right == 0:
+            return None
+        else:
+            value = left / right
+        return value if value else Decimal(0)
+    if len(expression) > MAX_EXPRESSION_LENGTH or not EXPRESSION_CHARS_PATTERN.fullmatch(expression):
         return None
+    values: List[Fraction] = []
+    operators: List[str] = []
+    binary_count = 0
+    expect_operand = True
+
+    def apply(operator: str) -> None:
+        if operator == "neg":
+            values.append(-values.pop())
+            return
+        right = values.pop()
+        left = values.pop()
+        if operator == "+":
+            values.append(left + right)
+        elif operator == "-":
+            values.append(left - right)
+        elif operator == "*":
+            values.append(left * right)
+        else:
+            values.append(left / right)
 
-    if op == "+":
-        return left + right
-    if op == "-":
-        return left - right
-    if op == "*":
-        return left * right
-    if op == "/":
-        if right == 0:
+    try:
+        position = 0
+        while position < len(expression):
+            match = EXPRESSION_TOKEN_PATTERN.match(expression, position)
+            if match is None:
+                break
+            position = match.end()
+            number, symbol = match.groups()
+            if number is not None:
+                if not expect_operand:
+                    return None
+                values.append(Fraction(Decimal(number)))
+                expect_operand = False
+            elif symbol == "(":
+                if not expect_operand:
+                    return None
+                operators.append(symbol)
+            elif symbol == ")":
+                if expect_operand:
+                    return None
+                while operators and operators[-1] != "(":
+                    apply(operators.pop())
+                if not operators:
+                    return None
+                operators.pop()
+            elif symbol == "-" and expect_operand:
+                operators.append("neg")
+            elif symbol in EXPRESSION_PRECEDENCE and not expect_operand:
+                precedence = EXPRESSION_PRECEDENCE[symbol]
+                while operators and operators[-1] != "(" and EXPRESSION_PRECEDENCE[operators[-1]] >= precedence:
+                    apply(operators.pop())
+                operators.append(symbol)
+                binary_count += 1
+                expect_operand = True
+            else:
+                return None
+        if expect_operand or binary_count == 0:
             return None
-        return left / right
-    return None
+        while operators:
+            operator = operators.pop()
+            if operator == "(":
+                return None
+            apply(operator)
+    except (ZeroDivisionError, InvalidOperation):
+        return None
+    result = values[0]
+    return Decimal(result.numerator) / Decimal(result.denominator)
 
 
 def parse_decimal_text(value: str) -> Decimal | None:
@@ -342,55 +1131,79 @@ def format_decimal(value: Decimal) -> str:
     return text.replace(".", ",")
 
 
+FACIT_START_PATTERN = re.compile(r"\bFacit\b", re.IGNORECASE)
+FACIT_END_PATTERN = re.compile(r"\n\s*(Kontrollera|Studera|Observera|Genomförande|Uppföljning)\b", re.IGNORECASE)
+
+
 def extract_facit_segment(raw_text: str) -> str:
-    match = re.search(
-        r"\bFacit\b(.+?)(\n\s*(Kontrollera|Studera|Observera|Genomförande|Uppföljning)\b|$)",
-        raw_text,
-        re.IGNORECASE | re.DOTALL,
-    )
-    if not match:
+    """Text between the first `Facit` and the next closing heading (or the end)."""
+    start = FACIT_START_PATTERN.search(raw_text)
+    if not start:
         return ""
-    return match.group(1).strip()
+    end = FACIT_END_PATTERN.search(raw_text, start.end() + 1)
+    return raw_text[start.end() : end.start() if end else len(raw_text)].strip()
+
+
+def facit_pages_until_segment_end(pages: Iterable[str]) -> Iterator[str]:
+    """Yield pages up to the one where the Facit segment's closing heading appears.
+
+    Joining the yielded pages with "\n" gives extract_facit_segment() the same
+    segment as joining every page, so later pages never need to be decoded.
+    Each page is searched on its own, prefixed with the joining newline.
+    """
+    min_end = None  # first offset in the next window where the closing heading may start
+    for index, page in enumerate(pages):
+        yield page
+        window = page if index == 0 else "\n" + page
+        if min_end is None:
+            start = FACIT_START_PATTERN.search(window)
+            if start is None:
+                continue
+            min_end = start.end() + 1
+        if FACIT_END_PATTERN.search(window, min_end):
+            return
+        min_end = max(min_end - len(window), 0)
 
 
 def _find_marker_positions(tokens: List[str], expected_count: int) -> List[int] | None:
-    marker_positions: Dict[int, List[int]] = {
-        marker: [idx for idx, token in enumerate(tokens) if token == str(marker)]
-        for marker in range(1, expected_count + 1)
-    }
-    if any(len(marker_positions[marker]) == 0 for marker in range(1, expected_count + 1)):
+    """Align item markers 1..expected_count to token positions.
+
+    Markers must appear in order with at least one answer token between two
+    markers and after the last one. Of all valid alignments the earliest
+    (lexicographically smallest) is returned. One pass indexes the marker
+    tokens, a backward pass finds the latest feasible position per marker and
+    a forward pass then takes the earliest position within those bounds.
+    """
+    if expected_count <= 0:
+        return []
+
+    wanted = {str(marker): marker for marker in range(1, expected_count + 1)}
+    marker_positions: Dict[int, List[int]] = {marker: [] for marker in range(1, expected_count + 1)}
+    for idx, token in enumerate(tokens):
+        marker = wanted.get(token)
+        if marker is not None:
+            marker_positions[marker].append(idx)
+    if any(not positions for positions in marker_positions.values()):
         return None
 
-    memo: Dict[Tuple[int, int], Tuple[int, ...] | None] = {}
+    latest = [0] * (expected_count + 1)
+    limit = len(tokens) - 1
+    for marker in range(expected_count, 0, -1):
+        positions = marker_positions[marker]
+        cut = bisect.bisect_left(positions, limit)
+        if cut == 0:
+            return None
+        latest[marker] = positions[cut - 1]
+        limit = latest[marker] - 1
 
-    def solve(marker: int, previous_marker_idx: int) -> Tuple[int, ...] | None:
-        key = (marker, previous_marker_idx)
-        if key in memo:
-            return memo[key]
-
-        for pos in marker_positions[marker]:
-            if pos <= previous_marker_idx:
-                continue
-            if marker > 1 and pos <= previous_marker_idx + 1:
-                continue
-            if marker == expected_count:
-                if pos >= len(tokens) - 1:
-                    continue
-                memo[key] = (pos,)
-                return memo[key]
-
-            tail = solve(marker + 1, pos)
-            if tail is not None:
-                memo[key] = (pos,) + tail
-                return memo[key]
-
-        memo[key] = None
-        return None
-
-    solved = solve(1, -1)
-    if solved is None:
-        return None
-    return list(solved)
+    solved: List[int] = []
+    floor = -1
+    for marker in range(1, expected_count + 1):
+        positions = marker_positions[marker]
+        pos = positions[bisect.bisect_right(positions, floor)]
+        solved.append(pos)
+        floor = pos + 1
+    return solved
 
 
 def parse_facit_answers(raw_text: str, expected_count: int) -> Dict[int, str]:
@@ -453,17 +1266,15 @@ def infer_ncm_mapping(code: str) -> Dict[str, object]:
     }
 
 
-def build_rows_for_code(code: str, parser_mode: str) -> Dict[str, object]:
+def build_item_rows(
+    code: str,
+    diagnos_items: Dict[int, str],
+    facit_answers: Dict[int, str],
+    diagnos_pdf_name: str,
+    facit_pdf_name: str,
+) -> List[ItemRow]:
+    """Merge parsed diagnos items and facit answers into ItemRows, one per item number."""
     mapping = infer_ncm_mapping(code)
-    diagnos_pdf = find_pdf_for_code(code, "diagnos")
-    facit_pdf = find_pdf_for_code(code, "facit")
-
-    diagnos_text = normalize_text(read_pdf_text(diagnos_pdf))
-    facit_raw_text = read_pdf_text(facit_pdf)
-
-    diagnos_items = parse_diagnos_items(diagnos_text, parser_mode=parser_mode)
-    facit_answers = parse_facit_answers(facit_raw_text, expected_count=len(diagnos_items))
-
     rows: List[ItemRow] = []
     item_numbers = sorted(set(diagnos_items.keys()) | set(facit_answers.keys()))
     for no in item_numbers:
@@ -505,8 +1316,8 @@ def build_rows_for_code(code: str, parser_mode: str) -> Dict[str, object]:
                 item_no=no,
                 question_text=question_text,
                 expected_answer=expected_answer,
-                source_diagnos_pdf=diagnos_pdf.name,
-                source_facit_pdf=facit_pdf.name,
+                source_diagnos_pdf=diagnos_pdf_name,
+                source_facit_pdf=facit_pdf_name,
                 answer_source=answer_source,
                 extraction_confidence=confidence,
                 ncm_domain_tag=str(mapping["domain_tag"]),
@@ -514,6 +1325,55 @@ def build_rows_for_code(code: str, parser_mode: str) -> Dict[str, object]:
                 ability_tags="|".join(mapping["ability_tags"]),
             )
         )
+    return rows
+
+
+def count_item_rows(rows: List[ItemRow]) -> Dict[str, int]:
+    return {
+        "merged_item_count": len(rows),
+        "high_confidence_items": sum(1 for row in rows if row.extraction_confidence == "high"),
+        "computed_answer_items": sum(1 for row in rows if row.answer_source == "computed"),
+        "facit_numeric_text_items": sum(1 for row in rows if row.answer_source == "facit_numeric_text"),
+    }
+
+
+def build_rows_for_code(
+    code: str,
+    parser_mode: str,
+    corpus: CorpusIndex | None = None,
+    timer: StageTimer | None = None,
+) -> Dict[str, object]:
+    if corpus is None:
+        corpus = CorpusIndex.build(NMC_DIR)
+    cache = corpus.cache
+    diagnos_pdf = corpus.pdf_for_code(code, "diagnos")
+    facit_pdf = corpus.pdf_for_code(code, "facit")
+
+    if timer is None:
+        timer = StageTimer()
+    cache_snapshot = cache.snapshot() if cache is not None else None
+    with timer.stage("read_pdf") as stage:
+        diagnos_raw_text, diagnos_pages = corpus.load(code, "diagnos")
+        facit_raw_text, facit_pages = corpus.load(code, "facit")
+        stage["pages"] += diagnos_pages + facit_pages
+        stage["chars"] += len(diagnos_raw_text) + len(facit_raw_text)
+    with timer.stage("normalize_text") as stage:
+        diagnos_text = normalize_text(diagnos_raw_text)
+        stage["chars"] += len(diagnos_raw_text)
+    with timer.stage("parse_items") as stage:
+        diagnos_items = parse_diagnos_items(diagnos_text, parser_mode=parser_mode)
+        stage["chars"] += len(diagnos_text)
+        stage["items"] += len(diagnos_items)
+    with timer.stage("parse_facit_answers") as stage:
+        facit_answers = parse_facit_answers(facit_raw_text, expected_count=len(diagnos_items))
+        stage["chars"] += len(facit_raw_text)
+        stage["items"] += len(facit_answers)
+
+    build_stage = timer.stages.setdefault("build_rows", {"wall_ms": 0.0, "pages": 0, "chars": 0, "items": 0})
+    build_started = time.perf_counter()
+    rows = build_item_rows(code, diagnos_items, facit_answers, diagnos_pdf.name, facit_pdf.name)
+    build_stage["wall_ms"] += (time.perf_counter() - build_started) * 1000
+    build_stage["items"] += len(rows)
 
     report = {
         "code": code,
@@ -522,178 +1382,716 @@ def build_rows_for_code(code: str, parser_mode: str) -> Dict[str, object]:
         "facit_pdf": facit_pdf.name,
         "diagnos_item_count": len(diagnos_items),
         "facit_item_count": len(facit_answers),
-        "merged_item_count": len(rows),
-        "high_confidence_items": sum(1 for row in rows if row.extraction_confidence == "high"),
-        "computed_answer_items": sum(1 for row in rows if row.answer_source == "computed"),
-        "facit_numeric_text_items": sum(1 for row in rows if row.answer_source == "facit_numeric_text"),
+        **count_item_rows(rows),
     }
+    if cache is not None and cache_snapshot is not None:
+        report["pdf_text_cache"] = cache.stats_since(cache_snapshot)
+    report["metrics"] = timer.as_dict()
     return {"rows": rows, "report": report}
 
 
 def get_batch_file_stem(batch_name: str) -> str:
+    if batch_name.startswith(CANDIDATE_BATCH_PREFIX):
+        return f"candidate_batch_{batch_name[len(CANDIDATE_BATCH_PREFIX):]}"
     suffix = batch_name[5:] if batch_name.startswith("safe_") else batch_name
     return f"safe_batch_{suffix}"
 
 
-def write_batch_outputs(batch_name: str, rows: List[ItemRow], summary: Dict[str, object]) -> None:
+ITEM_ROW_FIELDS = [field.name for field in fields(ItemRow)]
+
+
+class JsonArrayWriter:
+    """Stream objects into a JSON array formatted exactly like json.dump(..., indent=2)."""
+
+    def __init__(self, handle) -> None:
+        self.handle = handle
+        self.count = 0
+
+    def write(self, item: Dict[str, object]) -> None:
+        text = json.dumps(item, ensure_ascii=False, indent=2)
+        self.handle.write("[\n" if self.count == 0 else ",\n")
+        self.handle.write("  " + text.replace("\n", "\n  "))
+        self.count += 1
+
+    def close(self) -> None:
+        self.handle.write("[]" if self.count == 0 else "\n]")
+
+
+def write_batch_rows(batch_name: str, rows: Iterable[ItemRow]) -> Dict[str, object]:
+    """Stream rows into the batch JSON and CSV files; returns the write stage record."""
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     stem = get_batch_file_stem(batch_name)
-
     json_path = OUT_DIR / f"{stem}.json"
     csv_path = OUT_DIR / f"{stem}.csv"
-    report_path = OUT_DIR / f"{stem}_report.json"
+    write_started = time.perf_counter()
+
+    with atomic_output(json_path) as json_handle, atomic_output(
+        csv_path, encoding="utf-8-sig", newline=""
+    ) as csv_handle:
+        json_writer = JsonArrayWriter(json_handle)
+        csv_writer = csv.DictWriter(csv_handle, fieldnames=ITEM_ROW_FIELDS, delimiter=";")
+        csv_writer.writeheader()
+        for row in rows:
+            record = asdict(row)
+            json_writer.write(record)
+            csv_writer.writerow(record)
+        json_writer.close()
 
-    with json_path.open("w", encoding="utf-8") as handle:
-        json.dump([asdict(row) for row in rows], handle, ensure_ascii=False, indent=2)
+    return round_stage({"wall_ms": (time.perf_counter() - write_started) * 1000, "items": json_writer.count})
 
-    with csv_path.open("w", encoding="utf-8-sig", newline="") as handle:
-        writer = csv.DictWriter(
-            handle,
-            fieldnames=[
-                "ncm_code",
-                "item_no",
-                "question_text",
-                "expected_answer",
-                "source_diagnos_pdf",
-                "source_facit_pdf",
-                "answer_source",
-                "extraction_confidence",
-                "ncm_domain_tag",
-                "operation_tag",
-                "ability_tags",
-            ],
-            delimiter=";",
-        )
-        writer.writeheader()
-        for row in rows:
-            writer.writerow(asdict(row))
 
-    with report_path.open("w", encoding="utf-8") as handle:
-        json.dump(summary, handle, ensure_ascii=False, indent=2)
+def write_batch_report(batch_name: str, summary: Dict[str, object]) -> None:
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    write_json_report(OUT_DIR / f"{get_batch_file_stem(batch_name)}_report.json", summary)
 
     # Backward compatibility: previous pipeline consumed this legacy report path.
     if batch_name == "safe_as_expressions":
-        legacy_report_path = OUT_DIR / "safe_batch_parse_report.json"
-        with legacy_report_path.open("w", encoding="utf-8") as handle:
-            json.dump(summary, handle, ensure_ascii=False, indent=2)
+        write_json_report(OUT_DIR / "safe_batch_parse_report.json", summary)
 
 
-def process_batch(batch: Dict[str, object]) -> Tuple[List[ItemRow], Dict[str, object]]:
+def map_codes(func: Callable[[T], R], items: Iterable[T], executor: Executor | None = None) -> Iterator[R]:
+    """Apply func per code, in input order, optionally fanned out to a process pool."""
+    if executor is None:
+        return map(func, items)
+    return executor.map(func, items)
+
+
+def build_rows_or_error(code: str, parser_mode: str, corpus: CorpusIndex | None = None) -> Dict[str, object]:
+    timer = StageTimer()
+    try:
+        return build_rows_for_code(code, parser_mode=parser_mode, corpus=corpus, timer=timer)
+    except Exception as error:  # pragma: no cover
+        return {
+            "rows": [],
+            "report": {
+                "code": code,
+                "parser_mode": parser_mode,
+                "status": "review",
+                "reason": "timeout" if isinstance(error, PdfExtractionTimeout) else "processing_error",
+                "diagnos_item_count": 0,
+                "facit_item_count": 0,
+                "merged_item_count": 0,
+                "high_confidence_items": 0,
+                "computed_answer_items": 0,
+                "facit_numeric_text_items": 0,
+                "error": str(error),
+                "metrics": timer.as_dict(),
+            },
+        }
+
+
+def sum_cache_stats(reports: Iterable[Dict[str, object]], mode: str) -> Dict[str, object]:
+    hits = 0
+    misses = 0
+    for report in reports:
+        stats = report.get("pdf_text_cache")
+        if isinstance(stats, dict):
+            hits += int(stats.get("hits", 0))
+            misses += int(stats.get("misses", 0))
+    return {"mode": mode, "hits": hits, "misses": misses}
+
+
+def load_previous_batch(batch_name: str) -> Dict[str, Dict[str, object]]:
+    """Rows and per-code reports from the batch files of an earlier run, by code."""
+    stem = get_batch_file_stem(batch_name)
+    try:
+        with (OUT_DIR / f"{stem}.json").open("r", encoding="utf-8") as handle:
+            raw_rows = json.load(handle)
+        with (OUT_DIR / f"{stem}_report.json").open("r", encoding="utf-8") as handle:
+            report = json.load(handle)
+        rows = [ItemRow(**raw) for raw in raw_rows]
+    except (OSError, ValueError, TypeError):
+        return {}
+
+    previous: Dict[str, Dict[str, object]] = {}
+    for entry in report.get("per_code", []):
+        previous[str(entry.get("code", ""))] = {"rows": [], "report": entry}
+    for row in rows:
+        if row.ncm_code in previous:
+            previous[row.ncm_code]["rows"].append(row)
+    return previous
+
+
+def load_previous_batch_summary(batch: Dict[str, object]) -> Dict[str, object] | None:
+    stem = get_batch_file_stem(str(batch["name"]))
+    if not (OUT_DIR / f"{stem}.json").exists() or not (OUT_DIR / f"{stem}.csv").exists():
+        return None
+    try:
+        with (OUT_DIR / f"{stem}_report.json").open("r", encoding="utf-8") as handle:
+            summary = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if summary.get("codes") != list(batch["codes"]) or summary.get("parser_mode") != batch["parser"]:
+        return None
+    return summary
+
+
+class CheckpointStore:
+    """Per-code results of the current run, written as each code finishes.
+
+    Checkpoints live in <out>/.checkpoints/<stage>/<CODE>.json next to the
+    code's manifest record; load() only returns a checkpoint whose record
+    still matches, so a resumed run never reuses results for changed inputs.
+    """
+
+    def __init__(self, root: Path, records: Dict[str, Dict[str, object]]) -> None:
+        self.root = root
+        self.records = records
+        self.resumed = 0
+
+    def path(self, stage: str, code: str) -> Path:
+        return self.root / stage / f"{code}.json"
+
+    def save(self, stage: str, code: str, result: Dict[str, object]) -> None:
+        with atomic_output(self.path(stage, code)) as handle:
+            json.dump({"record": self.records.get(code), "result": result}, handle, ensure_ascii=False)
+
+    def load(self, stage: str, code: str) -> Dict[str, object] | None:
+        try:
+            with self.path(stage, code).open("r", encoding="utf-8") as handle:
+                checkpoint = json.load(handle)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(checkpoint, dict) or checkpoint.get("record") != self.records.get(code):
+            return None
+        self.resumed += 1
+        return checkpoint.get("result")
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+ITEM_STORE_SCHEMA = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE codes (
+    ncm_code TEXT PRIMARY KEY,
+    safe_batch TEXT NOT NULL,
+    domain_tag TEXT NOT NULL,
+    operation_tag TEXT NOT NULL,
+    mapping_confidence TEXT NOT NULL,
+    mapping_source TEXT NOT NULL
+);
+CREATE TABLE ability_tags (
+    ncm_code TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (ncm_code, tag)
+);
+CREATE TABLE items (
+    ncm_code TEXT NOT NULL,
+    item_no INTEGER NOT NULL,
+    question_text TEXT NOT NULL,
+    expected_answer TEXT NOT NULL,
+    source_diagnos_pdf TEXT NOT NULL,
+    source_facit_pdf TEXT NOT NULL,
+    answer_source TEXT NOT NULL,
+    extraction_confidence TEXT NOT NULL,
+    ncm_domain_tag TEXT NOT NULL,
+    operation_tag TEXT NOT NULL,
+    PRIMARY KEY (ncm_code, item_no)
+);
+CREATE TABLE screening (
+    ncm_code TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    recommended_parser TEXT NOT NULL,
+    diagnos_pdf TEXT NOT NULL,
+    facit_pdf TEXT NOT NULL,
+    item_count INTEGER NOT NULL,
+    facit_count INTEGER NOT NULL,
+    numeric_answer_count INTEGER NOT NULL,
+    error TEXT NOT NULL
+);
+CREATE INDEX idx_codes_domain ON codes (domain_tag);
+CREATE INDEX idx_codes_operation ON codes (operation_tag);
+CREATE INDEX idx_ability_tags_tag ON ability_tags (tag, ncm_code);
+CREATE INDEX idx_items_domain ON items (ncm_domain_tag);
+CREATE INDEX idx_items_operation ON items (operation_tag);
+CREATE INDEX idx_items_confidence ON items (extraction_confidence);
+CREATE INDEX idx_screening_status ON screening (status);
+"""
+
+# ItemRow.ability_tags is stored once per code in ability_tags, not per item.
+ITEM_STORE_ITEM_FIELDS = [name for name in ITEM_ROW_FIELDS if name != "ability_tags"]
+ITEM_STORE_CODE_FIELDS = ["ncm_code", "safe_batch", "domain_tag", "operation_tag", "mapping_confidence", "mapping_source"]
+ITEM_STORE_SCREENING_FIELDS = [
+    "ncm_code",
+    "status",
+    "reason",
+    "recommended_parser",
+    "diagnos_pdf",
+    "facit_pdf",
+    "item_count",
+    "facit_count",
+    "numeric_answer_count",
+    "error",
+]
+
+
+class ItemStore:
+    """Optional SQLite copy of the extracted items, code mapping and screening.
+
+    Every write is per code and compares with what is stored first, so an
+    incremental run only rewrites rows of codes whose content changed.
+    created is True when the file was new or had an older schema, in which
+    case the caller backfills it from the existing outputs.
+    """
+
+    def __init__(self, path: Path) -> None:
+        import sqlite3
+
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        self.changed_codes: Set[str] = set()
+        try:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+        self.created = row is None or row[0] != ITEM_STORE_SCHEMA_VERSION
+        if self.created:
+            self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self.conn:
+            tables = [name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            for table in tables:
+                self.conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            self.conn.executescript(ITEM_STORE_SCHEMA)
+            self.conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('schema_version', ?)",
+                (ITEM_STORE_SCHEMA_VERSION,),
+            )
+
+    def _select(self, table: str, columns: List[str], code: str, order_by: str = "") -> List[Tuple[object, ...]]:
+        query = f"SELECT {', '.join(columns)} FROM {table} WHERE ncm_code = ?"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        return self.conn.execute(query, (code,)).fetchall()
+
+    def _replace(self, table: str, columns: List[str], code: str, rows: List[Tuple[object, ...]]) -> None:
+        placeholders = ", ".join("?" for _ in columns)
+        self.conn.execute(f"DELETE FROM {table} WHERE ncm_code = ?", (code,))
+        self.conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        self.changed_codes.add(code)
+
+    def replace_items(self, code: str, rows: Iterable[ItemRow]) -> None:
+        new_rows = sorted(tuple(getattr(row, name) for name in ITEM_STORE_ITEM_FIELDS) for row in rows)
+        if self._select("items", ITEM_STORE_ITEM_FIELDS, code, order_by="item_no") == new_rows:
+            return
+        with self.conn:
+            self._replace("items", ITEM_STORE_ITEM_FIELDS, code, new_rows)
+
+    def upsert_screening(self, row: Dict[str, object]) -> None:
+        values = {**row, "ncm_code": row.get("code", "")}
+        new_row = tuple(
+            values.get(name, 0) if name.endswith("count") else str(values.get(name, ""))
+            for name in ITEM_STORE_SCREENING_FIELDS
+        )
+        code = str(new_row[0])
+        if self._select("screening", ITEM_STORE_SCREENING_FIELDS, code) == [new_row]:
+            return
+        with self.conn:
+            self._replace("screening", ITEM_STORE_SCREENING_FIELDS, code, [new_row])
+
+    def sync_codes(self, mapping_rows: Iterable[Dict[str, object]]) -> None:
+        """Upsert codes and their ability tags from build_ncm_mapping_rows() output."""
+        for mapping in mapping_rows:
+            code = str(mapping["ncm_code"])
+            code_row = tuple(str(mapping[name]) for name in ITEM_STORE_CODE_FIELDS)
+            tag_rows = sorted({(code, str(tag)) for tag in mapping["ability_tags"]})
+            if (
+                self._select("codes", ITEM_STORE_CODE_FIELDS, code) == [code_row]
+                and self._select("ability_tags", ["ncm_code", "tag"], code, order_by="tag") == tag_rows
+            ):
+                continue
+            with self.conn:
+                self._replace("codes", ITEM_STORE_CODE_FIELDS, code, [code_row])
+                self._replace("ability_tags", ["ncm_code", "tag"], code, tag_rows)
+
+    def prune(self, table: str, live_codes: Iterable[str]) -> None:
+        """Delete rows of table for codes outside live_codes."""
+        live = set(live_codes)
+        stale = [code for (code,) in self.conn.execute(f"SELECT DISTINCT ncm_code FROM {table}") if code not in live]
+        if not stale:
+            return
+        with self.conn:
+            self.conn.executemany(f"DELETE FROM {table} WHERE ncm_code = ?", [(code,) for code in stale])
+        self.changed_codes.update(stale)
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def save_batch_checkpoint(checkpoints: CheckpointStore, batch_name: str, result: Dict[str, object]) -> None:
+    report = result["report"]
+    if report.get("reason") in FAILED_REASONS:
+        return
+    rows = [asdict(row) for row in result["rows"]]
+    checkpoints.save(batch_name, str(report["code"]), {"rows": rows, "report": report})
+
+
+def load_batch_checkpoint(checkpoints: CheckpointStore, batch_name: str, code: str) -> Dict[str, object] | None:
+    result = checkpoints.load(batch_name, code)
+    if result is None:
+        return None
+    try:
+        return {"rows": [ItemRow(**raw) for raw in result["rows"]], "report": result["report"]}
+    except (KeyError, TypeError):
+        return None
+
+
+def process_batch(
+    batch: Dict[str, object],
+    corpus: CorpusIndex | None = None,
+    executor: Executor | None = None,
+    changed_codes: Set[str] | None = None,
+    checkpoints: CheckpointStore | None = None,
+    resume: bool = False,
+    item_store: ItemStore | None = None,
+    timed: List[Tuple[str, str, Dict[str, object]]] | None = None,
+) -> Dict[str, object]:
+    """Extract a batch, stream its rows to disk and return the batch summary.
+
+    Rows flow code by code from extraction straight into the JSON/CSV writers
+    while the summary counters are accumulated, so only one code's rows are
+    held at a time. With changed_codes, codes outside that set reuse rows and
+    reports from the previous batch files instead of being re-extracted.
+    Each extracted code is checkpointed as it arrives; with resume, codes
+    checkpointed by an interrupted run are taken from there. Extracted and
+    resumed codes are also upserted into item_store.
+
+    A code whose extraction fails or times out keeps its rows from the
+    previous batch files, so one unreadable PDF never drops that code's
+    problems from the outputs; it is listed under "failed_codes".
+
+    The summary's metrics and cache counters only cover the codes extracted
+    or resumed by this call; their (code, batch, metrics) entries are also
+    appended to timed.
+    """
     batch_name = str(batch["name"])
     codes = list(batch["codes"])
     parser_mode = str(batch["parser"])
 
-    all_rows: List[ItemRow] = []
-    per_code_reports: List[Dict[str, object]] = []
-
-    for code in codes:
-        result = build_rows_for_code(code, parser_mode=parser_mode)
-        all_rows.extend(result["rows"])
-        per_code_reports.append(result["report"])
+    if corpus is None:
+        corpus = CorpusIndex.build(NMC_DIR)
+    previous = load_previous_batch(batch_name)
+    pending = [code for code in codes if changed_codes is None or code in changed_codes or code not in previous]
+    resumed: Dict[str, Dict[str, object]] = {}
+    if checkpoints is not None and resume:
+        for code in pending:
+            result = load_batch_checkpoint(checkpoints, batch_name, code)
+            if result is not None:
+                resumed[code] = result
+    to_build = [code for code in pending if code not in resumed]
+    rebuilt = set(to_build)
+    extracted = set(pending)
 
-    summary = {
+    per_code_reports: List[Dict[str, object]] = []
+    run_reports: List[Dict[str, object]] = []
+    failed_codes: List[Dict[str, object]] = []
+    summary: Dict[str, object] = {
         "generated_at_utc": datetime.now(timezone.utc).isoformat(),
         "batch_name": batch_name,
         "parser_mode": parser_mode,
         "codes": codes,
-        "total_rows": len(all_rows),
-        "high_confidence_rows": sum(1 for row in all_rows if row.extraction_confidence == "high"),
+        "total_rows": 0,
+        "high_confidence_rows": 0,
         "per_code": per_code_reports,
     }
 
-    write_batch_outputs(batch_name, all_rows, summary)
-    return all_rows, summary
-
-
-def screen_remaining_codes(all_codes: List[str], safe_lookup: Dict[str, str]) -> List[Dict[str, object]]:
-    rows: List[Dict[str, object]] = []
-
-    for code in all_codes:
-        if code in safe_lookup:
-            continue
-
-        try:
-            diagnos_pdf = find_pdf_for_code(code, "diagnos")
-            facit_pdf = find_pdf_for_code(code, "facit")
-
-            diagnos_text = normalize_text(read_pdf_text(diagnos_pdf))
-            facit_text = read_pdf_text(facit_pdf)
-
-            expr_items = parse_expression_items(diagnos_text)
-            word_items = parse_word_items(diagnos_text)
-            if len(expr_items) > 0 and len(expr_items) >= len(word_items):
-                parser_mode = "expression"
-                chosen_items = expr_items
-            elif len(word_items) > 0:
-                parser_mode = "word"
-                chosen_items = word_items
+    def iter_rows() -> Iterator[ItemRow]:
+        task = functools.partial(build_rows_or_error, parser_mode=parser_mode, corpus=corpus)
+        built = iter(map_codes(task, to_build, executor))
+        for code in codes:
+            if code in rebuilt:
+                result = next(built)
+                if checkpoints is not None:
+                    save_batch_checkpoint(checkpoints, batch_name, result)
+                report = result["report"]
+                if report.get("reason") in FAILED_REASONS:
+                    kept = previous.get(code)
+                    failed_codes.append(
+                        {
+                            "code": code,
+                            "reason": report["reason"],
+                            "error": report.get("error", ""),
+                            "kept_previous_rows": bool(kept and kept["rows"]),
+                        }
+                    )
+                    if kept and kept["rows"]:
+                        result = kept
+            elif code in resumed:
+                result = resumed.pop(code)
             else:
-                parser_mode = "none"
-                chosen_items = {}
+                result = previous.pop(code)
+            if code in extracted:
+                run_reports.append(report if code in rebuilt else result["report"])
+                if item_store is not None:
+                    item_store.replace_items(code, result["rows"])
+            per_code_reports.append(result["report"])
+            for row in result["rows"]:
+                summary["total_rows"] += 1
+                if row.extraction_confidence == "high":
+                    summary["high_confidence_rows"] += 1
+                yield row
+
+    write_stage = write_batch_rows(batch_name, iter_rows())
+
+    if failed_codes:
+        summary["failed_codes"] = failed_codes
+    if corpus.cache is not None:
+        summary["pdf_text_cache"] = sum_cache_stats(run_reports, corpus.cache.mode)
+    entries = [(str(report.get("code", "")), batch_name, report.get("metrics", {})) for report in run_reports]
+    if timed is not None:
+        timed.extend(entries)
+    summary["metrics"] = summarize_metrics(entries)
+    summary["metrics"]["stages"]["write_outputs"] = write_stage
+    write_batch_report(batch_name, summary)
+    return summary
+
+
+def screen_code(code: str, corpus: CorpusIndex, keep_parsed: bool = False) -> Dict[str, object]:
+    """Screening row for one code; with keep_parsed it carries the parsed items and answers under "parsed"."""
+    timer = StageTimer()
+    try:
+        diagnos_pdf = corpus.pdf_for_code(code, "diagnos")
+        facit_pdf = corpus.pdf_for_code(code, "facit")
+
+        with timer.stage("read_pdf") as stage:
+            diagnos_raw_text, diagnos_pages = corpus.load(code, "diagnos")
+            facit_text, facit_pages = corpus.load(code, "facit")
+            stage["pages"] += diagnos_pages + facit_pages
+            stage["chars"] += len(diagnos_raw_text) + len(facit_text)
+        with timer.stage("normalize_text") as stage:
+            diagnos_text = normalize_text(diagnos_raw_text)
+            stage["chars"] += len(diagnos_raw_text)
+        with timer.stage("parse_items") as stage:
+            diagnos_items = tokenize_diagnos_items(diagnos_text)
+            stage["chars"] += len(diagnos_text)
+            stage["items"] += max(len(diagnos_items.expression), len(diagnos_items.word))
+        expr_items = diagnos_items.expression
+        word_items = diagnos_items.word
+        if len(expr_items) > 0 and len(expr_items) >= len(word_items):
+            parser_mode = "expression"
+            chosen_items = expr_items
+        elif len(word_items) > 0:
+            parser_mode = "word"
+            chosen_items = word_items
+        else:
+            parser_mode = "none"
+            chosen_items = {}
 
-            item_count = len(chosen_items)
+        item_count = len(chosen_items)
+        with timer.stage("parse_facit_answers") as stage:
             facit_answers = parse_facit_answers(facit_text, expected_count=item_count)
-            facit_count = len(facit_answers)
-
-            numeric_answer_count = 0
-            for answer in facit_answers.values():
-                if parse_decimal_text(answer) is not None or parse_primary_numeric_from_text(answer) is not None:
-                    numeric_answer_count += 1
+            stage["chars"] += len(facit_text)
+            stage["items"] += len(facit_answers)
+        facit_count = len(facit_answers)
+
+        numeric_answer_count = 0
+        for answer in facit_answers.values():
+            if parse_decimal_text(answer) is not None or parse_primary_numeric_from_text(answer) is not None:
+                numeric_answer_count += 1
+
+        if item_count == 0:
+            status = "review"
+            reason = "diagnos_pattern_missing"
+        elif facit_count != item_count:
+            status = "review"
+            reason = "facit_count_mismatch"
+        elif numeric_answer_count != item_count:
+            status = "review"
+            reason = "facit_non_numeric_or_ambiguous"
+        else:
+            status = "candidate_safe"
+            reason = f"auto_{parser_mode}_numeric"
+
+        row: Dict[str, object] = {
+            "code": code,
+            "status": status,
+            "reason": reason,
+            "recommended_parser": parser_mode,
+            "diagnos_pdf": diagnos_pdf.name,
+            "facit_pdf": facit_pdf.name,
+            "item_count": item_count,
+            "facit_count": facit_count,
+            "numeric_answer_count": numeric_answer_count,
+            "metrics": timer.as_dict(),
+        }
+        if keep_parsed:
+            # Only --promote-candidates reads these; write_screening_report() leaves them out.
+            row["parsed"] = {
+                "items": {str(no): text for no, text in chosen_items.items()},
+                "answers": {str(no): text for no, text in facit_answers.items()},
+            }
+        return row
+    except Exception as error:  # pragma: no cover
+        return {
+            "code": code,
+            "status": "review",
+            "reason": "timeout" if isinstance(error, PdfExtractionTimeout) else "processing_error",
+            "recommended_parser": "none",
+            "item_count": 0,
+            "facit_count": 0,
+            "numeric_answer_count": 0,
+            "error": str(error),
+            "metrics": timer.as_dict(),
+        }
 
-            if item_count == 0:
-                status = "review"
-                reason = "diagnos_pattern_missing"
-            elif facit_count != item_count:
-                status = "review"
-                reason = "facit_count_mismatch"
-            elif numeric_answer_count != item_count:
-                status = "review"
-                reason = "facit_non_numeric_or_ambiguous"
-            else:
-                status = "candidate_safe"
-                reason = f"auto_{parser_mode}_numeric"
 
-            rows.append(
-                {
-                    "code": code,
-                    "status": status,
-                    "reason": reason,
-                    "recommended_parser": parser_mode,
-                    "diagnos_pdf": diagnos_pdf.name,
-                    "facit_pdf": facit_pdf.name,
-                    "item_count": item_count,
-                    "facit_count": facit_count,
-                    "numeric_answer_count": numeric_answer_count,
-                }
-            )
-        except Exception as error:  # pragma: no cover
-            rows.append(
-                {
-                    "code": code,
-                    "status": "review",
-                    "reason": "processing_error",
-                    "recommended_parser": "none",
-                    "item_count": 0,
-                    "facit_count": 0,
-                    "numeric_answer_count": 0,
-                    "error": str(error),
-                }
-            )
+def screen_remaining_codes(
+    all_codes: List[str],
+    safe_lookup: Dict[str, str],
+    corpus: CorpusIndex | None = None,
+    executor: Executor | None = None,
+    changed_codes: Set[str] | None = None,
+    checkpoints: CheckpointStore | None = None,
+    resume: bool = False,
+    item_store: ItemStore | None = None,
+    promote: bool = False,
+    timed: List[Tuple[str, str, Dict[str, object]]] | None = None,
+) -> List[Dict[str, object]]:
+    """Screen the codes outside SAFE_BATCHES; with promote, rows carry their parsed items under "parsed".
+
+    Rows reused from the previous report or from checkpoints may have no
+    parsed items, so with promote the candidate_safe codes among them are
+    screened again. (code, "screening", metrics) of the codes screened or
+    resumed here are appended to timed.
+    """
+    if corpus is None:
+        corpus = CorpusIndex.build(NMC_DIR)
+    pending = [code for code in all_codes if code not in safe_lookup]
+    previous = load_previous_screening() if changed_codes is not None else {}
+    to_screen = [
+        code
+        for code in pending
+        if changed_codes is None
+        or code in changed_codes
+        or code not in previous
+        or (promote and previous[code].get("status") == "candidate_safe")
+    ]
 
-    return rows
+    screened: Dict[str, Dict[str, object]] = {}
+    if checkpoints is not None and resume:
+        for code in to_screen:
+            row = checkpoints.load("screening", code)
+            if row is not None and not (promote and row.get("status") == "candidate_safe" and "parsed" not in row):
+                screened[code] = row
+        to_screen = [code for code in to_screen if code not in screened]
+
+    task = functools.partial(screen_code, corpus=corpus, keep_parsed=promote)
+    for code, row in zip(to_screen, map_codes(task, to_screen, executor)):
+        screened[code] = row
+        if checkpoints is not None and row.get("reason") not in FAILED_REASONS:
+            checkpoints.save("screening", code, row)
+    if item_store is not None:
+        for row in screened.values():
+            item_store.upsert_screening(row)
+    if timed is not None:
+        timed.extend((code, "screening", row.get("metrics", {})) for code, row in screened.items())
+    return [screened[code] if code in screened else previous[code] for code in pending]
+
+
+def load_previous_screening() -> Dict[str, Dict[str, object]]:
+    try:
+        with (OUT_DIR / "safe_candidate_screening.json").open("r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    return {str(row.get("code", "")): row for row in payload.get("rows", [])}
 
 
 def write_screening_report(screening: List[Dict[str, object]]) -> None:
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     report_path = OUT_DIR / "safe_candidate_screening.json"
+    screening = [{key: value for key, value in row.items() if key != "parsed"} for row in screening]
     payload = {
         "generated_at_utc": datetime.now(timezone.utc).isoformat(),
         "candidate_safe_count": sum(1 for row in screening if row["status"] == "candidate_safe"),
         "review_count": sum(1 for row in screening if row["status"] != "candidate_safe"),
+        "metrics": summarize_metrics(
+            (str(row.get("code", "")), "screening", row.get("metrics", {})) for row in screening
+        ),
         "rows": screening,
     }
-    with report_path.open("w", encoding="utf-8") as handle:
-        json.dump(payload, handle, ensure_ascii=False, indent=2)
+    write_json_report(report_path, payload)
+
+
+def promote_candidates(screening: List[Dict[str, object]]) -> List[str]:
+    """Write candidate_batch_<parser>.json/csv/_report.json for the candidate_safe codes.
+
+    Rows come from the items and answers screening already parsed, through
+    build_item_rows() like a safe batch, so nothing is extracted again.
+    Candidate files of a parser without candidates are removed. Returns the
+    file stems written or removed.
+    """
+    grouped: Dict[str, List[Dict[str, object]]] = {parser: [] for parser in CANDIDATE_PARSERS}
+    for row in screening:
+        if row.get("status") == "candidate_safe" and isinstance(row.get("parsed"), dict):
+            grouped.setdefault(str(row["recommended_parser"]), []).append(row)
+
+    written: List[str] = []
+    for parser_mode, candidates in grouped.items():
+        batch_name = f"{CANDIDATE_BATCH_PREFIX}{parser_mode}"
+        stem = get_batch_file_stem(batch_name)
+        if not candidates:
+            written.extend(remove_candidate_batches([parser_mode]))
+            continue
+
+        per_code_reports: List[Dict[str, object]] = []
+        rows: List[ItemRow] = []
+        for candidate in candidates:
+            code = str(candidate["code"])
+            parsed = candidate["parsed"]
+            items = {int(no): str(text) for no, text in parsed.get("items", {}).items()}
+            answers = {int(no): str(text) for no, text in parsed.get("answers", {}).items()}
+            code_rows = build_item_rows(
+                code, items, answers, str(candidate.get("diagnos_pdf", "")), str(candidate.get("facit_pdf", ""))
+            )
+            rows.extend(code_rows)
+            per_code_reports.append(
+                {
+                    "code": code,
+                    "parser_mode": parser_mode,
+                    "diagnos_pdf": candidate.get("diagnos_pdf", ""),
+                    "facit_pdf": candidate.get("facit_pdf", ""),
+                    "diagnos_item_count": len(items),
+                    "facit_item_count": len(answers),
+                    **count_item_rows(code_rows),
+                    "screening_reason": candidate.get("reason", ""),
+                }
+            )
+
+        write_batch_rows(batch_name, rows)
+        write_batch_report(
+            batch_name,
+            {
+                "generated_at_utc": datetime.now(timezone.utc).isoformat(),
+                "batch_name": batch_name,
+                "parser_mode": parser_mode,
+                "codes": [report["code"] for report in per_code_reports],
+                "total_rows": len(rows),
+                "high_confidence_rows": sum(1 for row in rows if row.extraction_confidence == "high"),
+                "per_code": per_code_reports,
+            },
+        )
+        written.append(stem)
+    return written
+
+
+def remove_candidate_batches(parser_modes: Iterable[str] = CANDIDATE_PARSERS) -> List[str]:
+    """Delete the candidate_batch_<parser> files of parser_modes; returns the stems removed."""
+    removed: List[str] = []
+    for parser_mode in parser_modes:
+        stem = get_batch_file_stem(f"{CANDIDATE_BATCH_PREFIX}{parser_mode}")
+        paths = [OUT_DIR / f"{stem}.json", OUT_DIR / f"{stem}.csv", OUT_DIR / f"{stem}_report.json"]
+        if any(path.exists() for path in paths):
+            for path in paths:
+                path.unlink(missing_ok=True)
+            removed.append(stem)
+    return removed
 
 
 def build_ncm_mapping_rows(all_codes: List[str], safe_lookup: Dict[str, str]) -> List[Dict[str, object]]:
@@ -721,19 +2119,16 @@ def write_ncm_mapping_outputs(rows: List[Dict[str, object]]) -> None:
     json_path = OUT_DIR / "ncm_code_skill_map.json"
     csv_path = OUT_DIR / "ncm_code_skill_map.csv"
 
-    with json_path.open("w", encoding="utf-8") as handle:
-        json.dump(
-            {
-                "generated_at_utc": datetime.now(timezone.utc).isoformat(),
-                "total_codes": len(rows),
-                "rows": rows,
-            },
-            handle,
-            ensure_ascii=False,
-            indent=2,
-        )
+    write_json_report(
+        json_path,
+        {
+            "generated_at_utc": datetime.now(timezone.utc).isoformat(),
+            "total_codes": len(rows),
+            "rows": rows,
+        },
+    )
 
-    with csv_path.open("w", encoding="utf-8-sig", newline="") as handle:
+    with atomic_output(csv_path, encoding="utf-8-sig", newline="") as handle:
         writer = csv.DictWriter(
             handle,
             fieldnames=[
@@ -755,6 +2150,429 @@ def write_ncm_mapping_outputs(rows: List[Dict[str, object]]) -> None:
             writer.writerow(csv_row)
 
 
+def load_problem_index_rows(path: Path) -> List[Tuple[str, int]]:
+    """Row id -> (code, item_no) from an earlier index."""
+    try:
+        with path.open("r", encoding="utf-8") as handle:
+            payload = json.load(handle)
+    except (OSError, ValueError):
+        return []
+    if not isinstance(payload, dict) or payload.get("version") != PROBLEM_INDEX_VERSION:
+        return []
+    return [(str(key[0]), int(key[1])) for key in payload.get("rows", [])]
+
+
+def build_problem_index(
+    rows: Iterable[Dict[str, object]],
+    previous_rows: List[Tuple[str, int]],
+) -> Dict[str, object]:
+    """Posting lists over batch rows, keeping the row ids of previous_rows.
+
+    rows lists every (code, item_no) that was ever issued an id, so a row
+    keeps its id across runs (also if it disappears and comes back) and ids
+    are never reused. Only rows present now appear in the posting lists.
+    """
+    id_rows: List[Tuple[str, int]] = list(previous_rows)
+    ids = {key: row_id for row_id, key in enumerate(id_rows)}
+    live: Set[int] = set()
+    postings: Dict[str, Dict[str, List[int]]] = {
+        "by_code": {},
+        "by_ability_tag": {},
+        "by_domain": {},
+        "by_operation": {},
+    }
+
+    def post(name: str, value: object, row_id: int) -> None:
+        value = str(value or "").strip()
+        if value:
+            postings[name].setdefault(value, []).append(row_id)
+
+    for row in rows:
+        key = (str(row["ncm_code"]), int(row["item_no"]))
+        row_id = ids.get(key)
+        if row_id is None:
+            row_id = len(id_rows)
+            ids[key] = row_id
+            id_rows.append(key)
+        if row_id in live:
+            continue
+        live.add(row_id)
+        post("by_code", key[0], row_id)
+        post("by_domain", row.get("ncm_domain_tag"), row_id)
+        post("by_operation", row.get("operation_tag"), row_id)
+        for tag in dict.fromkeys(str(row.get("ability_tags", "")).split("|")):
+            post("by_ability_tag", tag, row_id)
+
+    index: Dict[str, object] = {
+        "version": PROBLEM_INDEX_VERSION,
+        "rows": [list(key) for key in id_rows],
+    }
+    for name, lists in postings.items():
+        index[name] = {value: sorted(row_ids) for value, row_ids in sorted(lists.items())}
+    return index
+
+
+def iter_batch_output_rows() -> Iterator[Dict[str, object]]:
+    for batch in SAFE_BATCHES:
+        path = OUT_DIR / f"{get_batch_file_stem(str(batch['name']))}.json"
+        try:
+            with path.open("r", encoding="utf-8") as handle:
+                rows = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        yield from rows
+
+
+def write_problem_index() -> bool:
+    """Rebuild ncm_problem_index.json from the batch files; True if its content changed."""
+    path = OUT_DIR / PROBLEM_INDEX_NAME
+    index = build_problem_index(iter_batch_output_rows(), load_problem_index_rows(path))
+    # One posting list per line keeps the file compact but diffable.
+    lines = [f'{{"version":{index["version"]},']
+    lines.append(f'"rows":{json.dumps(index["rows"], ensure_ascii=False, separators=(",", ":"))},')
+    names = ["by_code", "by_ability_tag", "by_domain", "by_operation"]
+    for position, name in enumerate(names):
+        entries = [
+            f"{json.dumps(value, ensure_ascii=False)}:{json.dumps(row_ids, separators=(',', ':'))}"
+            for value, row_ids in index[name].items()
+        ]
+        closing = "" if position == len(names) - 1 else ","
+        lines.append(f'"{name}":{{\n' + ",\n".join(entries) + "}" + closing)
+    return write_text_if_changed(path, "\n".join(lines) + "}\n")
+
+
+def write_text_if_changed(path: Path, text: str) -> bool:
+    try:
+        if path.read_text(encoding="utf-8") == text:
+            return False
+    except OSError:
+        pass
+    with atomic_output(path) as handle:
+        handle.write(text)
+    return True
+
+
+# Port of toBankEntry() and its helpers in src/lib/ncmBankEntry.js, so the app
+# loads ready entries instead of deriving them per row at startup. Numbers
+# follow JavaScript semantics (float parsing, Number#toString, UTF-16 length);
+# src/lib/ncmBankEntry.test.js checks the output against the JS functions.
+BANK_KNOWN_OPERATIONS = ("addition", "subtraction", "multiplication", "division")
+BANK_NUMBER_PATTERN = re.compile(r"-?(?:[0-9]+|[0-9]*\.[0-9]+)")
+BANK_EXPRESSION_PATTERN = re.compile(r"(-?(?:[0-9]+|[0-9]*[.,][0-9]+))\s*([+\-−×x*÷/])\s*(-?(?:[0-9]+|[0-9]*[.,][0-9]+))")
+BANK_OPERATOR_TYPES = {
+    "+": "addition",
+    "-": "subtraction",
+    "−": "subtraction",
+    "×": "multiplication",
+    "x": "multiplication",
+    "*": "multiplication",
+    "÷": "division",
+    "/": "division",
+}
+BANK_DEFAULT_LEVELS = [
+    ("AS1", 6),
+    ("AS2", 6),
+    ("AS3", 7),
+    ("AS4", 8),
+    ("AS5", 8),
+    ("AS6", 9),
+    ("AS7", 10),
+    ("AS8", 9),
+    ("AS9", 10),
+    ("AS10", 11),
+    ("AS11", 11),
+    ("RP", 10),
+    ("SA", 9),
+]
+
+
+def js_number(value: float) -> int | float:
+    """A parsed number as JSON should carry it: integral values without '.0'."""
+    return int(value) if value.is_integer() else value
+
+
+def js_number_string(value: float) -> str:
+    """Number.prototype.toString() for finite values."""
+    if value == 0:
+        return "0"
+    digits, exponent = Decimal(repr(float(value))).normalize().as_tuple()[1:]
+    digit_text = "".join(map(str, digits))
+    point = len(digit_text) + exponent  # position of the decimal point in digit_text
+    sign = "-" if value < 0 else ""
+    if -6 < point <= 21:
+        if point <= 0:
+            return f"{sign}0.{'0' * -point}{digit_text}"
+        if point >= len(digit_text):
+            return f"{sign}{digit_text}{'0' * (point - len(digit_text))}"
+        return f"{sign}{digit_text[:point]}.{digit_text[point:]}"
+    mantissa = digit_text[0] + (f".{digit_text[1:]}" if len(digit_text) > 1 else "")
+    return f"{sign}{mantissa}e{'+' if point - 1 >= 0 else '-'}{abs(point - 1)}"
+
+
+def bank_parse_number(value: object) -> float | None:
+    normalized = re.sub(r"\s+", "", str(value or "").strip()).replace(",", ".", 1)
+    if not BANK_NUMBER_PATTERN.fullmatch(normalized):
+        return None
+    number = float(normalized)
+    return number if math.isfinite(number) else None
+
+
+def bank_parse_expression(text: str) -> Tuple[float, float, str] | None:
+    match = BANK_EXPRESSION_PATTERN.fullmatch(str(text or "").strip())
+    if not match:
+        return None
+    a = bank_parse_number(match.group(1))
+    b = bank_parse_number(match.group(3))
+    if a is None or b is None:
+        return None
+    return a, b, BANK_OPERATOR_TYPES[match.group(2)]
+
+
+def bank_resolve_operation(operation_tag: str, ability_tags: List[str], expression_type: str) -> str:
+    if operation_tag in BANK_KNOWN_OPERATIONS:
+        return operation_tag
+    if expression_type in BANK_KNOWN_OPERATIONS:
+        return expression_type
+    present = [name for name in BANK_KNOWN_OPERATIONS if f"op_{name}" in ability_tags]
+    return present[0] if len(present) == 1 else "addition"
+
+
+def bank_count_digits(value: float) -> int:
+    return max(1, len(js_number_string(abs(value)).replace(".", "", 1)))
+
+
+def bank_expression_level(operation: str, a: float, b: float) -> int:
+    max_digits = max(bank_count_digits(a), bank_count_digits(b))
+    if not a.is_integer() or not b.is_integer():
+        return {"multiplication": 10, "division": 11}.get(operation, 9)
+    if operation in ("addition", "subtraction"):
+        return 2 if max_digits <= 1 else 6 if max_digits == 2 else 11 if max_digits == 3 else 12
+    if operation == "multiplication":
+        return 4 if max_digits <= 1 else 8 if max_digits == 2 else 11
+    if operation == "division":
+        return 5 if max_digits <= 2 else 8 if max_digits == 3 else 10
+    return 6
+
+
+def bank_default_level(code: str) -> int:
+    for prefix, level in BANK_DEFAULT_LEVELS:
+        if code.startswith(prefix):
+            return level
+    return 6
+
+
+def bank_prompt_time_sec(question_text: str) -> int:
+    text = str(question_text or "").strip()
+    text_length = len(text.encode("utf-16-le")) // 2
+    words = len(text.split())
+    if text_length <= 16 and words <= 3:
+        return 18
+    if words <= 8:
+        return 24
+    if words <= 18:
+        return 34
+    return 44
+
+
+def build_bank_entry(row: Dict[str, object]) -> Dict[str, object] | None:
+    """The entry toBankEntry() derives from a batch row, or None when it drops the row."""
+    code = normalize_ncm_code(str(row.get("ncm_code") or ""))
+    question_text = str(row.get("question_text") or "").strip()
+    expected_answer = bank_parse_number(row.get("expected_answer"))
+    if not code or not question_text or expected_answer is None:
+        return None
+
+    operation_tag = str(row.get("operation_tag") or "").strip()
+    domain_tag = str(row.get("ncm_domain_tag") or "").strip()
+    ability_tags = [tag.strip() for tag in str(row.get("ability_tags") or "").split("|") if tag.strip()]
+    expression = bank_parse_expression(question_text)
+    operation = bank_resolve_operation(operation_tag, ability_tags, expression[2] if expression else "")
+    try:
+        item_no = float(str(row.get("item_no") or 0).strip() or 0)
+    except ValueError:
+        item_no = 0.0
+    item_no_value = js_number(item_no) if math.isfinite(item_no) else 0
+
+    entry: Dict[str, object] = {
+        "ncmCode": code,
+        "itemNo": item_no_value,
+        "questionText": question_text,
+        "expectedAnswer": js_number(expected_answer),
+        "operationTag": operation_tag or (operation if operation in BANK_KNOWN_OPERATIONS else "mixed"),
+        "domainTag": domain_tag or "unknown",
+        "abilityTags": ability_tags,
+        "type": operation,
+        "values": {},
+        "magnitude": {},
+        "level": bank_default_level(code),
+        "estimatedTimeSec": bank_prompt_time_sec(question_text),
+        "skillTag": f"ncm_{code.lower()}_item_{item_no_value}",
+    }
+    if expression:
+        a, b, _ = expression
+        entry["values"] = {"a": js_number(a), "b": js_number(b)}
+        entry["magnitude"] = {"a_digits": bank_count_digits(a), "b_digits": bank_count_digits(b)}
+        entry["level"] = bank_expression_level(operation, a, b)
+    return entry
+
+
+def format_bank_entries(entries: List[Dict[str, object]]) -> str:
+    compact = functools.partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+    return "[\n" + ",\n".join(map(compact, entries)) + "\n]\n" if entries else "[]\n"
+
+
+def write_problem_bank() -> bool:
+    """Rebuild ncm_problem_bank.json from the batch files; True if its content changed."""
+    entries = [entry for entry in map(build_bank_entry, iter_batch_output_rows()) if entry is not None]
+    return write_text_if_changed(OUT_DIR / PROBLEM_BANK_NAME, format_bank_entries(entries))
+
+
+def write_problem_shards() -> List[str]:
+    """Write the bank entries per NCM code to shards/<code>.json plus shards/manifest.json.
+
+    The manifest lists the shards in bank order, so concatenating the shards
+    of some codes in manifest order gives their entries in ncm_problem_bank.json.
+    Shards of codes without entries are removed. Returns the changed paths
+    relative to the out dir.
+    """
+    shard_dir = OUT_DIR / SHARD_DIR_NAME
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shards: Dict[str, List[Dict[str, object]]] = {}
+    for entry in map(build_bank_entry, iter_batch_output_rows()):
+        if entry is not None:
+            shards.setdefault(str(entry["ncmCode"]), []).append(entry)
+
+    changed: List[str] = []
+    manifest_shards: Dict[str, Dict[str, object]] = {}
+    for code, entries in shards.items():
+        file_name = f"{code}.json"
+        if write_text_if_changed(shard_dir / file_name, format_bank_entries(entries)):
+            changed.append(f"{SHARD_DIR_NAME}/{file_name}")
+        manifest_shards[code] = {
+            "file": file_name,
+            "entries": len(entries),
+            "domain_tags": sorted({str(entry["domainTag"]) for entry in entries}),
+            "operation_tags": sorted({str(entry["operationTag"]) for entry in entries}),
+            "ability_tags": sorted({str(tag) for entry in entries for tag in entry["abilityTags"]}),
+        }
+
+    for path in shard_dir.glob("*.json"):
+        if path.name != SHARD_MANIFEST_NAME and path.stem not in shards:
+            path.unlink()
+            changed.append(f"{SHARD_DIR_NAME}/{path.name}")
+
+    # One shard per line, like ncm_problem_index.json.
+    compact = functools.partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+    header = {"version": SHARD_MANIFEST_VERSION, "total_entries": sum(map(len, shards.values()))}
+    entries_text = ",\n".join(f"{compact(code)}:{compact(entry)}" for code, entry in manifest_shards.items())
+    manifest_text = compact(header)[:-1] + ',"shards":{\n' + entries_text + "}}\n"
+    if write_text_if_changed(shard_dir / SHARD_MANIFEST_NAME, manifest_text):
+        changed.append(f"{SHARD_DIR_NAME}/{SHARD_MANIFEST_NAME}")
+    return changed
+
+
+def verify_expression_answers(rows: Iterable[Tuple[str, Dict[str, object]]]) -> Dict[str, object]:
+    """Compare computed and facit answers for every (batch, row) whose question evaluates.
+
+    A computed value that equals the facit answer once rounded to the facit's
+    decimals counts as rounded rather than as a mismatch.
+    """
+    counts = {"expression_rows": 0, "matched": 0, "rounded": 0, "mismatched": 0, "without_facit": 0}
+    mismatches: List[Dict[str, object]] = []
+    for batch_name, row in rows:
+        computed = evaluate_expression(str(row.get("question_text", "")))
+        if computed is None:
+            continue
+        counts["expression_rows"] += 1
+        facit = None
+        if row.get("answer_source") in {"facit", "facit_numeric_text"}:
+            facit = parse_decimal_text(str(row.get("expected_answer", "")))
+        if facit is None:
+            counts["without_facit"] += 1
+            continue
+        if computed == facit:
+            counts["matched"] += 1
+            continue
+        exponent = min(facit.as_tuple().exponent, 0)
+        try:
+            rounded = computed.quantize(Decimal(1).scaleb(exponent), rounding=ROUND_HALF_UP)
+        except InvalidOperation:
+            rounded = None  # the quantized value needs more digits than the context precision
+        if rounded == facit:
+            counts["rounded"] += 1
+            continue
+        counts["mismatched"] += 1
+        mismatches.append(
+            {
+                "batch": batch_name,
+                "ncm_code": row.get("ncm_code", ""),
+                "item_no": row.get("item_no", 0),
+                "question_text": row.get("question_text", ""),
+                "facit_answer": format_decimal(facit),
+                "computed_answer": format_decimal(computed),
+            }
+        )
+    return {**counts, "mismatches": mismatches}
+
+
+def iter_verification_rows() -> Iterator[Tuple[str, Dict[str, object]]]:
+    """Rows of the safe batch files and of any candidate batch files, with their batch name."""
+    batch_names = [str(batch["name"]) for batch in SAFE_BATCHES]
+    batch_names += [f"{CANDIDATE_BATCH_PREFIX}{parser}" for parser in CANDIDATE_PARSERS]
+    for batch_name in batch_names:
+        try:
+            with (OUT_DIR / f"{get_batch_file_stem(batch_name)}.json").open("r", encoding="utf-8") as handle:
+                rows = json.load(handle)
+        except (OSError, ValueError):
+            continue
+        for row in rows:
+            yield batch_name, row
+
+
+def write_answer_verification() -> bool:
+    """Rebuild ncm_answer_verification.json; True if its content changed."""
+    payload = {
+        "generated_at_utc": datetime.now(timezone.utc).isoformat(),
+        **verify_expression_answers(iter_verification_rows()),
+    }
+    return write_json_report(OUT_DIR / ANSWER_VERIFICATION_NAME, payload)
+
+
+def format_run_metrics_lines(run_metrics: Dict[str, object]) -> List[str]:
+    lines = [
+        f"Tidsåtgång: {float(run_metrics.get('total_ms', 0.0)):.0f} ms",
+        "",
+        "| Steg | ms | Sidor | Tecken | Items | Tecken/s |",
+        "|---|---:|---:|---:|---:|---:|",
+    ]
+    for name, record in dict(run_metrics.get("stages", {})).items():
+        lines.append(
+            "| {name} | {ms:.1f} | {pages} | {chars} | {items} | {rate} |".format(
+                name=name,
+                ms=float(record.get("wall_ms", 0.0)),
+                pages=record.get("pages", 0),
+                chars=record.get("chars", 0),
+                items=record.get("items", 0),
+                rate=record.get("chars_per_s", ""),
+            )
+        )
+    slowest = list(run_metrics.get("slowest_codes", []))
+    if slowest:
+        lines.extend(
+            [
+                "",
+                f"Långsammaste koder (topp {len(slowest)}):",
+                "",
+                "| Kod | Källa | ms |",
+                "|---|---|---:|",
+            ]
+        )
+        for entry in slowest:
+            lines.append(f"| {entry.get('code', '')} | {entry.get('source', '')} | {float(entry.get('total_ms', 0.0)):.1f} |")
+    lines.append("")
+    return lines
+
+
 def append_import_log(
     run_timestamp: str,
     batch_summaries: List[Dict[str, object]],
@@ -762,7 +2580,10 @@ def append_import_log(
     safe_lookup: Dict[str, str],
     screening: List[Dict[str, object]],
     mapping_rows: List[Dict[str, object]],
+    run_metrics: Dict[str, object] | None = None,
+    replace_section: bool = False,
 ) -> None:
+    """Append a section for this run; with replace_section an existing section of run_timestamp is rewritten."""
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     log_path = OUT_DIR / "IMPORT_LOG.md"
 
@@ -842,49 +2663,706 @@ def append_import_log(
             "",
         ]
     )
+    if run_metrics:
+        section_lines.extend(format_run_metrics_lines(run_metrics))
 
     header = "# NMC Importlogg\n\nLöpande logg för vilka NMC-diagnoser som redan är hanterade i safe-batcher.\n\n"
     if not log_path.exists():
         log_path.write_text(header + "\n".join(section_lines) + "\n", encoding="utf-8")
         return
 
+    if replace_section:
+        text = log_path.read_text(encoding="utf-8")
+        start = text.find(f"\n{section_lines[0]}\n")
+        if start >= 0:
+            end = text.find("\n## ", start + 1)
+            rest = text[end + 1 :] if end >= 0 else ""
+            with atomic_output(log_path) as handle:
+                handle.write(text[: start + 1] + "\n".join(section_lines) + "\n" + ("\n" + rest if rest else ""))
+            return
+
     with log_path.open("a", encoding="utf-8") as handle:
         handle.write("\n".join(section_lines))
         handle.write("\n")
 
 
-def main() -> None:
+def build_safe_lookup() -> Dict[str, str]:
+    safe_lookup: Dict[str, str] = {}
+    for batch in SAFE_BATCHES:
+        for code in batch["codes"]:
+            safe_lookup[normalize_ncm_code(code)] = str(batch["name"])
+    return safe_lookup
+
+
+def compute_script_version() -> str:
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()[:16]
+
+
+def compute_mapping_fingerprint() -> str:
+    payload = json.dumps(
+        {"manual": MANUAL_NCM_MAP, "prefix_rules": PREFIX_RULES},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest() -> Dict[str, object]:
+    try:
+        with (OUT_DIR / MANIFEST_NAME).open("r", encoding="utf-8") as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def fingerprint_corpus_files(
+    corpus: CorpusIndex,
+    previous_files: Dict[str, Dict[str, object]],
+) -> Dict[str, Dict[str, object]]:
+    """sha256 per PDF, reusing the previous manifest hash when size and mtime match."""
+    files: Dict[str, Dict[str, object]] = {}
+    for entry in corpus.entries.values():
+        for item in (entry.diagnos, entry.facit):
+            if item is None:
+                continue
+            previous = previous_files.get(item.path.name, {})
+            if previous.get("size") == item.size and previous.get("mtime_ns") == item.mtime_ns:
+                content_hash = str(previous.get("sha256", ""))
+            else:
+                content_hash = hash_file(item.path)
+            if corpus.cache is not None:
+                corpus.cache.remember_hash(item.path, item.size, item.mtime_ns, content_hash)
+            files[item.path.name] = {"size": item.size, "mtime_ns": item.mtime_ns, "sha256": content_hash}
+    return dict(sorted(files.items()))
+
+
+def build_code_records(
+    corpus: CorpusIndex,
+    files: Dict[str, Dict[str, object]],
+    safe_lookup: Dict[str, str],
+    mapping_fingerprint: str,
+    script_version: str,
+) -> Dict[str, Dict[str, object]]:
+    parser_by_batch = {str(batch["name"]): str(batch["parser"]) for batch in SAFE_BATCHES}
+    records: Dict[str, Dict[str, object]] = {}
+    for code in sorted(set(corpus.codes()) | set(safe_lookup)):
+        entry = corpus.entries.get(code)
+        hashes = {}
+        for kind in ("diagnos", "facit"):
+            item = getattr(entry, kind) if entry is not None else None
+            hashes[kind] = str(files[item.path.name]["sha256"]) if item is not None else ""
+        batch_name = safe_lookup.get(code, "")
+        records[code] = {
+            "diagnos_sha256": hashes["diagnos"],
+            "facit_sha256": hashes["facit"],
+            "batch": batch_name,
+            "parser_mode": parser_by_batch.get(batch_name, "auto"),
+            "mapping_fingerprint": mapping_fingerprint,
+            "script_version": script_version,
+        }
+    return records
+
+
+def compute_mapping_output_key(all_codes: List[str], safe_lookup: Dict[str, str], records: Dict[str, object]) -> str:
+    payload = json.dumps(
+        {
+            "codes": all_codes,
+            "safe_lookup": safe_lookup,
+            "fingerprints": sorted({str(record["mapping_fingerprint"]) for record in records.values()}),
+            "script_versions": sorted({str(record["script_version"]) for record in records.values()}),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def write_manifest(
+    files: Dict[str, Dict[str, object]],
+    records: Dict[str, Dict[str, object]],
+    mapping_output_key: str,
+    script_version: str,
+    mapping_fingerprint: str,
+) -> None:
     OUT_DIR.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "script_version": script_version,
+        "mapping_fingerprint": mapping_fingerprint,
+        "mapping_output_key": mapping_output_key,
+        "files": files,
+        "codes": records,
+    }
+    with atomic_output(OUT_DIR / MANIFEST_NAME) as handle:
+        json.dump(payload, handle, ensure_ascii=False, indent=2)
 
-    all_codes = discover_all_codes()
-    safe_lookup: Dict[str, str] = {}
-    batch_summaries: List[Dict[str, object]] = []
 
+def write_run_report(
+    stages: Set[str],
+    batch_summaries: List[Dict[str, object]],
+    cache_mode: str,
+    changed_codes: Set[str] | None,
+    rewritten: List[str],
+    run_metrics: Dict[str, object],
+    exit_status: int,
+) -> None:
+    """Write this run's cache counters and metrics, which the batch reports only refresh on content changes."""
+    batches = {
+        str(summary.get("batch_name", "")): {
+            "pdf_text_cache": summary.get("pdf_text_cache", {}),
+            "metrics": summary.get("metrics", {}),
+            "failed_codes": [str(entry.get("code", "")) for entry in summary.get("failed_codes", [])],
+        }
+        for summary in batch_summaries
+    }
+    payload = {
+        "generated_at_utc": datetime.now(timezone.utc).isoformat(),
+        "stages": sorted(stages),
+        "changed_codes": None if changed_codes is None else sorted(changed_codes, key=natural_code_key),
+        "rewritten": rewritten,
+        "exit_status": exit_status,
+        "pdf_text_cache": sum_cache_stats(batches.values(), cache_mode),
+        "metrics": run_metrics,
+        "batches": batches,
+    }
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    with atomic_output(OUT_DIR / RUN_REPORT_NAME) as handle:
+        json.dump(payload, handle, ensure_ascii=False, indent=2)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Extract safe NMC batches into structured files.")
+    parser.add_argument(
+        "--nmc-dir",
+        type=Path,
+        default=NMC_DIR,
+        help="Folder with the diagnos/facit PDFs (default: NMC/).",
+    )
+    parser.add_argument(
+        "--out-dir",
+        type=Path,
+        default=None,
+        help="Folder for generated outputs (default: <nmc-dir>/processed).",
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Bypass the extracted PDF text cache (neither read nor write entries).",
+    )
+    cache_group.add_argument(
+        "--rebuild-cache",
+        action="store_true",
+        help="Ignore cached PDF text, re-extract every PDF and rewrite the cache.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Extract codes in N worker processes (0 = one per CPU). Output is identical to a serial run.",
+    )
+    parser.add_argument(
+        "--pdf-timeout",
+        type=float,
+        default=PdfExtractionLimits.timeout_s,
+        metavar="SECONDS",
+        help="Wall-clock limit for extracting one PDF; the code is reported as timeout (0 = no limit).",
+    )
+    parser.add_argument(
+        "--pdf-memory-mb",
+        type=int,
+        default=PdfExtractionLimits.memory_mb,
+        metavar="MB",
+        help="Address-space cap for the PDF extraction process (0 = no cap). "
+        "With both limits 0, PDFs are extracted in-process.",
+    )
+    stage_group = parser.add_mutually_exclusive_group()
+    stage_group.add_argument(
+        "--mapping-only",
+        action="store_true",
+        help="Only regenerate ncm_code_skill_map.json/csv (no PDF content is read).",
+    )
+    stage_group.add_argument(
+        "--screen-only",
+        action="store_true",
+        help="Only screen the codes outside SAFE_BATCHES.",
+    )
+    stage_group.add_argument(
+        "--batches-only",
+        action="store_true",
+        help="Only extract the SAFE_BATCHES outputs.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help=f"Only reprocess codes whose inputs changed since the last run (see {MANIFEST_NAME}).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Reuse codes checkpointed by an interrupted run (see {CHECKPOINT_DIR_NAME}/) and process the rest.",
+    )
+    parser.add_argument(
+        "--sqlite",
+        action="store_true",
+        help=f"Also keep {SQLITE_NAME} (items, codes, ability_tags, screening) up to date, per code.",
+    )
+    parser.add_argument(
+        "--promote-candidates",
+        action="store_true",
+        help="Write candidate_batch_<parser>.json/csv for candidate_safe codes from the screening parse "
+        "(screening runs without it remove these files).",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running: poll NMC/*.pdf and rerun incrementally for the codes whose PDFs change.",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=0.2,
+        metavar="SECONDS",
+        help="Polling interval for --watch (default: 0.2); a change is handled after two equal polls.",
+    )
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    serve_parser = commands.add_parser(
+        "serve",
+        help="Keep the corpus and extracted texts in memory and answer extraction requests over local HTTP.",
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to bind (default: 127.0.0.1).")
+    serve_parser.add_argument("--port", type=int, default=8765, help="Port to bind (default: 8765, 0 = any free port).")
+    query_parser = commands.add_parser(
+        "query",
+        help="Search the normalized diagnos/facit texts through the inverted text index.",
+    )
+    query_parser.add_argument(
+        "terms",
+        nargs="*",
+        help="Words or phrases every matching code must contain (case-insensitive).",
+    )
+    query_parser.add_argument(
+        "--not",
+        dest="exclude",
+        action="append",
+        default=[],
+        metavar="TEXT",
+        help="Drop codes that contain this word or phrase (repeatable).",
+    )
+    query_parser.add_argument("--regex", help="Regular expression run over the texts of the codes the terms leave.")
+    query_parser.add_argument("--kind", choices=["diagnos", "facit"], help="Only search this kind of PDF.")
+    query_parser.add_argument("--codes-only", action="store_true", help="Print matching codes without hits.")
+    query_parser.add_argument("--max-hits", type=int, default=3, help="Hits printed per code (default: 3).")
+    query_parser.add_argument(
+        "--no-update",
+        action="store_true",
+        help="Answer from the index as stored, without indexing new or changed PDFs first.",
+    )
+    return parser
+
+
+def selected_stages(args: argparse.Namespace) -> Set[str]:
+    if args.mapping_only:
+        return {"mapping"}
+    if args.screen_only:
+        return {"screening"}
+    if args.batches_only:
+        return {"batches"}
+    return set(ALL_STAGES)
+
+
+def run_batch_stage(
+    corpus: CorpusIndex,
+    executor: Executor | None,
+    changed_codes: Set[str] | None,
+    rewritten: List[str],
+    checkpoints: CheckpointStore | None = None,
+    resume: bool = False,
+    item_store: ItemStore | None = None,
+    timed: List[Tuple[str, str, Dict[str, object]]] | None = None,
+) -> List[Dict[str, object]]:
+    batch_summaries: List[Dict[str, object]] = []
     for batch in SAFE_BATCHES:
-        _, summary = process_batch(batch)
+        summary = None
+        if changed_codes is not None and not changed_codes.intersection(batch["codes"]):
+            summary = load_previous_batch_summary(batch)
+        if summary is None:
+            summary = process_batch(
+                batch,
+                corpus=corpus,
+                executor=executor,
+                changed_codes=changed_codes,
+                checkpoints=checkpoints,
+                resume=resume,
+                item_store=item_store,
+                timed=timed,
+            )
+            rewritten.append(get_batch_file_stem(str(batch["name"])))
         batch_summaries.append(summary)
-        for code in batch["codes"]:
-            safe_lookup[normalize_ncm_code(code)] = str(batch["name"])
+    return batch_summaries
+
 
-    screening = screen_remaining_codes(all_codes, safe_lookup)
+def run_screening_stage(
+    corpus: CorpusIndex,
+    safe_lookup: Dict[str, str],
+    executor: Executor | None,
+    changed_codes: Set[str] | None,
+    previous_records: Dict[str, Dict[str, object]],
+    rewritten: List[str],
+    checkpoints: CheckpointStore | None = None,
+    resume: bool = False,
+    item_store: ItemStore | None = None,
+    promote: bool = False,
+    timed: List[Tuple[str, str, Dict[str, object]]] | None = None,
+) -> List[Dict[str, object]]:
+    if not promote:
+        # Candidate batches belong to the screening that promoted them; a later screening drops them.
+        rewritten.extend(remove_candidate_batches())
+    all_codes = corpus.codes()
+    pending_codes = [code for code in all_codes if code not in safe_lookup]
+    previous_pending = sorted(code for code, record in previous_records.items() if not record.get("batch"))
+    if changed_codes is not None and previous_pending == pending_codes and not changed_codes.intersection(pending_codes):
+        previous_screening = load_previous_screening()
+        if set(previous_screening) == set(pending_codes) and not (
+            promote and any(row.get("status") == "candidate_safe" for row in previous_screening.values())
+        ):
+            return [previous_screening[code] for code in pending_codes]
+
+    screening = screen_remaining_codes(
+        all_codes,
+        safe_lookup,
+        corpus=corpus,
+        executor=executor,
+        changed_codes=changed_codes,
+        checkpoints=checkpoints,
+        resume=resume,
+        item_store=item_store,
+        promote=promote,
+        timed=timed,
+    )
     write_screening_report(screening)
+    rewritten.append("safe_candidate_screening")
+    if promote:
+        rewritten.extend(promote_candidates(screening))
+    return screening
 
-    mapping_rows = build_ncm_mapping_rows(all_codes, safe_lookup)
-    write_ncm_mapping_outputs(mapping_rows)
 
-    run_timestamp = datetime.now(timezone.utc).isoformat()
+def backfill_item_store(store: ItemStore) -> None:
+    """Fill a new or rebuilt ncm_items.sqlite from the batch and screening files on disk."""
+    for batch in SAFE_BATCHES:
+        for code, result in load_previous_batch(str(batch["name"])).items():
+            store.replace_items(code, result["rows"])
+    for row in load_previous_screening().values():
+        store.upsert_screening(row)
+
+
+def update_item_store(
+    store: ItemStore,
+    mapping_rows: List[Dict[str, object]],
+    all_codes: List[str],
+    safe_lookup: Dict[str, str],
+) -> None:
+    if store.created:
+        backfill_item_store(store)
+    store.sync_codes(mapping_rows)
+    store.prune("codes", all_codes)
+    store.prune("ability_tags", all_codes)
+    store.prune("items", safe_lookup)
+    store.prune("screening", [code for code in all_codes if code not in safe_lookup])
+
+
+def configure_paths(nmc_dir: Path, out_dir: Path | None = None) -> None:
+    global NMC_DIR, OUT_DIR
+    NMC_DIR = nmc_dir.resolve()
+    OUT_DIR = (out_dir or NMC_DIR / "processed").resolve()
+
+
+def build_text_cache(args: argparse.Namespace) -> PdfTextCache:
+    """The PDF text cache under OUT_DIR with the cache mode and extraction limits of args."""
+    mode = "off" if args.no_cache else "rebuild" if args.rebuild_cache else "use"
+    limits = PdfExtractionLimits(timeout_s=max(args.pdf_timeout, 0.0), memory_mb=max(args.pdf_memory_mb, 0))
+    return PdfTextCache(OUT_DIR / ".cache" / "pdf_text", mode=mode, limits=limits)
+
+
+def natural_code_key(code: str) -> Tuple[str, int]:
+    match = re.fullmatch(r"([A-Z]*)(\d*)", code)
+    if not match:
+        return code, 0
+    return match.group(1), int(match.group(2) or 0)
+
+
+def snapshot_pdf_stats(nmc_dir: Path) -> Dict[str, Tuple[int, int]]:
+    """(size, mtime_ns) per NMC/*.pdf, from one directory scan."""
+    stats: Dict[str, Tuple[int, int]] = {}
+    with os.scandir(nmc_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".pdf") and entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+def watch_corpus(args: argparse.Namespace) -> None:
+    """Poll NMC/*.pdf and rerun incrementally for the codes whose PDFs changed.
+
+    A change is acted on once two polls in a row see the same sizes and
+    mtimes, so a PDF that is still being copied is not read half-written.
+    Every update refreshes one IMPORT_LOG.md section for the watch session.
+    """
+    args.incremental = True
+    session_timestamp = datetime.now(timezone.utc).isoformat()
+    run_extraction(args, log_timestamp=session_timestamp)
+    known = snapshot_pdf_stats(NMC_DIR)
+    previous = known
+    print(f"Watching {NMC_DIR} for PDF changes (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(args.watch_interval)
+            current = snapshot_pdf_stats(NMC_DIR)
+            settled = current == previous
+            previous = current
+            if current == known or not settled:
+                continue
+            changed_names = {name for name in current.keys() | known.keys() if current.get(name) != known.get(name)}
+            known = current
+            codes = sorted({code for code, _ in map(extract_code_and_kind, map(Path, changed_names)) if code})
+            if not codes:
+                continue
+            started = time.perf_counter()
+            print(f"Changed PDFs for {', '.join(codes)}")
+            run_extraction(args, log_timestamp=session_timestamp)
+            print(f"Updated in {(time.perf_counter() - started) * 1000:.0f} ms")
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    configure_paths(args.nmc_dir, args.out_dir)
+    if args.command == "serve":
+        from nmc_extract_service import serve
+
+        serve(args)
+        return 0
+    if args.command == "query":
+        from nmc_text_index import run_query
+
+        run_query(args)
+        return 0
+    if args.watch:
+        watch_corpus(args)
+        return 0
+    return run_extraction(args)
+
+
+def require_pdfs(all_codes: List[str]) -> None:
+    """Stop before any output is written when NMC/ holds no PDFs at all."""
+    if not all_codes:
+        raise SystemExit(f"No NMC PDFs found in {NMC_DIR}; outputs in {OUT_DIR} left unchanged.")
+
+
+def report_batch_failures(batch_summaries: List[Dict[str, object]]) -> int:
+    """Print the SAFE_BATCHES codes that failed this run; returns the exit status."""
+    failures = [entry for summary in batch_summaries for entry in summary.get("failed_codes", [])]
+    for entry in failures:
+        kept = "kept previous rows" if entry["kept_previous_rows"] else "no previous rows"
+        print(f"Failed to extract {entry['code']} ({entry['reason']}: {entry['error']}); {kept}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def run_extraction(args: argparse.Namespace, log_timestamp: str | None = None) -> int:
+    """One pipeline run; with log_timestamp the IMPORT_LOG.md section of that timestamp is replaced.
+
+    Returns the exit status: 1 when a SAFE_BATCHES code failed to extract, else 0.
+    """
+    run_started = time.perf_counter()
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    remove_orphaned_temp_files(OUT_DIR)
+
+    stages = selected_stages(args)
+    safe_lookup = build_safe_lookup()
+
+    if stages == {"mapping"}:
+        # Fast path: the mapping only depends on file names and the mapping tables.
+        all_codes = CorpusIndex.build(NMC_DIR).codes()
+        require_pdfs(all_codes)
+        mapping_rows = build_ncm_mapping_rows(all_codes, safe_lookup)
+        write_ncm_mapping_outputs(mapping_rows)
+        if args.sqlite:
+            item_store = ItemStore(OUT_DIR / SQLITE_NAME)
+            try:
+                update_item_store(item_store, mapping_rows, all_codes, safe_lookup)
+            finally:
+                item_store.close()
+        print(f"Wrote NCM mapping for {len(all_codes)} codes to {OUT_DIR}")
+        return 0
+
+    cache = build_text_cache(args)
+    corpus = CorpusIndex.build(NMC_DIR, cache=cache)
+
+    all_codes = corpus.codes()
+    require_pdfs(all_codes)
+    previous_manifest = load_manifest()
+    previous_records: Dict[str, Dict[str, object]] = dict(previous_manifest.get("codes", {}))
+    script_version = compute_script_version()
+    mapping_fingerprint = compute_mapping_fingerprint()
+    files = fingerprint_corpus_files(corpus, previous_manifest.get("files", {}))
+    records = build_code_records(corpus, files, safe_lookup, mapping_fingerprint, script_version)
+    mapping_output_key = compute_mapping_output_key(all_codes, safe_lookup, records)
+
+    changed_codes: Set[str] | None = None
+    if args.incremental:
+        changed_codes = {code for code, record in records.items() if previous_records.get(code) != record}
+
+    checkpoints = CheckpointStore(OUT_DIR / CHECKPOINT_DIR_NAME, records)
+    if not args.resume:
+        checkpoints.clear()
+
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    executor: Executor | None = None
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(max_workers=jobs)
+
+    batch_summaries: List[Dict[str, object]] = []
+    screening: List[Dict[str, object]] = []
+    rewritten: List[str] = []
+    timed: List[Tuple[str, str, Dict[str, object]]] = []
+    item_store = ItemStore(OUT_DIR / SQLITE_NAME) if args.sqlite else None
+
+    try:
+        if "batches" in stages:
+            batch_summaries = run_batch_stage(
+                corpus,
+                executor,
+                changed_codes,
+                rewritten,
+                checkpoints,
+                args.resume,
+                item_store,
+                timed,
+            )
+        if "screening" in stages:
+            screening = run_screening_stage(
+                corpus,
+                safe_lookup,
+                executor,
+                changed_codes,
+                previous_records if args.incremental else {},
+                rewritten,
+                checkpoints,
+                args.resume,
+                item_store,
+                args.promote_candidates,
+                timed,
+            )
+
+        if "batches" in stages and write_problem_index():
+            rewritten.append(PROBLEM_INDEX_NAME)
+        if "batches" in stages and write_problem_bank():
+            rewritten.append(PROBLEM_BANK_NAME)
+        if "batches" in stages:
+            rewritten.extend(write_problem_shards())
+
+        if write_answer_verification():
+            rewritten.append(ANSWER_VERIFICATION_NAME)
+
+        mapping_rows = build_ncm_mapping_rows(all_codes, safe_lookup)
+        if "mapping" in stages:
+            if not args.incremental or previous_manifest.get("mapping_output_key") != mapping_output_key:
+                write_ncm_mapping_outputs(mapping_rows)
+                rewritten.append("ncm_code_skill_map")
+        else:
+            mapping_output_key = str(previous_manifest.get("mapping_output_key", ""))
+
+        if item_store is not None:
+            update_item_store(item_store, mapping_rows, all_codes, safe_lookup)
+            if item_store.changed_codes:
+                rewritten.append(SQLITE_NAME)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if item_store is not None:
+            item_store.close()
+
+    # Only codes and batches this run processed count; reused reports carry the metrics of earlier runs.
+    run_metrics = summarize_metrics(
+        timed,
+        extra_stages=[
+            {"write_outputs": dict(summary.get("metrics", {})).get("stages", {}).get("write_outputs", {})}
+            for summary in batch_summaries
+            if get_batch_file_stem(str(summary.get("batch_name", ""))) in rewritten
+        ],
+    )
+    run_metrics["total_ms"] = round((time.perf_counter() - run_started) * 1000, 3)
+
+    if rewritten:
+        cache.evict_stale(str(item["sha256"]) for item in files.values())
+    from nmc_text_index import open_text_index
+
+    text_index = open_text_index(cache)
+    text_index.update(corpus, loaded_only=True)
+    text_index.save()
+
+    # Only refresh manifest records for codes whose outputs this run produced, so a
+    # later --incremental run still sees stale outputs from skipped stages. Codes
+    # that failed or timed out get no record, so the next --incremental run retries them.
+    failed_codes = {
+        str(report.get("code", ""))
+        for report in [
+            *(entry for summary in batch_summaries for entry in summary.get("per_code", [])),
+            *(entry for summary in batch_summaries for entry in summary.get("failed_codes", [])),
+            *screening,
+        ]
+        if report.get("reason") in FAILED_REASONS
+    }
+    saved_records: Dict[str, Dict[str, object]] = {}
+    for code, record in records.items():
+        stage = "batches" if record["batch"] else "screening"
+        if code in failed_codes:
+            continue
+        if stage in stages:
+            saved_records[code] = record
+        elif code in previous_records:
+            saved_records[code] = previous_records[code]
+    write_manifest(files, saved_records, mapping_output_key, script_version, mapping_fingerprint)
+    checkpoints.clear()
+    if checkpoints.resumed:
+        print(f"Resumed {checkpoints.resumed} codes from checkpoints of an interrupted run")
+    exit_status = report_batch_failures(batch_summaries)
+    write_run_report(stages, batch_summaries, cache.mode, changed_codes, rewritten, run_metrics, exit_status)
+
+    if args.incremental and not rewritten:
+        print(f"No NMC inputs changed; outputs in {OUT_DIR} are up to date")
+        return exit_status
+
+    if stages != set(ALL_STAGES):
+        print(f"Ran {', '.join(sorted(stages))} only; rewrote {', '.join(rewritten) or 'nothing'} in {OUT_DIR}")
+        return exit_status
+
     append_import_log(
-        run_timestamp=run_timestamp,
+        run_timestamp=log_timestamp or datetime.now(timezone.utc).isoformat(),
         batch_summaries=batch_summaries,
         all_codes=all_codes,
         safe_lookup=safe_lookup,
         screening=screening,
         mapping_rows=mapping_rows,
+        run_metrics=run_metrics,
+        replace_section=log_timestamp is not None,
     )
 
     total_rows = sum(int(summary.get("total_rows", 0)) for summary in batch_summaries)
+    if args.incremental:
+        print(f"Rewrote {', '.join(rewritten)} ({len(changed_codes or ())} changed codes) in {OUT_DIR}")
+        return exit_status
     print(f"Wrote {total_rows} rows across {len(batch_summaries)} safe batches to {OUT_DIR}")
+    return exit_status
 
 
 if __name__ == "__main__":
-    main()
+    # Run the importable module's main(), so nmc_extract_service and
+    # nmc_text_index, which import it by name, share its paths and classes.
+    from nmc_extract_safe_batch import main as module_main
+
+    raise SystemExit(module_main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Local HTTP service for nmc_extract_safe_batch.py (its serve subcommand).
+
+ExtractionService keeps the corpus index, extracted texts and mappings in
+memory, so extracting or screening a code, rebuilding a batch or looking up
+a mapping does not start a new process per request. make_server() wraps it
+in an http.server.HTTPServer.
+
+Usage:
+    python scripts/nmc_extract_safe_batch.py serve [--port 8765]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+# NMC_DIR and OUT_DIR are read through the module, since configure_paths() rebinds them.
+import nmc_extract_safe_batch as nmc
+from nmc_extract_safe_batch import (
+    ANSWER_VERIFICATION_NAME,
+    PROBLEM_BANK_NAME,
+    PROBLEM_INDEX_NAME,
+    SAFE_BATCHES,
+    CorpusIndex,
+    PdfTextCache,
+    build_ncm_mapping_rows,
+    build_rows_for_code,
+    build_safe_lookup,
+    build_text_cache,
+    get_batch_file_stem,
+    normalize_ncm_code,
+    process_batch,
+    screen_remaining_codes,
+    snapshot_pdf_stats,
+    write_answer_verification,
+    write_problem_bank,
+    write_problem_index,
+    write_problem_shards,
+)
+
+
+class ExtractionService:
+    """Corpus index, extracted texts and mappings kept warm across requests for `serve`.
+
+    Each request first rescans NMC/*.pdf; texts of PDFs whose size and mtime
+    are unchanged are carried over, so only new or edited PDFs are extracted.
+    """
+
+    def __init__(self, cache: PdfTextCache) -> None:
+        self.cache = cache
+        self.safe_lookup = build_safe_lookup()
+        self.parser_by_batch = {str(batch["name"]): str(batch["parser"]) for batch in SAFE_BATCHES}
+        self.stats: Dict[str, Tuple[int, int]] = {}
+        self.corpus = CorpusIndex({}, cache=cache)
+        self.refresh()
+
+    def refresh(self) -> None:
+        stats = snapshot_pdf_stats(nmc.NMC_DIR)
+        if stats == self.stats:
+            return
+        corpus = CorpusIndex.build(nmc.NMC_DIR, cache=self.cache)
+        corpus.carry_over_texts(self.corpus)
+        self.corpus = corpus
+        self.stats = stats
+
+    def codes(self) -> Dict[str, object]:
+        return {
+            "codes": [
+                {"code": code, "safe_batch": self.safe_lookup.get(code, "")} for code in self.corpus.codes()
+            ]
+        }
+
+    def extract_code(self, code: str, parser_mode: str = "") -> Dict[str, object]:
+        code = normalize_ncm_code(code)
+        if not parser_mode:
+            parser_mode = self.parser_by_batch.get(self.safe_lookup.get(code, ""), "auto")
+        result = build_rows_for_code(code, parser_mode=parser_mode, corpus=self.corpus)
+        return {"rows": [asdict(row) for row in result["rows"]], "report": result["report"]}
+
+    def screen_code(self, code: str) -> Dict[str, object]:
+        code = normalize_ncm_code(code)
+        self.corpus.entry(code)  # unknown codes are a 404, not a processing_error row
+        return screen_remaining_codes([code], {}, corpus=self.corpus)[0]
+
+    def rebuild_batch(self, batch_name: str) -> Dict[str, object]:
+        batch = next((batch for batch in SAFE_BATCHES if batch["name"] == batch_name), None)
+        if batch is None:
+            raise FileNotFoundError(f"Unknown batch {batch_name}")
+        summary = process_batch(batch, corpus=self.corpus)
+        rewritten = [get_batch_file_stem(batch_name)]
+        if write_problem_index():
+            rewritten.append(PROBLEM_INDEX_NAME)
+        if write_problem_bank():
+            rewritten.append(PROBLEM_BANK_NAME)
+        rewritten.extend(write_problem_shards())
+        if write_answer_verification():
+            rewritten.append(ANSWER_VERIFICATION_NAME)
+        return {"summary": summary, "rewritten": rewritten}
+
+    def mapping(self, code: str) -> Dict[str, object]:
+        code = normalize_ncm_code(code)
+        return build_ncm_mapping_rows([code], self.safe_lookup)[0]
+
+    def handle(self, method: str, path: str, query: Dict[str, str]) -> Dict[str, object]:
+        """Dispatch one request; raises FileNotFoundError for unknown routes, codes and batches."""
+        parts = [part for part in path.split("/") if part]
+        self.refresh()
+        if method == "GET" and parts == ["codes"]:
+            return self.codes()
+        if method == "GET" and len(parts) == 2 and parts[0] == "extract":
+            return self.extract_code(parts[1], query.get("parser", ""))
+        if method == "GET" and len(parts) == 2 and parts[0] == "screen":
+            return self.screen_code(parts[1])
+        if method == "GET" and len(parts) == 2 and parts[0] == "mapping":
+            return self.mapping(parts[1])
+        if method == "POST" and len(parts) == 2 and parts[0] == "rebuild":
+            return self.rebuild_batch(parts[1])
+        raise FileNotFoundError(f"No route for {method} {path}")
+
+
+def make_server(service: ExtractionService, host: str, port: int) -> HTTPServer:
+    """HTTPServer bound to host:port that answers requests through service.handle().
+
+    Unknown routes, codes and batches answer 404, any other error 500.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, method: str) -> None:
+            started = time.perf_counter()
+            url = urlsplit(self.path)
+            try:
+                payload = service.handle(method, url.path, dict(parse_qsl(url.query)))
+                status = 200
+            except FileNotFoundError as error:
+                payload, status = {"error": str(error)}, 404
+            except Exception as error:  # pragma: no cover
+                payload, status = {"error": f"{type(error).__name__}: {error}"}, 500
+            payload["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            self._respond("GET")
+
+        def do_POST(self) -> None:
+            self._respond("POST")
+
+        def log_message(self, format: str, *args: object) -> None:
+            pass
+
+    return HTTPServer((host, port), Handler)
+
+
+def serve(args: argparse.Namespace) -> None:
+    """Serve ExtractionService over local HTTP until interrupted.
+
+    GET /codes, GET /extract/<code>[?parser=expression|word],
+    GET /screen/<code>, GET /mapping/<code> and POST /rebuild/<batch>
+    answer JSON; every response carries elapsed_ms.
+    """
+    nmc.OUT_DIR.mkdir(parents=True, exist_ok=True)
+    service = ExtractionService(build_text_cache(args))
+    server = make_server(service, args.host, args.port)
+    print(f"Serving {nmc.NMC_DIR} on http://{args.host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving")
+    finally:
+        server.server_close()
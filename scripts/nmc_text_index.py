@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Inverted text index over the NMC PDFs and the query subcommand of
+nmc_extract_safe_batch.py.
+
+NMC/processed/.cache/text_index.json maps tokens to (code, kind, page,
+offset) over the normalized PDF texts. Extraction runs drop changed PDFs from
+it and index the texts they loaded or find in the text cache; the query
+subcommand indexes any other new or changed PDFs and answers term, phrase and
+regex queries from it.
+
+Usage:
+    python scripts/nmc_extract_safe_batch.py query Beräkna --not "S var:"
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# NMC_DIR and OUT_DIR are read through the module, since configure_paths() rebinds them.
+import nmc_extract_safe_batch as nmc
+from nmc_extract_safe_batch import (
+    CorpusFile,
+    CorpusIndex,
+    PdfTextCache,
+    atomic_output,
+    build_text_cache,
+    natural_code_key,
+    normalize_text,
+)
+
+TEXT_INDEX_NAME = "text_index.json"
+TEXT_INDEX_VERSION = 1
+TEXT_TOKEN_PATTERN = re.compile(r"\w+")
+QUERY_SNIPPET_CHARS = 40
+
+
+class TextIndex:
+    """Inverted index over the normalized page texts of NMC/*.pdf.
+
+    terms maps a casefolded token to {pdf name: [page, offset, page, offset, ...]}
+    with character offsets into the normalize_text() output of that page. The
+    page texts are stored too, so phrase and regex queries are answered
+    without decoding PDFs. Facit PDFs are indexed up to the end of the Facit
+    segment, like the parsers read them. Documents are keyed by PDF name and
+    replaced when the PDF's size or mtime changes. PDFs whose text cannot be
+    extracted are listed in skipped with the error and retried once their
+    size or mtime changes.
+    """
+
+    def __init__(self, path: Path, extractor_version: str) -> None:
+        self.path = path
+        self.extractor_version = extractor_version
+        self.documents: Dict[str, Dict[str, object]] = {}
+        self.terms: Dict[str, Dict[str, List[int]]] = {}
+        self.skipped: Dict[str, Dict[str, object]] = {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: Path, extractor_version: str) -> "TextIndex":
+        index = cls(path, extractor_version)
+        try:
+            with path.open("r", encoding="utf-8") as handle:
+                payload = json.load(handle)
+        except (OSError, ValueError):
+            return index
+        if payload.get("version") != TEXT_INDEX_VERSION or payload.get("extractor_version") != extractor_version:
+            return index
+        index.documents = payload.get("documents", {})
+        index.terms = payload.get("terms", {})
+        index.skipped = payload.get("skipped", {})
+        return index
+
+    def save(self) -> bool:
+        if not self.changed:
+            return False
+        payload = {
+            "version": TEXT_INDEX_VERSION,
+            "extractor_version": self.extractor_version,
+            "documents": self.documents,
+            "terms": self.terms,
+            "skipped": self.skipped,
+        }
+        with atomic_output(self.path) as handle:
+            json.dump(payload, handle, ensure_ascii=False, separators=(",", ":"))
+        self.changed = False
+        return True
+
+    def update(self, corpus: CorpusIndex, loaded_only: bool = False) -> List[str]:
+        """Bring the index in line with corpus; returns the PDF names added, replaced or removed.
+
+        With loaded_only, new or changed PDFs are only indexed when corpus
+        already holds their text or the text cache has it (parallel runs load
+        texts in workers), so a pipeline run never extracts a PDF just for the
+        index (their stale documents are still dropped).
+        """
+        current: Dict[str, Tuple[str, str, CorpusFile]] = {}
+        for code, entry in corpus.entries.items():
+            for kind in ("diagnos", "facit"):
+                item = getattr(entry, kind)
+                if item is not None:
+                    current[item.path.name] = (code, kind, item)
+
+        updated: List[str] = []
+        for name, document in list(self.documents.items()):
+            found = current.get(name)
+            if found is None or [document["size"], document["mtime_ns"]] != [found[2].size, found[2].mtime_ns]:
+                self._remove(name)
+                updated.append(name)
+        for name, skipped in list(self.skipped.items()):
+            found = current.get(name)
+            if found is None or [skipped["size"], skipped["mtime_ns"]] != [found[2].size, found[2].mtime_ns]:
+                del self.skipped[name]
+                self.changed = True
+        for name, (code, kind, item) in sorted(current.items()):
+            if name in self.documents or name in self.skipped:
+                continue
+            stat = {"code": code, "kind": kind, "size": item.size, "mtime_ns": item.mtime_ns}
+            if loaded_only:
+                raw_pages = corpus.cached_pages(code, kind)
+                if raw_pages is None:
+                    continue
+            else:
+                try:
+                    raw_pages = corpus.load_pages(code, kind)
+                except Exception as error:
+                    # One unreadable PDF must not keep the rest of the corpus out of the index.
+                    self.skipped[name] = {**stat, "error": str(error)}
+                    self.changed = True
+                    continue
+            self._add(name, {**stat, "pages": [normalize_text(page) for page in raw_pages]})
+            if name not in updated:
+                updated.append(name)
+        return updated
+
+    def _add(self, name: str, document: Dict[str, object]) -> None:
+        self.documents[name] = document
+        for page_no, page in enumerate(document["pages"], start=1):
+            for match in TEXT_TOKEN_PATTERN.finditer(page):
+                self.terms.setdefault(match.group().casefold(), {}).setdefault(name, []).extend(
+                    (page_no, match.start())
+                )
+        self.changed = True
+
+    def _remove(self, name: str) -> None:
+        document = self.documents.pop(name)
+        for token in {match.group().casefold() for page in document["pages"] for match in TEXT_TOKEN_PATTERN.finditer(page)}:
+            postings = self.terms.get(token)
+            if postings is not None:
+                postings.pop(name, None)
+                if not postings:
+                    del self.terms[token]
+        self.changed = True
+
+    def find(self, text: str) -> Dict[str, List[Tuple[int, int]]]:
+        """(page, offset) hits per PDF name for a term or phrase, case-insensitively.
+
+        A single word is a posting lookup. Anything longer is matched from the
+        postings of its first word, with any whitespace between its parts.
+        """
+        tokens = TEXT_TOKEN_PATTERN.findall(text.casefold())
+        if len(tokens) == 1 and tokens[0] == text.strip().casefold():
+            postings = self.terms.get(tokens[0], {})
+            return {name: list(zip(flat[::2], flat[1::2])) for name, flat in postings.items()}
+
+        pattern = re.compile(r"\s*".join(map(re.escape, text.split())), re.IGNORECASE)
+        if not tokens:
+            return self.search(pattern, self.documents)
+        lead = TEXT_TOKEN_PATTERN.search(text.strip()).start()  # characters before the first word
+        hits: Dict[str, List[Tuple[int, int]]] = {}
+        for name, flat in self.terms.get(tokens[0], {}).items():
+            pages = self.documents[name]["pages"]
+            for page_no, offset in zip(flat[::2], flat[1::2]):
+                start = offset - lead
+                if start >= 0 and pattern.match(pages[page_no - 1], start):
+                    hits.setdefault(name, []).append((page_no, start))
+        return hits
+
+    def search(self, pattern: re.Pattern, names: Iterable[str]) -> Dict[str, List[Tuple[int, int]]]:
+        """(page, offset) of every pattern match in the stored texts of names."""
+        hits: Dict[str, List[Tuple[int, int]]] = {}
+        for name in names:
+            for page_no, page in enumerate(self.documents[name]["pages"], start=1):
+                for match in pattern.finditer(page):
+                    hits.setdefault(name, []).append((page_no, match.start()))
+        return hits
+
+    def snippet(self, name: str, page_no: int, offset: int) -> str:
+        page = self.documents[name]["pages"][page_no - 1]
+        start = max(0, offset - QUERY_SNIPPET_CHARS // 2)
+        return page[start : offset + QUERY_SNIPPET_CHARS].strip()
+
+
+def query_text_index(
+    index: TextIndex,
+    terms: Sequence[str],
+    excluded: Sequence[str] = (),
+    regex: str | None = None,
+    kind: str | None = None,
+) -> Dict[str, List[Tuple[str, int, int]]]:
+    """Codes whose PDFs contain every term and no excluded term, and match regex.
+
+    Terms, exclusions and the regex are evaluated per code over its diagnos
+    and facit texts (or only kind). The terms narrow the documents the regex
+    runs over. Returns (pdf name, page, offset) hits per code, sorted by code.
+    """
+    names_by_code: Dict[str, List[str]] = {}
+    for name, document in index.documents.items():
+        if kind is None or document["kind"] == kind:
+            names_by_code.setdefault(str(document["code"]), []).append(name)
+
+    codes = set(names_by_code)
+    hits: Dict[str, List[Tuple[str, int, int]]] = {code: [] for code in codes}
+
+    def per_code(found: Dict[str, List[Tuple[int, int]]]) -> Dict[str, List[Tuple[str, int, int]]]:
+        grouped: Dict[str, List[Tuple[str, int, int]]] = {}
+        for name, positions in found.items():
+            code = str(index.documents[name]["code"])
+            if name in names_by_code.get(code, ()):
+                grouped.setdefault(code, []).extend((name, page, offset) for page, offset in positions)
+        return grouped
+
+    for term in terms:
+        found = per_code(index.find(term))
+        codes &= set(found)
+        for code in codes:
+            hits[code].extend(found[code])
+    for term in excluded:
+        codes -= set(per_code(index.find(term)))
+    if regex:
+        names = [name for code in codes for name in names_by_code[code]]
+        found = per_code(index.search(re.compile(regex), names))
+        codes &= set(found)
+        for code in codes:
+            hits[code].extend(found[code])
+    return {code: sorted(hits[code]) for code in sorted(codes, key=natural_code_key)}
+
+
+def open_text_index(cache: PdfTextCache) -> TextIndex:
+    return TextIndex.load(nmc.OUT_DIR / ".cache" / TEXT_INDEX_NAME, cache.extractor_version)
+
+
+def run_query(args: argparse.Namespace) -> None:
+    started = time.perf_counter()
+    cache = build_text_cache(args)
+    index = open_text_index(cache)
+    if not args.no_update:
+        updated = index.update(CorpusIndex.build(nmc.NMC_DIR, cache=cache))
+        if index.save():
+            print(f"Indexed {len(updated)} changed PDFs")
+    for name, skipped in sorted(index.skipped.items()):
+        print(f"Skipped unreadable {name}: {skipped['error']}")
+
+    results = query_text_index(index, args.terms, args.exclude, args.regex, args.kind)
+    for code, code_hits in results.items():
+        if args.codes_only or not code_hits:
+            print(code)
+            continue
+        for name, page, offset in code_hits[: args.max_hits]:
+            kind = index.documents[name]["kind"]
+            print(f"{code}\t{kind} p{page}:{offset}\t{index.snippet(name, page, offset)}")
+        if len(code_hits) > args.max_hits:
+            print(f"{code}\t... {len(code_hits) - args.max_hits} more")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"{len(results)} codes ({elapsed_ms:.0f} ms)")
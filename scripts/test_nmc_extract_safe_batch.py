@@ -0,0 +1,697 @@
+"""
+Tests for nmc_extract_safe_batch.py on a small synthetic NMC corpus.
+
+The corpus comes from nmc_bench_pipeline.generate_corpus (the SAFE_BATCHES
+codes plus a few filler codes) and is copied per test, so tests can edit
+PDFs. Every run writes to a temporary out dir; the repository's NMC/ folder
+is never read or written.
+
+Usage:
+    python -m pytest -q scripts
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+from decimal import Decimal
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pytest
+
+import nmc_extract_safe_batch as nmc
+import nmc_extract_service as nmc_service
+import nmc_text_index
+from nmc_bench_pipeline import generate_corpus
+
+FILLER_CODES = 4
+CORPUS_SEED = 11
+
+
+@pytest.fixture(scope="session")
+def pristine_corpus(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    nmc_dir = tmp_path_factory.mktemp("corpus") / "NMC"
+    generate_corpus(nmc_dir, filler_codes=FILLER_CODES, seed=CORPUS_SEED)
+    return nmc_dir
+
+
+@pytest.fixture
+def nmc_dir(pristine_corpus: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    # main() points the module globals at the test corpus; monkeypatch restores them.
+    monkeypatch.setattr(nmc, "NMC_DIR", nmc.NMC_DIR)
+    monkeypatch.setattr(nmc, "OUT_DIR", nmc.OUT_DIR)
+    return Path(shutil.copytree(pristine_corpus, tmp_path / "NMC"))
+
+
+def run(nmc_dir: Path, *args: str) -> None:
+    nmc.main(["--nmc-dir", str(nmc_dir), "--jobs", "1", *args])
+
+
+def read_json(path: Path) -> object:
+    with path.open("r", encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def batch_reports(out_dir: Path) -> Dict[str, Dict[str, object]]:
+    reports: Dict[str, Dict[str, object]] = {}
+    for batch in nmc.SAFE_BATCHES:
+        stem = nmc.get_batch_file_stem(str(batch["name"]))
+        for report in read_json(out_dir / f"{stem}_report.json")["per_code"]:
+            reports[str(report["code"])] = report
+    return reports
+
+
+def processed_outputs(out_dir: Path) -> Dict[str, object]:
+    return {
+        path.name: nmc.strip_volatile(read_json(path))
+        for path in sorted(out_dir.glob("*.json"))
+        if path.name not in (nmc.MANIFEST_NAME, nmc.RUN_REPORT_NAME)
+    }
+
+
+@pytest.mark.parametrize(
+    ("question", "expected"),
+    [
+        ("3 · (4,5 − 1,5)", Decimal(9)),
+        ("12 : 4 : 3", Decimal(1)),
+        ("2--3", Decimal(5)),
+        ("120 + 35", Decimal(155)),
+        ("7 - 7", Decimal(0)),
+        ("1/3", Decimal("0.3333333333333333333333333333")),
+        ("5", None),
+        ("-5", None),
+        ("2(3)", None),
+        ("((1)", None),
+        ("4 / 0", None),
+    ],
+)
+def test_evaluate_expression(question: str, expected: Decimal | None) -> None:
+    assert nmc.evaluate_expression(question) == expected
+
+
+def test_verify_expression_answers_counts_rounding_and_overflow() -> None:
+    def row(question: str, answer: str) -> Tuple[str, Dict[str, object]]:
+        return "batch", {"question_text": question, "answer_source": "facit", "expected_answer": answer}
+
+    result = nmc.verify_expression_answers(
+        [
+            row("12 + 5", "17"),
+            row("10 / 3", "3,33"),
+            row("99999999999999999 * 99999999999999999", "1"),
+            ("batch", {"question_text": "4 · 4", "answer_source": "computed", "expected_answer": "16"}),
+        ]
+    )
+    assert {key: result[key] for key in ("expression_rows", "matched", "rounded", "mismatched", "without_facit")} == {
+        "expression_rows": 4,
+        "matched": 1,
+        "rounded": 1,
+        "mismatched": 1,
+        "without_facit": 1,
+    }
+    assert result["mismatches"][0]["facit_answer"] == "1"
+
+
+def test_tokenize_diagnos_items() -> None:
+    text = (
+        "Diagnos AS1 Namn: ____ 1 Beräkna 12 + 5 S var: ____ "
+        "2 Beräkna 30 · 2 S var: ____ "
+        "3 Lisa har 4 kulor och får 2 till. Hur många har hon nu? S var: ____"
+    )
+    items = nmc.tokenize_diagnos_items(text)
+    assert items.expression == {1: "12 + 5", 2: "30 · 2"}
+    assert items.word == {
+        1: "Beräkna 12 + 5",
+        2: "Beräkna 30 · 2",
+        3: "Lisa har 4 kulor och får 2 till. Hur många har hon nu?",
+    }
+    assert nmc.parse_diagnos_items(text, "auto") == items.expression
+
+
+@pytest.mark.parametrize("count", [0, 1, 3])
+def test_json_array_writer_matches_json_dump(count: int) -> None:
+    items = [
+        {"code": f"AS{index}", "answer": "½", "tags": ["a", "b"], "nested": {"n": index}} for index in range(count)
+    ]
+    handle = io.StringIO()
+    writer = nmc.JsonArrayWriter(handle)
+    for item in items:
+        writer.write(item)
+    writer.close()
+    assert handle.getvalue() == json.dumps(items, ensure_ascii=False, indent=2)
+
+
+def test_unchanged_writes_keep_mtime(tmp_path: Path) -> None:
+    report, text, raw = tmp_path / "report.json", tmp_path / "log.md", tmp_path / "rows.json"
+    assert nmc.write_json_report(report, {"generated_at_utc": "a", "metrics": {"ms": 1}, "rows": 2})
+    assert nmc.write_text_if_changed(text, "rows: 2\n")
+    with nmc.atomic_output(raw) as handle:
+        handle.write("[]")
+    for path in (report, text, raw):
+        os.utime(path, ns=(0, 0))
+
+    assert not nmc.write_json_report(report, {"generated_at_utc": "b", "metrics": {"ms": 2}, "rows": 2})
+    assert not nmc.write_text_if_changed(text, "rows: 2\n")
+    with nmc.atomic_output(raw) as handle:
+        handle.write("[]")
+    assert [path.stat().st_mtime_ns for path in (report, text, raw)] == [0, 0, 0]
+    assert not list(tmp_path.glob(".*.tmp"))
+
+    assert nmc.write_json_report(report, {"generated_at_utc": "c", "rows": 3})
+    assert report.stat().st_mtime_ns != 0
+
+
+def test_rerun_keeps_output_mtimes(nmc_dir: Path) -> None:
+    run(nmc_dir)
+    out_dir = nmc_dir / "processed"
+    outputs = [
+        path
+        for path in out_dir.iterdir()
+        if path.is_file() and path.name not in (nmc.MANIFEST_NAME, nmc.RUN_REPORT_NAME, "IMPORT_LOG.md")
+    ]
+    for path in outputs:
+        os.utime(path, ns=(0, 0))
+    run(nmc_dir)
+    assert {path.name: path.stat().st_mtime_ns for path in outputs} == {path.name: 0 for path in outputs}
+
+
+def test_full_run_writes_batches_and_screening(nmc_dir: Path) -> None:
+    run(nmc_dir)
+    out_dir = nmc_dir / "processed"
+    reports = batch_reports(out_dir)
+    assert set(reports) == {code for batch in nmc.SAFE_BATCHES for code in batch["codes"]}
+    assert all("reason" not in report and report["merged_item_count"] > 0 for report in reports.values())
+    screening = read_json(out_dir / "safe_candidate_screening.json")
+    assert len(screening["rows"]) == FILLER_CODES
+    verification = read_json(out_dir / nmc.ANSWER_VERIFICATION_NAME)
+    assert verification["expression_rows"] > 0
+    assert verification["mismatched"] == 0
+
+
+def test_parallel_run_matches_serial_run(nmc_dir: Path, tmp_path: Path) -> None:
+    serial_dir = Path(shutil.copytree(nmc_dir, tmp_path / "serial" / "NMC"))
+    run(serial_dir)
+    run(nmc_dir, "--jobs", "2")
+    parallel_out, serial_out = nmc_dir / "processed", serial_dir / "processed"
+    names = sorted(path.name for path in serial_out.iterdir() if path.is_file())
+    assert names == sorted(path.name for path in parallel_out.iterdir() if path.is_file())
+    for name in names:
+        if name in (nmc.MANIFEST_NAME, nmc.RUN_REPORT_NAME, "IMPORT_LOG.md"):
+            continue
+        parallel, serial = (parallel_out / name).read_bytes(), (serial_out / name).read_bytes()
+        if b'"generated_at_utc"' in serial:
+            assert nmc.strip_volatile(json.loads(parallel)) == nmc.strip_volatile(json.loads(serial)), name
+        else:
+            assert parallel == serial, name
+
+
+def test_incremental_run_skips_unchanged_inputs(nmc_dir: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    run(nmc_dir, "--incremental")
+    capsys.readouterr()
+    run(nmc_dir, "--incremental")
+    assert "No NMC inputs changed" in capsys.readouterr().out
+
+    shutil.copyfile(nmc_dir / "AS2%20facit.pdf", nmc_dir / "AS1%20facit.pdf")
+    run(nmc_dir, "--incremental")
+    out = capsys.readouterr().out
+    assert "1 changed codes" in out
+    assert "safe_batch_as_expressions" in out
+
+
+def test_incremental_run_metrics_cover_only_processed_codes(nmc_dir: Path) -> None:
+    run(nmc_dir, "--incremental")
+    shutil.copyfile(nmc_dir / "AS2%20facit.pdf", nmc_dir / "AS1%20facit.pdf")
+    run(nmc_dir, "--incremental")
+    out_dir = nmc_dir / "processed"
+    section = (out_dir / "IMPORT_LOG.md").read_text(encoding="utf-8").split("\n## ")[-1]
+    slowest = section.split("Långsammaste koder")[1]
+    assert "| AS1 | safe_as_expressions |" in slowest
+    assert "| AS2 |" not in slowest and "| screening |" not in slowest
+
+
+def test_text_cache_counts_hits_and_misses(nmc_dir: Path) -> None:
+    out_dir = nmc_dir / "processed"
+    run(nmc_dir)
+    cold = read_json(out_dir / nmc.RUN_REPORT_NAME)
+    report_path = out_dir / "safe_batch_as_expressions_report.json"
+    cold_report = report_path.read_bytes()
+    assert cold["pdf_text_cache"]["hits"] == 0 and cold["pdf_text_cache"]["misses"] > 0
+
+    run(nmc_dir)
+    warm = read_json(out_dir / nmc.RUN_REPORT_NAME)
+    assert warm["pdf_text_cache"] == {"mode": "use", "hits": cold["pdf_text_cache"]["misses"], "misses": 0}
+    batch = warm["batches"]["safe_as_expressions"]
+    assert batch["pdf_text_cache"]["hits"] > 0
+    assert [entry["code"] for entry in batch["metrics"]["slowest_codes"]]
+    # The batch report keeps the counters of the run that last changed its content.
+    assert report_path.read_bytes() == cold_report
+
+    run(nmc_dir, "--rebuild-cache")
+    rebuilt = read_json(out_dir / nmc.RUN_REPORT_NAME)
+    assert rebuilt["pdf_text_cache"] == {"mode": "rebuild", "hits": 0, "misses": cold["pdf_text_cache"]["misses"]}
+
+
+def test_no_cache_writes_no_entries(nmc_dir: Path) -> None:
+    run(nmc_dir, "--no-cache")
+    out_dir = nmc_dir / "processed"
+    assert read_json(out_dir / nmc.RUN_REPORT_NAME)["pdf_text_cache"] == {"mode": "off", "hits": 0, "misses": 0}
+    assert not list((out_dir / ".cache" / "pdf_text").glob("*.json"))
+
+
+def test_evict_stale_keeps_live_entries(nmc_dir: Path) -> None:
+    cache = nmc.PdfTextCache(nmc_dir / "processed" / ".cache" / "pdf_text", limits=nmc.PdfExtractionLimits(0, 0))
+    live, stale = nmc_dir / "AS1%20diagnos.pdf", nmc_dir / "AS2%20diagnos.pdf"
+    pages = cache.read_pages(live)
+    cache.read_pages(stale)
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert cache.read_pages(live) == pages and cache.hits == 1
+
+    assert cache.evict_stale([cache.content_hash(live)]) == 1
+    assert cache.entry_path(cache.content_hash(live)).exists()
+    assert not cache.entry_path(cache.content_hash(stale)).exists()
+
+
+def test_incremental_run_retries_failed_codes(
+    nmc_dir: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    build_rows_for_code = nmc.build_rows_for_code
+    safe_lookup = nmc.build_safe_lookup()
+    screen_filler = next(code for code in nmc.CorpusIndex.build(nmc_dir).codes() if code not in safe_lookup)
+    load = nmc.CorpusIndex.load
+
+    def fail_as1(code: str, **kwargs: object) -> Dict[str, object]:
+        if code == "AS1":
+            raise nmc.PdfExtractionTimeout("AS1 timed out")
+        return build_rows_for_code(code, **kwargs)
+
+    def fail_screening(corpus: nmc.CorpusIndex, code: str, kind: str) -> object:
+        if code == screen_filler:
+            raise nmc.PdfExtractionError("unreadable")
+        return load(corpus, code, kind)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(nmc, "build_rows_for_code", fail_as1)
+        patch.setattr(nmc.CorpusIndex, "load", fail_screening)
+        run(nmc_dir, "--incremental")
+    out_dir = nmc_dir / "processed"
+    assert batch_reports(out_dir)["AS1"]["reason"] == "timeout"
+    manifest = read_json(out_dir / nmc.MANIFEST_NAME)
+    assert "AS1" not in manifest["codes"] and screen_filler not in manifest["codes"]
+    capsys.readouterr()
+
+    run(nmc_dir, "--incremental")
+    assert "2 changed codes" in capsys.readouterr().out
+    assert "reason" not in batch_reports(out_dir)["AS1"]
+    screening = {row["code"]: row for row in read_json(out_dir / "safe_candidate_screening.json")["rows"]}
+    assert screening[screen_filler]["reason"] not in nmc.FAILED_REASONS
+    assert {"AS1", screen_filler} <= set(read_json(out_dir / nmc.MANIFEST_NAME)["codes"])
+
+
+def test_failed_safe_batch_code_keeps_previous_rows(nmc_dir: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    assert nmc.main(["--nmc-dir", str(nmc_dir), "--jobs", "1"]) == 0
+    out_dir = nmc_dir / "processed"
+    batch_path = out_dir / "safe_batch_as_expressions.json"
+    bank_path = out_dir / nmc.PROBLEM_BANK_NAME
+    rows_before, bank_before = batch_path.read_bytes(), bank_path.read_bytes()
+    capsys.readouterr()
+
+    (nmc_dir / "AS1%20diagnos.pdf").write_bytes(b"%PDF-1.4\nnot a pdf at all\n")
+    assert nmc.main(["--nmc-dir", str(nmc_dir), "--jobs", "1"]) == 1
+    assert "Failed to extract AS1 (processing_error" in capsys.readouterr().err
+    assert batch_path.read_bytes() == rows_before
+    assert bank_path.read_bytes() == bank_before
+    report = read_json(out_dir / "safe_batch_as_expressions_report.json")
+    assert [entry["code"] for entry in report["failed_codes"]] == ["AS1"]
+    assert report["failed_codes"][0]["kept_previous_rows"] is True
+    assert "AS1" not in read_json(out_dir / nmc.MANIFEST_NAME)["codes"]
+
+
+def test_mapping_only_does_not_import_pypdf(nmc_dir: Path) -> None:
+    script = (
+        "import sys, nmc_extract_safe_batch as nmc; "
+        f"status = nmc.main(['--nmc-dir', {str(nmc_dir)!r}, '--mapping-only']); "
+        "print(status, 'pypdf' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=Path(nmc.__file__).parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.splitlines()[-1] == "0 False"
+    assert (nmc_dir / "processed" / "ncm_code_skill_map.json").exists()
+
+
+def test_run_without_pdfs_leaves_outputs_alone(nmc_dir: Path) -> None:
+    run(nmc_dir)
+    out_dir = nmc_dir / "processed"
+    before = {path.name: path.read_bytes() for path in out_dir.iterdir() if path.is_file()}
+    for pdf in nmc_dir.glob("*.pdf"):
+        pdf.unlink()
+    for args in ([], ["--mapping-only"]):
+        with pytest.raises(SystemExit, match="No NMC PDFs found"):
+            run(nmc_dir, *args)
+    assert {path.name: path.read_bytes() for path in out_dir.iterdir() if path.is_file()} == before
+
+
+def test_watch_reruns_once_changed_pdfs_settle(
+    nmc_dir: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    facit = nmc_dir / "AS1%20facit.pdf"
+    replacement = (nmc_dir / "AS2%20facit.pdf").read_bytes()
+    polls = [
+        lambda: facit.write_bytes(replacement[: len(replacement) // 2]),  # copy in progress
+        lambda: facit.write_bytes(replacement),  # copy finished, not settled yet
+        lambda: None,  # settled: rerun
+        lambda: None,  # nothing new
+    ]
+    log_timestamps: List[str | None] = []
+    run_extraction = nmc.run_extraction
+
+    def recording_run(args, log_timestamp=None):
+        log_timestamps.append(log_timestamp)
+        return run_extraction(args, log_timestamp)
+
+    def fake_sleep(seconds: float) -> None:
+        if not polls:
+            raise KeyboardInterrupt
+        polls.pop(0)()
+
+    monkeypatch.setattr(nmc, "run_extraction", recording_run)
+    monkeypatch.setattr(nmc.time, "sleep", fake_sleep)
+    run(nmc_dir, "--watch", "--watch-interval", "0")
+
+    out = capsys.readouterr().out
+    assert out.count("Changed PDFs for AS1") == 1 and "Stopped watching" in out
+    assert len(log_timestamps) == 2 and log_timestamps[0] == log_timestamps[1] is not None
+    out_dir = nmc_dir / "processed"
+    assert read_json(out_dir / nmc.RUN_REPORT_NAME)["changed_codes"] == ["AS1"]
+    assert (out_dir / "IMPORT_LOG.md").read_text(encoding="utf-8").count("\n## ") == 1
+
+
+def test_resume_reuses_checkpoints(
+    nmc_dir: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    reference = nmc_dir.parent / "reference"
+    run(nmc_dir, "--out-dir", str(reference))
+
+    def interrupt() -> bool:
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(nmc, "write_problem_index", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            run(nmc_dir)
+    out_dir = nmc_dir / "processed"
+    assert (out_dir / nmc.CHECKPOINT_DIR_NAME).is_dir()
+    capsys.readouterr()
+
+    run(nmc_dir, "--resume")
+    codes = len(nmc.CorpusIndex.build(nmc_dir).codes())
+    assert f"Resumed {codes} codes from checkpoints" in capsys.readouterr().out
+    assert not (out_dir / nmc.CHECKPOINT_DIR_NAME).exists()
+    assert processed_outputs(out_dir) == processed_outputs(reference)
+
+
+def test_promote_candidates_and_stale_candidate_cleanup(nmc_dir: Path) -> None:
+    run(nmc_dir, "--promote-candidates")
+    out_dir = nmc_dir / "processed"
+    screening = read_json(out_dir / "safe_candidate_screening.json")["rows"]
+    candidates = {row["code"]: row for row in screening if row["status"] == "candidate_safe"}
+    assert candidates and all("parsed" not in row for row in screening)
+
+    promoted: Dict[str, List[Dict[str, object]]] = {}
+    for parser_mode in nmc.CANDIDATE_PARSERS:
+        path = out_dir / f"candidate_batch_{parser_mode}.json"
+        for row in read_json(path) if path.exists() else []:
+            promoted.setdefault(row["ncm_code"], []).append(row)
+    assert set(promoted) == set(candidates)
+    for code, rows in promoted.items():
+        assert len(rows) == candidates[code]["item_count"]
+        assert all(row["expected_answer"] for row in rows)
+
+    run(nmc_dir)
+    assert not list(out_dir.glob("candidate_batch_*"))
+
+
+def test_screen_code_keeps_parsed_items_only_on_request(nmc_dir: Path) -> None:
+    corpus = nmc.CorpusIndex.build(nmc_dir)
+    code = next(code for code in corpus.codes() if code not in nmc.build_safe_lookup())
+    assert "parsed" not in nmc.screen_code(code, corpus)
+    parsed = nmc.screen_code(code, corpus, keep_parsed=True)["parsed"]
+    assert set(parsed) == {"items", "answers"} and parsed["items"]
+
+
+def test_problem_index_ids_are_stable_and_never_reused(tmp_path: Path) -> None:
+    def row(code: str, item_no: int, operation: str = "addition") -> Dict[str, object]:
+        return {
+            "ncm_code": code,
+            "item_no": item_no,
+            "ncm_domain_tag": "AS",
+            "operation_tag": operation,
+            "ability_tags": "AS|AS-add",
+        }
+
+    first = nmc.build_problem_index([row("AS1", 1), row("AS1", 2), row("AS2", 1, "subtraction")], [])
+    assert first["rows"] == [["AS1", 1], ["AS1", 2], ["AS2", 1]]
+    assert first["by_code"] == {"AS1": [0, 1], "AS2": [2]}
+    assert first["by_operation"] == {"addition": [0, 1], "subtraction": [2]}
+    assert first["by_ability_tag"] == {"AS": [0, 1, 2], "AS-add": [0, 1, 2]}
+
+    previous = [tuple(key) for key in first["rows"]]
+    second = nmc.build_problem_index([row("AS3", 1), row("AS2", 1, "subtraction"), row("AS1", 2)], previous)
+    assert second["rows"] == [["AS1", 1], ["AS1", 2], ["AS2", 1], ["AS3", 1]]
+    assert second["by_code"] == {"AS1": [1], "AS2": [2], "AS3": [3]}
+
+    previous = [tuple(key) for key in second["rows"]]
+    third = nmc.build_problem_index([row("AS1", 1), row("AS4", 1)], previous)
+    assert third["rows"][:4] == second["rows"] and third["rows"][4] == ["AS4", 1]
+    assert third["by_code"] == {"AS1": [0], "AS4": [4]}
+
+
+def test_problem_index_file_keeps_ids_across_runs(nmc_dir: Path) -> None:
+    run(nmc_dir, "--incremental")
+    out_dir = nmc_dir / "processed"
+    path = out_dir / nmc.PROBLEM_INDEX_NAME
+    before = read_json(path)
+    assert nmc.load_problem_index_rows(path) == [tuple(key) for key in before["rows"]]
+
+    batch_path = out_dir / "safe_batch_as_expressions.json"
+    rows = read_json(batch_path)
+    batch_path.write_text(json.dumps([row for row in rows if row["ncm_code"] != "AS1"]), encoding="utf-8")
+    assert nmc.write_problem_index()
+    without = read_json(path)
+    assert without["rows"] == before["rows"] and "AS1" not in without["by_code"]
+
+    batch_path.write_text(json.dumps(rows), encoding="utf-8")
+    assert nmc.write_problem_index()
+    assert read_json(path) == before
+
+
+def test_problem_shards_split_the_bank_per_code(nmc_dir: Path) -> None:
+    run(nmc_dir)
+    out_dir = nmc_dir / "processed"
+    shard_dir = out_dir / nmc.SHARD_DIR_NAME
+    manifest = read_json(shard_dir / nmc.SHARD_MANIFEST_NAME)
+    bank = read_json(out_dir / nmc.PROBLEM_BANK_NAME)
+    shards = {code: read_json(shard_dir / info["file"]) for code, info in manifest["shards"].items()}
+    assert [entry for entries in shards.values() for entry in entries] == bank
+    assert manifest["total_entries"] == len(bank)
+    assert all(info["entries"] == len(shards[code]) for code, info in manifest["shards"].items())
+    assert all({entry["ncmCode"] for entry in entries} == {code} for code, entries in shards.items())
+
+    batch_path = out_dir / "safe_batch_as_expressions.json"
+    batch_path.write_text(
+        json.dumps([row for row in read_json(batch_path) if row["ncm_code"] != "AS1"]), encoding="utf-8"
+    )
+    assert nmc.write_problem_shards() == ["shards/AS1.json", "shards/manifest.json"]
+    assert not (shard_dir / "AS1.json").exists()
+    assert "AS1" not in read_json(shard_dir / nmc.SHARD_MANIFEST_NAME)["shards"]
+    assert nmc.write_problem_shards() == []
+
+
+def item_row(code: str, item_no: int, answer: str) -> nmc.ItemRow:
+    return nmc.ItemRow(
+        ncm_code=code,
+        item_no=item_no,
+        question_text=f"{item_no} + 1",
+        expected_answer=answer,
+        source_diagnos_pdf=f"{code} diagnos.pdf",
+        source_facit_pdf=f"{code} facit.pdf",
+        answer_source="facit",
+        extraction_confidence="high",
+        ncm_domain_tag="AS",
+        operation_tag="addition",
+        ability_tags="AS",
+    )
+
+
+def test_item_store_upserts_only_changed_codes(tmp_path: Path) -> None:
+    path = tmp_path / nmc.SQLITE_NAME
+    store = nmc.ItemStore(path)
+    assert store.created
+    store.replace_items("AS1", [item_row("AS1", 2, "3"), item_row("AS1", 1, "2")])
+    store.replace_items("AS2", [item_row("AS2", 1, "2")])
+    store.upsert_screening({"code": "AG1", "status": "candidate_safe", "item_count": 4})
+    assert store.changed_codes == {"AS1", "AS2", "AG1"}
+    store.close()
+
+    store = nmc.ItemStore(path)
+    assert not store.created
+    store.replace_items("AS1", [item_row("AS1", 1, "2"), item_row("AS1", 2, "3")])
+    store.upsert_screening({"code": "AG1", "status": "candidate_safe", "item_count": 4})
+    assert store.changed_codes == set()
+    store.replace_items("AS2", [item_row("AS2", 1, "5")])
+    store.upsert_screening({"code": "AG1", "status": "review", "item_count": 4})
+    assert store.changed_codes == {"AS2", "AG1"}
+    answers = store.conn.execute("SELECT ncm_code, item_no, expected_answer FROM items ORDER BY ncm_code, item_no")
+    assert answers.fetchall() == [("AS1", 1, "2"), ("AS1", 2, "3"), ("AS2", 1, "5")]
+
+    store.changed_codes.clear()
+    store.prune("items", ["AS1"])
+    store.prune("screening", ["AG1"])
+    assert store.changed_codes == {"AS2"}
+    assert store.conn.execute("SELECT DISTINCT ncm_code FROM items").fetchall() == [("AS1",)]
+    store.close()
+
+
+def test_sqlite_run_mirrors_batch_rows(nmc_dir: Path) -> None:
+    run(nmc_dir, "--sqlite")
+    out_dir = nmc_dir / "processed"
+    batch_files = [path for path in out_dir.glob("safe_batch_*.json") if not path.name.endswith("_report.json")]
+    rows = sum(len(read_json(path)) for path in batch_files)
+    store = nmc.ItemStore(out_dir / nmc.SQLITE_NAME)
+    try:
+        assert store.conn.execute("SELECT COUNT(*) FROM items").fetchone() == (rows,)
+        assert store.conn.execute("SELECT COUNT(*) FROM screening").fetchone() == (FILLER_CODES,)
+    finally:
+        store.close()
+
+
+@pytest.mark.parametrize(
+    ("flags", "mode", "limits"),
+    [
+        ([], "use", nmc.PdfExtractionLimits()),
+        (["--no-cache", "--pdf-timeout", "0", "--pdf-memory-mb", "0"], "off", nmc.PdfExtractionLimits(0, 0)),
+        (["--rebuild-cache", "--pdf-timeout", "-1"], "rebuild", nmc.PdfExtractionLimits(0, 2048)),
+    ],
+)
+def test_build_text_cache_follows_flags(
+    nmc_dir: Path, flags: List[str], mode: str, limits: nmc.PdfExtractionLimits
+) -> None:
+    args = nmc.build_arg_parser().parse_args(["--nmc-dir", str(nmc_dir), *flags])
+    nmc.configure_paths(args.nmc_dir, args.out_dir)
+    cache = nmc.build_text_cache(args)
+    assert (cache.mode, cache.limits) == (mode, limits)
+    assert cache.cache_dir == nmc_dir.resolve() / "processed" / ".cache" / "pdf_text"
+
+
+def test_service_routes(nmc_dir: Path) -> None:
+    nmc.configure_paths(nmc_dir)
+    service = nmc_service.ExtractionService(nmc.PdfTextCache(nmc.OUT_DIR / ".cache" / "pdf_text"))
+    codes = [row["code"] for row in service.handle("GET", "/codes", {})["codes"]]
+    assert "AS1" in codes
+
+    extracted = service.handle("GET", "/extract/as1", {})
+    assert extracted["report"]["code"] == "AS1"
+    assert extracted["rows"][0]["ncm_code"] == "AS1"
+    assert service.handle("GET", "/mapping/AS1", {})["safe_batch"] == "safe_as_expressions"
+    rebuilt = service.handle("POST", "/rebuild/safe_as_expressions", {})["rewritten"]
+    assert {"safe_batch_as_expressions", nmc.PROBLEM_BANK_NAME, "shards/AS1.json"} <= set(rebuilt)
+
+    with pytest.raises(FileNotFoundError):
+        service.handle("GET", "/extract/ZZ999", {})
+    with pytest.raises(FileNotFoundError):
+        service.handle("GET", "/screen/ZZ999", {})
+    with pytest.raises(FileNotFoundError):
+        service.handle("GET", "/nowhere", {})
+
+
+def test_http_routes_answer_404_for_unknown_codes(nmc_dir: Path) -> None:
+    nmc.configure_paths(nmc_dir)
+    service = nmc_service.ExtractionService(nmc.PdfTextCache(nmc.OUT_DIR / ".cache" / "pdf_text"))
+    server = nmc_service.make_server(service, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path: str) -> Tuple[int, Dict[str, object]]:
+        url = f"http://127.0.0.1:{server.server_port}{path}"
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as error:
+            return error.code, json.load(error)
+
+    try:
+        screen_code = next(code for code in service.corpus.codes() if code not in service.safe_lookup)
+        status, payload = get(f"/screen/{screen_code}")
+        assert status == 200 and payload["code"] == screen_code and "elapsed_ms" in payload
+        status, payload = get("/extract/AS1")
+        assert status == 200 and payload["report"]["code"] == "AS1"
+        for path in ("/screen/ZZ999", "/extract/ZZ999", "/mapping"):
+            status, payload = get(path)
+            assert status == 404 and "error" in payload
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_query_finds_terms_and_phrases(nmc_dir: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    run(nmc_dir, "query", "Facit", "--kind", "facit", "--codes-only")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == f"Indexed {2 * len(nmc.CorpusIndex.build(nmc_dir).codes())} changed PDFs"
+    assert "AS1" in lines
+
+    nmc.configure_paths(nmc_dir)
+    index = nmc_text_index.open_text_index(nmc.PdfTextCache(nmc.OUT_DIR / ".cache" / "pdf_text"))
+    assert index.update(nmc.CorpusIndex.build(nmc_dir)) == []
+    hits = nmc_text_index.query_text_index(index, ["S var"], excluded=["kulor"])
+    assert "AS1" in hits and "AS3" not in hits
+
+
+@pytest.mark.parametrize(
+    "limits", [[], ["--pdf-timeout", "0", "--pdf-memory-mb", "0"]], ids=["isolated", "in_process"]
+)
+def test_query_skips_unreadable_pdfs(nmc_dir: Path, limits: List[str], capsys: pytest.CaptureFixture[str]) -> None:
+    broken = nmc_dir / "AS2%20diagnos.pdf"
+    broken.write_bytes(b"%PDF-1.4\nnot a pdf at all\n")
+    run(nmc_dir, *limits, "query", "Beräkna", "--codes-only")
+    lines = capsys.readouterr().out.splitlines()
+    assert any(line.startswith(f"Skipped unreadable {broken.name}: ") for line in lines)
+    assert "AS1" in lines and "AS2" not in lines
+
+    # The skipped PDF is not retried until it changes.
+    run(nmc_dir, *limits, "query", "Beräkna", "--codes-only")
+    lines = capsys.readouterr().out.splitlines()
+    assert not any(line.startswith("Indexed ") for line in lines)
+    assert any(line.startswith(f"Skipped unreadable {broken.name}: ") for line in lines)
+
+    shutil.copyfile(nmc_dir / "AS4%20diagnos.pdf", broken)
+    run(nmc_dir, *limits, "query", "Beräkna", "--codes-only")
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "Indexed 1 changed PDFs"
+    assert "AS2" in lines and not any(line.startswith("Skipped ") for line in lines)
+
+
+def test_parallel_run_fills_text_index_from_cache(nmc_dir: Path, capsys: pytest.CaptureFixture[str]) -> None:
+    nmc.main(["--nmc-dir", str(nmc_dir), "--jobs", "2"])
+    capsys.readouterr()
+    run(nmc_dir, "query", "Beräkna", "--codes-only", "--no-update")
+    lines = capsys.readouterr().out.splitlines()
+    assert {"AS1", "AS2"} <= set(lines)
+
+    serial_out = nmc_dir.parent / "serial"
+    run(nmc_dir, "--out-dir", str(serial_out))
+    parallel = read_json(nmc_dir / "processed" / ".cache" / nmc_text_index.TEXT_INDEX_NAME)
+    serial = read_json(serial_out / ".cache" / nmc_text_index.TEXT_INDEX_NAME)
+    assert len(parallel["documents"]) == 2 * len(nmc.CorpusIndex.build(nmc_dir).codes())
+    assert parallel["documents"] == serial["documents"]
+    assert parallel["terms"] == serial["terms"]
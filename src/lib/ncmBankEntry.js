@@ -0,0 +1,184 @@
+import { normalizeNcmCode } from './ncmSkillMap'
+
+// Derives an NCM bank entry from a safe batch row. The app loads entries
+// precomputed by scripts/nmc_extract_safe_batch.py (ncm_problem_bank.json),
+// which ports these functions; ncmBankEntry.test.js keeps the two in step.
+
+const KNOWN_OPERATIONS = new Set(['addition', 'subtraction', 'multiplication', 'division'])
+
+export function toBankEntry(raw) {
+  const ncmCode = normalizeNcmCode(raw?.ncm_code)
+  const questionText = String(raw?.question_text || '').trim()
+  const expectedAnswer = parseNumericAnswer(raw?.expected_answer)
+  if (!ncmCode || !questionText || expectedAnswer === null) return null
+
+  const operationTag = normalizeTag(raw?.operation_tag)
+  const domainTag = normalizeTag(raw?.ncm_domain_tag)
+  const abilityTags = normalizeAbilityTags(raw?.ability_tags)
+  const expression = parseExpression(questionText)
+  const type = resolveOperation(operationTag, abilityTags, expression?.type || '')
+  const level = expression
+    ? estimateExpressionLevel(type, expression.a, expression.b)
+    : estimateDefaultLevel(ncmCode)
+  const magnitude = buildMagnitude(expression)
+  const estimatedTimeSec = estimatePromptTimeSec(questionText)
+
+  return {
+    ncmCode,
+    itemNo: Number(raw?.item_no || 0) || 0,
+    questionText,
+    expectedAnswer,
+    operationTag: operationTag || inferOperationTagFromType(type),
+    domainTag: domainTag || 'unknown',
+    abilityTags,
+    type,
+    values: expression ? { a: expression.a, b: expression.b } : {},
+    magnitude,
+    level,
+    estimatedTimeSec,
+    skillTag: `ncm_${ncmCode.toLowerCase()}_item_${Number(raw?.item_no || 0) || 0}`
+  }
+}
+
+function normalizeTag(value) {
+  return String(value || '').trim()
+}
+
+function normalizeAbilityTags(value) {
+  return String(value || '')
+    .split('|')
+    .map(item => String(item || '').trim())
+    .filter(Boolean)
+}
+
+
+function parseNumericAnswer(value) {
+  const normalized = String(value || '')
+    .trim()
+    .replace(/\s+/g, '')
+    .replace(',', '.')
+  if (!/^-?(?:\d+|\d*\.\d+)$/.test(normalized)) return null
+  const number = Number(normalized)
+  return Number.isFinite(number) ? number : null
+}
+
+function parseExpression(text) {
+  const compact = String(text || '').trim()
+  const match = compact.match(/^(-?(?:\d+|\d*[.,]\d+))\s*([+\-−×x*÷/])\s*(-?(?:\d+|\d*[.,]\d+))$/u)
+  if (!match) return null
+
+  const a = parseNumericAnswer(match[1])
+  const b = parseNumericAnswer(match[3])
+  if (a === null || b === null) return null
+
+  const op = match[2]
+  const type = inferTypeFromOperator(op)
+  if (!type) return null
+
+  return { a, b, type }
+}
+
+function inferTypeFromOperator(op) {
+  if (op === '+') return 'addition'
+  if (op === '-' || op === '−') return 'subtraction'
+  if (op === '×' || op === 'x' || op === '*') return 'multiplication'
+  if (op === '÷' || op === '/') return 'division'
+  return ''
+}
+
+function resolveOperation(operationTag, abilityTags = [], expressionType = '') {
+  if (KNOWN_OPERATIONS.has(operationTag)) return operationTag
+  if (expressionType && KNOWN_OPERATIONS.has(expressionType)) return expressionType
+
+  const hasAdd = abilityTags.includes('op_addition')
+  const hasSub = abilityTags.includes('op_subtraction')
+  const hasMul = abilityTags.includes('op_multiplication')
+  const hasDiv = abilityTags.includes('op_division')
+  const operationCount = [hasAdd, hasSub, hasMul, hasDiv].filter(Boolean).length
+
+  if (operationCount === 1) {
+    if (hasAdd) return 'addition'
+    if (hasSub) return 'subtraction'
+    if (hasMul) return 'multiplication'
+    if (hasDiv) return 'division'
+  }
+
+  return 'addition'
+}
+
+function inferOperationTagFromType(type) {
+  if (KNOWN_OPERATIONS.has(type)) return type
+  return 'mixed'
+}
+
+function buildMagnitude(expression) {
+  if (!expression) return {}
+  return {
+    a_digits: countDigits(expression.a),
+    b_digits: countDigits(expression.b)
+  }
+}
+
+function countDigits(value) {
+  const numeric = Math.abs(Number(value))
+  if (!Number.isFinite(numeric)) return 1
+  const text = numeric.toString().replace('.', '')
+  return Math.max(1, text.length)
+}
+
+function estimateExpressionLevel(type, a, b) {
+  const maxDigits = Math.max(countDigits(a), countDigits(b))
+  const usesDecimals = !Number.isInteger(a) || !Number.isInteger(b)
+
+  if (usesDecimals) {
+    if (type === 'addition' || type === 'subtraction') return 9
+    if (type === 'multiplication') return 10
+    if (type === 'division') return 11
+    return 9
+  }
+
+  if (type === 'addition' || type === 'subtraction') {
+    if (maxDigits <= 1) return 2
+    if (maxDigits === 2) return 6
+    if (maxDigits === 3) return 11
+    return 12
+  }
+  if (type === 'multiplication') {
+    if (maxDigits <= 1) return 4
+    if (maxDigits === 2) return 8
+    return 11
+  }
+  if (type === 'division') {
+    if (maxDigits <= 2) return 5
+    if (maxDigits === 3) return 8
+    return 10
+  }
+  return 6
+}
+
+function estimateDefaultLevel(ncmCode) {
+  if (ncmCode.startsWith('AS1')) return 6
+  if (ncmCode.startsWith('AS2')) return 6
+  if (ncmCode.startsWith('AS3')) return 7
+  if (ncmCode.startsWith('AS4')) return 8
+  if (ncmCode.startsWith('AS5')) return 8
+  if (ncmCode.startsWith('AS6')) return 9
+  if (ncmCode.startsWith('AS7')) return 10
+  if (ncmCode.startsWith('AS8')) return 9
+  if (ncmCode.startsWith('AS9')) return 10
+  if (ncmCode.startsWith('AS10')) return 11
+  if (ncmCode.startsWith('AS11')) return 11
+  if (ncmCode.startsWith('RP')) return 10
+  if (ncmCode.startsWith('SA')) return 9
+  return 6
+}
+
+export function estimatePromptTimeSec(questionText) {
+  const textLength = String(questionText || '').trim().length
+  const words = String(questionText || '').trim().split(/\s+/).filter(Boolean).length
+  if (textLength <= 16 && words <= 3) return 18
+  if (words <= 8) return 24
+  if (words <= 18) return 34
+  return 44
+}
+
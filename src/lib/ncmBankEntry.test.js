@@ -0,0 +1,42 @@
+import { describe, expect, it } from 'vitest'
+import safeAsExpressions from '../../NMC/processed/safe_batch_as_expressions.json'
+import safeAsExpressionExtra from '../../NMC/processed/safe_batch_as_expression_extra.json'
+import safeAsWordProblems from '../../NMC/processed/safe_batch_as_word_problems.json'
+import safeCrossDomainWordNumeric from '../../NMC/processed/safe_batch_cross_domain_word_numeric.json'
+import { toBankEntry } from './ncmBankEntry'
+import { NCM_SAFE_PROBLEM_BANK } from './ncmProblemBank'
+
+describe('ncmBankEntry', () => {
+  it('matches the entries precomputed by the extraction pipeline', () => {
+    const derived = [safeAsExpressions, safeAsExpressionExtra, safeAsWordProblems, safeCrossDomainWordNumeric]
+      .flatMap(batch => batch)
+      .map(toBankEntry)
+      .filter(Boolean)
+
+    expect(derived.length).toBeGreaterThan(0)
+    expect(NCM_SAFE_PROBLEM_BANK).toEqual(derived)
+  })
+
+  it('derives operands, level and skill tag from an expression row', () => {
+    const entry = toBankEntry({
+      ncm_code: 'as9',
+      item_no: 3,
+      question_text: '4,5 − 1,25',
+      expected_answer: '3,25',
+      operation_tag: '',
+      ncm_domain_tag: 'arithmetic',
+      ability_tags: 'ncm_arithmetic|concept_decimal'
+    })
+
+    expect(entry).toMatchObject({
+      ncmCode: 'AS9',
+      expectedAnswer: 3.25,
+      type: 'subtraction',
+      operationTag: 'subtraction',
+      values: { a: 4.5, b: 1.25 },
+      magnitude: { a_digits: 2, b_digits: 3 },
+      level: 9,
+      skillTag: 'ncm_as9_item_3'
+    })
+  })
+})
@@ -1,17 +1,8 @@
-import safeAsExpressions from '../../NMC/processed/safe_batch_as_expressions.json'
-import safeAsExpressionExtra from '../../NMC/processed/safe_batch_as_expression_extra.json'
-import safeAsWordProblems from '../../NMC/processed/safe_batch_as_word_problems.json'
-import safeCrossDomainWordNumeric from '../../NMC/processed/safe_batch_cross_domain_word_numeric.json'
+import ncmProblemBankEntries from '../../NMC/processed/ncm_problem_bank.json'
+import ncmProblemIndex from '../../NMC/processed/ncm_problem_index.json'
+import { estimatePromptTimeSec } from './ncmBankEntry'
 import { getNcmDomainLabelSv, getNcmOperationLabelSv, normalizeNcmCode } from './ncmSkillMap'
 
-const KNOWN_OPERATIONS = new Set(['addition', 'subtraction', 'multiplication', 'division'])
-const SAFE_BATCHES = [
-  safeAsExpressions,
-  safeAsExpressionExtra,
-  safeAsWordProblems,
-  safeCrossDomainWordNumeric
-]
-
 const ABILITY_LABELS_SV = Object.freeze({
   ncm_arithmetic: 'Aritmetik',
   ncm_written_method: 'Skriftlig metod',
@@ -49,13 +40,16 @@ const NCM_CODE_LABELS_SV = Object.freeze({
   SA2: 'SA2 - Sannolikhet/statistik'
 })
 
+// Entries are derived at build time by scripts/nmc_extract_safe_batch.py
+// (same result as toBankEntry() in ./ncmBankEntry over the safe batches).
 export const NCM_SAFE_PROBLEM_BANK = Object.freeze(
-  SAFE_BATCHES
-    .flatMap(batch => (Array.isArray(batch) ? batch : []))
-    .map(toBankEntry)
-    .filter(Boolean)
+  Array.isArray(ncmProblemBankEntries) ? ncmProblemBankEntries : []
 )
 
+// Bank position per row id of ncm_problem_index.json, or null when the index
+// does not cover the bank (then filtering falls back to a full scan).
+const BANK_POSITION_BY_ROW_ID = buildBankPositionByRowId(ncmProblemIndex, NCM_SAFE_PROBLEM_BANK)
+
 export function getNcmCodeOptions() {
   const byCode = new Map()
   for (const item of NCM_SAFE_PROBLEM_BANK) {
@@ -112,6 +106,33 @@ export function getNcmAbilityLabelSv(tag) {
 }
 
 export function filterNcmProblems(filter = {}) {
+  if (!BANK_POSITION_BY_ROW_ID) return scanNcmProblems(filter)
+
+  const postingLists = [
+    unionPostings(ncmProblemIndex.by_code, normalizeCodeList(filter.codes)),
+    unionPostings(ncmProblemIndex.by_domain, normalizeTagList(filter.domainTags)),
+    unionPostings(ncmProblemIndex.by_operation, normalizeTagList(filter.operationTags)),
+    unionPostings(ncmProblemIndex.by_ability_tag, normalizeTagList(filter.abilityTags))
+  ].filter(Boolean)
+  if (postingLists.length === 0) return NCM_SAFE_PROBLEM_BANK.slice()
+
+  postingLists.sort((a, b) => a.length - b.length)
+  let rowIds = postingLists[0]
+  for (let index = 1; index < postingLists.length && rowIds.length > 0; index += 1) {
+    rowIds = intersectSorted(rowIds, postingLists[index])
+  }
+
+  const positions = []
+  for (const rowId of rowIds) {
+    const position = BANK_POSITION_BY_ROW_ID[rowId]
+    if (position !== undefined) positions.push(position)
+  }
+  return positions
+    .sort((a, b) => a - b)
+    .map(position => NCM_SAFE_PROBLEM_BANK[position])
+}
+
+function scanNcmProblems(filter) {
   const codeSet = new Set(normalizeCodeList(filter.codes))
   const abilitySet = new Set(normalizeTagList(filter.abilityTags))
   const domainSet = new Set(normalizeTagList(filter.domainTags))
@@ -207,49 +228,62 @@ export function generateNcmProblemFromEntry(entry, options = {}) {
   }
 }
 
-function toBankEntry(raw) {
-  const ncmCode = normalizeNcmCode(raw?.ncm_code)
-  const questionText = String(raw?.question_text || '').trim()
-  const expectedAnswer = parseNumericAnswer(raw?.expected_answer)
-  if (!ncmCode || !questionText || expectedAnswer === null) return null
-
-  const operationTag = normalizeTag(raw?.operation_tag)
-  const domainTag = normalizeTag(raw?.ncm_domain_tag)
-  const abilityTags = normalizeAbilityTags(raw?.ability_tags)
-  const expression = parseExpression(questionText)
-  const type = resolveOperation(operationTag, abilityTags, expression?.type || '')
-  const level = expression
-    ? estimateExpressionLevel(type, expression.a, expression.b)
-    : estimateDefaultLevel(ncmCode)
-  const magnitude = buildMagnitude(expression)
-  const estimatedTimeSec = estimatePromptTimeSec(questionText)
+function buildBankPositionByRowId(index, bank) {
+  const rows = Array.isArray(index?.rows) ? index.rows : null
+  if (!rows) return null
+
+  const rowIdByKey = new Map(rows.map((row, rowId) => [`${row[0]}:${row[1]}`, rowId]))
+  const domainByRowId = invertPostings(index.by_domain)
+  const operationByRowId = invertPostings(index.by_operation)
+  const positions = new Array(rows.length)
+  for (let position = 0; position < bank.length; position += 1) {
+    const entry = bank[position]
+    const rowId = rowIdByKey.get(`${entry.ncmCode}:${entry.itemNo}`)
+    // Entries the index does not describe exactly (defaulted or inferred tags,
+    // duplicates) would filter differently, so keep scanning in that case.
+    if (rowId === undefined || positions[rowId] !== undefined) return null
+    if (domainByRowId.get(rowId) !== entry.domainTag) return null
+    if (operationByRowId.get(rowId) !== entry.operationTag) return null
+    positions[rowId] = position
+  }
+  return positions
+}
 
-  return {
-    ncmCode,
-    itemNo: Number(raw?.item_no || 0) || 0,
-    questionText,
-    expectedAnswer,
-    operationTag: operationTag || inferOperationTagFromType(type),
-    domainTag: domainTag || 'unknown',
-    abilityTags,
-    type,
-    values: expression ? { a: expression.a, b: expression.b } : {},
-    magnitude,
-    level,
-    estimatedTimeSec,
-    skillTag: `ncm_${ncmCode.toLowerCase()}_item_${Number(raw?.item_no || 0) || 0}`
+function invertPostings(postings) {
+  const valueByRowId = new Map()
+  for (const [value, rowIds] of Object.entries(postings || {})) {
+    for (const rowId of rowIds) valueByRowId.set(rowId, value)
   }
+  return valueByRowId
 }
 
-function normalizeTag(value) {
-  return String(value || '').trim()
+function unionPostings(postings, keys) {
+  if (keys.length === 0) return null
+  if (keys.length === 1) return postings?.[keys[0]] || []
+
+  const merged = new Set()
+  for (const key of keys) {
+    for (const rowId of postings?.[key] || []) merged.add(rowId)
+  }
+  return Array.from(merged).sort((a, b) => a - b)
 }
 
-function normalizeAbilityTags(value) {
-  return String(value || '')
-    .split('|')
-    .map(item => String(item || '').trim())
-    .filter(Boolean)
+function intersectSorted(left, right) {
+  const result = []
+  let i = 0
+  let j = 0
+  while (i < left.length && j < right.length) {
+    if (left[i] === right[j]) {
+      result.push(left[i])
+      i += 1
+      j += 1
+    } else if (left[i] < right[j]) {
+      i += 1
+    } else {
+      j += 1
+    }
+  }
+  return result
 }
 
 function normalizeCodeList(values) {
@@ -264,136 +298,6 @@ function normalizeTagList(values) {
     .filter(Boolean)
 }
 
-function parseNumericAnswer(value) {
-  const normalized = String(value || '')
-    .trim()
-    .replace(/\s+/g, '')
-    .replace(',', '.')
-  if (!/^-?(?:\d+|\d*\.\d+)$/.test(normalized)) return null
-  const number = Number(normalized)
-  return Number.isFinite(number) ? number : null
-}
-
-function parseExpression(text) {
-  const compact = String(text || '').trim()
-  const match = compact.match(/^(-?(?:\d+|\d*[.,]\d+))\s*([+\-−×x*÷/])\s*(-?(?:\d+|\d*[.,]\d+))$/u)
-  if (!match) return null
-
-  const a = parseNumericAnswer(match[1])
-  const b = parseNumericAnswer(match[3])
-  if (a === null || b === null) return null
-
-  const op = match[2]
-  const type = inferTypeFromOperator(op)
-  if (!type) return null
-
-  return { a, b, type }
-}
-
-function inferTypeFromOperator(op) {
-  if (op === '+') return 'addition'
-  if (op === '-' || op === '−') return 'subtraction'
-  if (op === '×' || op === 'x' || op === '*') return 'multiplication'
-  if (op === '÷' || op === '/') return 'division'
-  return ''
-}
-
-function resolveOperation(operationTag, abilityTags = [], expressionType = '') {
-  if (KNOWN_OPERATIONS.has(operationTag)) return operationTag
-  if (expressionType && KNOWN_OPERATIONS.has(expressionType)) return expressionType
-
-  const hasAdd = abilityTags.includes('op_addition')
-  const hasSub = abilityTags.includes('op_subtraction')
-  const hasMul = abilityTags.includes('op_multiplication')
-  const hasDiv = abilityTags.includes('op_division')
-  const operationCount = [hasAdd, hasSub, hasMul, hasDiv].filter(Boolean).length
-
-  if (operationCount === 1) {
-    if (hasAdd) return 'addition'
-    if (hasSub) return 'subtraction'
-    if (hasMul) return 'multiplication'
-    if (hasDiv) return 'division'
-  }
-
-  return 'addition'
-}
-
-function inferOperationTagFromType(type) {
-  if (KNOWN_OPERATIONS.has(type)) return type
-  return 'mixed'
-}
-
-function buildMagnitude(expression) {
-  if (!expression) return {}
-  return {
-    a_digits: countDigits(expression.a),
-    b_digits: countDigits(expression.b)
-  }
-}
-
-function countDigits(value) {
-  const numeric = Math.abs(Number(value))
-  if (!Number.isFinite(numeric)) return 1
-  const text = numeric.toString().replace('.', '')
-  return Math.max(1, text.length)
-}
-
-function estimateExpressionLevel(type, a, b) {
-  const maxDigits = Math.max(countDigits(a), countDigits(b))
-  const usesDecimals = !Number.isInteger(a) || !Number.isInteger(b)
-
-  if (usesDecimals) {
-    if (type === 'addition' || type === 'subtraction') return 9
-    if (type === 'multiplication') return 10
-    if (type === 'division') return 11
-    return 9
-  }
-
-  if (type === 'addition' || type === 'subtraction') {
-    if (maxDigits <= 1) return 2
-    if (maxDigits === 2) return 6
-    if (maxDigits === 3) return 11
-    return 12
-  }
-  if (type === 'multiplication') {
-    if (maxDigits <= 1) return 4
-    if (maxDigits === 2) return 8
-    return 11
-  }
-  if (type === 'division') {
-    if (maxDigits <= 2) return 5
-    if (maxDigits === 3) return 8
-    return 10
-  }
-  return 6
-}
-
-function estimateDefaultLevel(ncmCode) {
-  if (ncmCode.startsWith('AS1')) return 6
-  if (ncmCode.startsWith('AS2')) return 6
-  if (ncmCode.startsWith('AS3')) return 7
-  if (ncmCode.startsWith('AS4')) return 8
-  if (ncmCode.startsWith('AS5')) return 8
-  if (ncmCode.startsWith('AS6')) return 9
-  if (ncmCode.startsWith('AS7')) return 10
-  if (ncmCode.startsWith('AS8')) return 9
-  if (ncmCode.startsWith('AS9')) return 10
-  if (ncmCode.startsWith('AS10')) return 11
-  if (ncmCode.startsWith('AS11')) return 11
-  if (ncmCode.startsWith('RP')) return 10
-  if (ncmCode.startsWith('SA')) return 9
-  return 6
-}
-
-function estimatePromptTimeSec(questionText) {
-  const textLength = String(questionText || '').trim().length
-  const words = String(questionText || '').trim().split(/\s+/).filter(Boolean).length
-  if (textLength <= 16 && words <= 3) return 18
-  if (words <= 8) return 24
-  if (words <= 18) return 34
-  return 44
-}
-
 function clamp(value, min, max) {
   return Math.max(min, Math.min(max, value))
 }
@@ -1,5 +1,6 @@
 import { describe, expect, it } from 'vitest'
 import {
+  NCM_SAFE_PROBLEM_BANK,
   filterNcmProblems,
   generateNcmProblemFromFilter,
   getNcmAbilityOptions,
@@ -30,6 +31,30 @@ describe('ncmProblemBank', () => {
     expect(rows.some(item => item.ncmCode === 'RP5')).toBe(true)
   })
 
+  it('filters through the posting-list index like a full scan', () => {
+    const filters = [
+      { codes: ['AS1', 'RP5'] },
+      { abilityTags: ['concept_decimal', 'concept_percent'] },
+      { operationTags: ['division'], abilityTags: ['concept_decimal'] },
+      { domainTags: ['arithmetic'], codes: ['AS3', 'SA2'] },
+      { codes: ['AS1'], operationTags: ['division'] },
+      {}
+    ]
+    for (const filter of filters) {
+      const codes = new Set(filter.codes || [])
+      const abilities = new Set(filter.abilityTags || [])
+      const domains = new Set(filter.domainTags || [])
+      const operations = new Set(filter.operationTags || [])
+      const expected = NCM_SAFE_PROBLEM_BANK.filter(item =>
+        (codes.size === 0 || codes.has(item.ncmCode))
+        && (domains.size === 0 || domains.has(item.domainTag))
+        && (operations.size === 0 || operations.has(item.operationTag))
+        && (abilities.size === 0 || item.abilityTags.some(tag => abilities.has(tag)))
+      )
+      expect(filterNcmProblems(filter)).toEqual(expected)
+    }
+  })
+
   it('generates playable NCM problems with prompt text metadata', () => {
     const problem = generateNcmProblemFromFilter({ codes: ['AS1'] })
     expect(problem).toBeTruthy()
@@ -0,0 +1,49 @@
+import ncmShardManifest from '../../NMC/processed/shards/manifest.json'
+import { normalizeNcmCode } from './ncmSkillMap'
+
+// Per-code slices of ncm_problem_bank.json, written by
+// scripts/nmc_extract_safe_batch.py. Each shard is its own chunk, so a
+// session only downloads and parses the codes it was assigned.
+const SHARD_DIR = '../../NMC/processed/shards/'
+const SHARD_LOADERS = import.meta.glob(
+  ['../../NMC/processed/shards/*.json', '!../../NMC/processed/shards/manifest.json'],
+  { import: 'default' }
+)
+
+const SHARD_CODES = Object.freeze(Object.keys(ncmShardManifest?.shards || {}))
+const loadedShards = new Map()
+
+export function getNcmShardCodes() {
+  return SHARD_CODES.slice()
+}
+
+export function getNcmShardInfo(code) {
+  const normalized = normalizeNcmCode(code)
+  return (normalized && ncmShardManifest?.shards?.[normalized]) || null
+}
+
+// Entries of the given codes in bank order, the same as
+// filterNcmProblems({ codes }) in ./ncmProblemBank.
+export async function loadNcmProblemsForCodes(codes) {
+  const wanted = new Set(
+    (Array.isArray(codes) ? codes : [])
+      .map(item => normalizeNcmCode(item))
+      .filter(Boolean)
+  )
+  const shards = await Promise.all(SHARD_CODES.filter(code => wanted.has(code)).map(loadShard))
+  return shards.flat()
+}
+
+function loadShard(code) {
+  let pending = loadedShards.get(code)
+  if (!pending) {
+    const loader = SHARD_LOADERS[`${SHARD_DIR}${ncmShardManifest.shards[code].file}`]
+    pending = loader
+      ? loader().then(entries => Object.freeze(Array.isArray(entries) ? entries : []))
+      : Promise.resolve(Object.freeze([]))
+    // A failed import is retried on the next call instead of being cached.
+    pending.catch(() => loadedShards.delete(code))
+    loadedShards.set(code, pending)
+  }
+  return pending
+}
@@ -0,0 +1,25 @@
+import { describe, expect, it } from 'vitest'
+import { NCM_SAFE_PROBLEM_BANK, filterNcmProblems } from './ncmProblemBank'
+import { getNcmShardCodes, getNcmShardInfo, loadNcmProblemsForCodes } from './ncmProblemShards'
+
+describe('ncmProblemShards', () => {
+  it('splits the whole bank into per-code shards', async () => {
+    const codes = getNcmShardCodes()
+    expect(codes).toContain('AS1')
+    expect(await loadNcmProblemsForCodes(codes)).toEqual(NCM_SAFE_PROBLEM_BANK)
+  })
+
+  it('loads only the requested codes, in bank order', async () => {
+    const rows = await loadNcmProblemsForCodes(['rp5', 'AS1', 'AS1'])
+    expect(rows).toEqual(filterNcmProblems({ codes: ['AS1', 'RP5'] }))
+    expect(rows.length).toBe(getNcmShardInfo('AS1').entries + getNcmShardInfo('RP5').entries)
+  })
+
+  it('describes each shard with its tags', async () => {
+    const info = getNcmShardInfo('as9')
+    expect(info.file).toBe('AS9.json')
+    expect(info.ability_tags).toContain('concept_decimal')
+    expect(getNcmShardInfo('ZZ999')).toBeNull()
+    await expect(loadNcmProblemsForCodes(['ZZ999'])).resolves.toEqual([])
+  })
+})